@@ -1,24 +1,38 @@
 import hashlib
 import json
-import os
-import ast
 import re
 import sys
-from dotenv import load_dotenv
+import time
 from functools import wraps
 
-from flask import Flask, g, request, send_from_directory, abort, request_started
+from flask import (Flask, Response, g, request, send_from_directory, abort,
+                   make_response, request_started, stream_with_context,
+                   url_for)
 from flask_cors import CORS
 from flask_restful import Resource
+from flask_restful.utils import unpack
 from flask_restful_swagger_2 import Api, Schema
 from flask_json import FlaskJSON, json_response
 
 from neo4j import GraphDatabase, basic_auth
 
-import os
-from dotenv import load_dotenv
+import metrics
+import queries
+import settings
+from auth_cache import AuthCache
+from graph_cache import GraphVersion, ResponseCache, etag_for
+from ingredient_search import IngredientSearch
+from payloads import (NEIGHBOUR_OVERFETCH, batch_payload, parse_batch,
+                      parse_by_ingredients, parse_neighbours, parse_page,
+                      parse_search, recipe_ingredient_list, serializeIngredient,
+                      serializeRecipe, similar_recipes_payload,
+                      substitutes_payload)
+from recipe_graph import (rank_matches, rank_paths, to_compact_payload,
+                          to_payload)
+from recipe_index import RecipeIndex
+from settings import COMPACT_JSON, MSGPACK, env, msgpack
+from vector_index import VectorIndex
 
-load_dotenv()
 app = Flask(__name__)
 CORS(app)
 FlaskJSON(app)
@@ -30,38 +44,83 @@ api = Api(app, title='Food Knowledge Graph', api_version='0.0.10')
 
 @api.representation('application/json')
 def output_json(data, code, headers=None):
-    return json_response(data_=data, headers_=headers, status_=code)
+    with metrics.ENCODE_SECONDS.labels('application/json').time():
+        return json_response(data_=data, headers_=headers, status_=code)
 
 
-def env(key, default=None, required=True):
+@api.representation(COMPACT_JSON)
+def output_compact_json(data, code, headers=None):
+    with metrics.ENCODE_SECONDS.labels(COMPACT_JSON).time():
+        response = json_response(data_=data, headers_=headers, status_=code)
+    response.mimetype = COMPACT_JSON
+    return response
+
+
+if msgpack is not None:
+    @api.representation(MSGPACK)
+    def output_msgpack(data, code, headers=None):
+        with metrics.ENCODE_SECONDS.labels(MSGPACK).time():
+            body = msgpack.packb(data, use_bin_type=True)
+        response = make_response(body, code)
+        response.headers.extend(headers or {})
+        response.mimetype = MSGPACK
+        return response
+
+
+def wants_compact():
     """
-    Retrieves environment variables and returns Python natives.
+    Whether the client negotiated the compact graph format, as compact JSON
+    or MessagePack.
     """
-    try:
-        value = os.environ[key]
-        return ast.literal_eval(value)
-    except (SyntaxError, ValueError):
-        return value
-    except KeyError:
-        if default or not required:
-            return default
-        raise RuntimeError(
-            "Missing required environment variable '%s'" % key)
-
-
-NEO4J_URI = env('NEO4J_URI')
-NEO4J_USER = env('NEO4J_USER')
-NEO4J_PASSWORD = env('NEO4J_PASSWORD')
+    mediatype = request.accept_mimetypes.best_match(
+        list(api.representations), default='application/json')
+    return mediatype in (COMPACT_JSON, MSGPACK)
+
 
 driver = GraphDatabase.driver(
-    NEO4J_URI, auth=basic_auth(NEO4J_USER, str(NEO4J_PASSWORD)))
+    settings.NEO4J_URI,
+    auth=basic_auth(settings.NEO4J_USER, str(settings.NEO4J_PASSWORD)))
+metrics.POOLS.add('sync', driver)
 
 app.config['SECRET_KEY'] = env('SECRET_KEY')
 
+# Optional in-memory engine for /recipes/by-ingredients
+recipe_index = None
+if settings.RECIPE_INDEX:
+    recipe_index = RecipeIndex(
+        driver, refresh_interval=settings.RECIPE_INDEX_REFRESH_SECONDS)
+    recipe_index.start()
+
+RECIPE_SCORING_PUSHDOWN = settings.RECIPE_SCORING_PUSHDOWN
+
+# API key -> user, so authenticated requests skip the user lookup
+auth_cache = AuthCache(
+    max_size=settings.AUTH_CACHE_SIZE, ttl=settings.AUTH_CACHE_TTL_SECONDS,
+    negative_ttl=settings.AUTH_CACHE_NEGATIVE_TTL_SECONDS)
+
+# Read responses are cached until GraphBuilder bumps the graph version
+graph_version = GraphVersion(driver, ttl=settings.GRAPH_VERSION_TTL_SECONDS)
+response_cache = ResponseCache(max_size=settings.RESPONSE_CACHE_SIZE)
+
+# In-memory prefix index behind /ingredients/search
+ingredient_search = IngredientSearch(
+    driver, graph_version,
+    refresh_interval=settings.INGREDIENT_SEARCH_REFRESH_SECONDS)
+
+# Optional memory-mapped vectors behind /ingredients/<id>/substitutes and
+# /recipes/<id>/similar
+ingredient_vectors = None
+if settings.INGREDIENT_VECTORS:
+    ingredient_vectors = VectorIndex(settings.INGREDIENT_VECTORS)
+recipe_vectors = None
+if settings.RECIPE_VECTORS:
+    recipe_vectors = VectorIndex(settings.RECIPE_VECTORS)
+
 
 def get_db():
     if not hasattr(g, 'neo4j_db'):
         g.neo4j_db = driver.session()
+        metrics.SESSIONS.inc()
     return g.neo4j_db
 
 
@@ -69,6 +128,22 @@ def get_db():
 def close_db(error):
     if hasattr(g, 'neo4j_db'):
         g.neo4j_db.close()
+        metrics.SESSIONS.dec()
+
+
+def start_timer(sender, **extra):
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def observe_request(response):
+    # Streamed bodies are timed up to their headers and not sized
+    metrics.observe_response(
+        request.endpoint or 'unmatched', request.method,
+        response.status_code,
+        time.perf_counter() - g.get('request_start', time.perf_counter()),
+        None if response.is_streamed else response.content_length)
+    return response
 
 
 def set_user(sender, **extra):
@@ -83,21 +158,26 @@ def set_user(sender, **extra):
     token = match.group(1)
 
     def get_user_by_token(tx, token):
-        return tx.run(
-            '''
-            MATCH (user:User {api_key: $api_key}) RETURN user
-            ''', {'api_key': token}
-        ).single()
+        records = metrics.fetch(tx, queries.USER_BY_API_KEY, api_key=token)
+        return records[0] if records else None
 
-    db = get_db()
-    result = db.read_transaction(get_user_by_token, token)
-    try:
-        g.user = result['user']
-    except (KeyError, TypeError):
+    found, user = auth_cache.get(token)
+    if not found:
+        db = get_db()
+        result = db.read_transaction(get_user_by_token, token)
+        try:
+            user = result['user']
+        except (KeyError, TypeError):
+            user = None
+        auth_cache.set(token, user)
+
+    if user is None:
         abort(401, 'invalid authorization key')
+    g.user = user
     return
 
 
+request_started.connect(start_timer, app)
 request_started.connect(set_user, app)
 
 
@@ -110,6 +190,47 @@ def login_required(f):
         return f(*args, **kwargs)
     return wrapped
 
+
+def cached_by_graph_version(f):
+    """
+    Caches successful responses per endpoint and arguments for the current
+    graph version, and answers a matching `If-None-Match` with 304.
+    Responses are not cached while the graph has no version stamp.
+    """
+    @wraps(f)
+    def wrapped(*args, **kwargs):
+        version = graph_version.get()
+        if version is None or wants_stream():
+            return f(*args, **kwargs)
+
+        mediatype = request.accept_mimetypes.best_match(
+            list(api.representations), default='application/json')
+        key = (request.endpoint, tuple(sorted(kwargs.items())),
+               request.query_string, mediatype)
+        etag = etag_for(version, key)
+        headers = {
+            'ETag': f'"{etag}"',
+            'Cache-Control': 'no-cache',
+            'Vary': 'Accept'
+        }
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers=headers)
+
+        entry = response_cache.get(version, key)
+        if entry is None:
+            result = f(*args, **kwargs)
+            if isinstance(result, Response):
+                return result
+            data, code, extra_headers = unpack(result)
+            if code != 200:
+                return result
+            entry = (data, extra_headers or {})
+            response_cache.set(version, key, entry)
+
+        data, extra_headers = entry
+        return data, 200, dict(extra_headers, **headers)
+    return wrapped
+
 ########## MODELS ##########
 
 
@@ -144,23 +265,6 @@ class RecipeModel(Schema):
 ########## JSON SERIALIZATION ##########
 
 
-def serializeIngredient(ingredient):
-    return {
-        'id': ingredient['id'],
-        'name': ingredient['name'],
-        'category': ingredient['category'],
-    }
-
-
-def serializeRecipe(recipe):
-    return {
-        'id': recipe['id'],
-        'name': recipe['name'],
-        'url': recipe['url'],
-        'totalTime': recipe['totalTime']
-    }
-
-
 def hash_password(username, password):
     if sys.version[0] == 2:
         s = '{}:{}'.format(username, password)
@@ -168,6 +272,52 @@ def hash_password(username, password):
         s = '{}:{}'.format(username, password).encode('utf-8')
     return hashlib.sha256(s).hexdigest()
 
+########## PAGINATION ##########
+
+
+def wants_stream():
+    return request.args.get('stream') == 'true' or \
+        request.accept_mimetypes.best == 'application/x-ndjson'
+
+
+def list_nodes(label, returns, serialize):
+    """
+    Lists the nodes of `label` ordered by id. With `limit` and/or `after`
+    only one keyset page is returned, with a `Link` header to the next one.
+    With `stream=true` or an NDJSON `Accept` header, records are written to
+    the client as they are read from the driver.
+    """
+    after = request.args.get('after')
+    limit, error = parse_page(request.args.get('limit', type=int), after)
+    if error:
+        return {'message': error}, 400
+
+    query = queries.list_nodes_query(label, returns, after, limit)
+    params = {'after': after, 'limit': limit}
+
+    db = get_db()
+    if wants_stream():
+        def generate():
+            # Auto-commit results are pulled lazily from the driver
+            start, rows = time.perf_counter(), 0
+            for record in db.run(query, params):
+                rows += 1
+                yield json.dumps(serialize(record)) + '\n'
+            metrics.observe_query(query, start, rows)
+        return Response(stream_with_context(generate()),
+                        mimetype='application/x-ndjson')
+
+    results = db.read_transaction(
+        lambda tx: metrics.fetch(tx, query, **params))
+    items = [serialize(record) for record in results]
+
+    headers = {}
+    if limit is not None and len(items) == limit:
+        next_page = url_for(
+            request.endpoint, limit=limit, after=items[-1]['id'])
+        headers['Link'] = f'<{next_page}>; rel="next"'
+    return items, 200, headers
+
 ########## API ##########
 
 
@@ -179,191 +329,223 @@ class ApiDocs(Resource):
 
 
 class IngredientList(Resource):
+    method_decorators = [cached_by_graph_version]
+
     def get(self):
-        db = get_db()
-        results = db.read_transaction(lambda tx: list(tx.run(
-            'MATCH (i:Ingredient) RETURN ID(i) as id, i.name as name, i.category as category')))
-        return [serializeIngredient(record) for record in results]
+        return list_nodes(
+            'Ingredient', queries.INGREDIENT_FIELDS, serializeIngredient)
 
 
 class Ingredient(Resource):
+    method_decorators = [cached_by_graph_version]
+
     def get(self, id):
         db = get_db()
-        result = db.read_transaction(
-            lambda tx: tx.run(
-                'MATCH (i:Ingredient) WHERE id(i) = $id RETURN ID(i) as id, i.name as name, i.category as category',
-                id=id).single())
-        if result:
-            return serializeIngredient(result)
+        results = db.read_transaction(
+            lambda tx: metrics.fetch(tx, queries.INGREDIENT, id=id))
+        if results:
+            return serializeIngredient(results[0])
         return {'message': 'Ingredient not found'}, 404
 
 
 class IngredientListByRecipe(Resource):
+    method_decorators = [cached_by_graph_version]
+
     def get(self, id):
         db = get_db()
         results = db.read_transaction(
-            lambda tx: tx.run(
-                '''
-                MATCH c=(r:Recipe)-[rel:CONTAINS]->(i:Ingredient)
-                WHERE ID(r) = $id
-                RETURN c, rel.quantity AS quantity, rel.measure AS measure
-                ''', id=id).data())
+            lambda tx: metrics.fetch(tx, queries.RECIPE_INGREDIENTS, id=id))
+        return recipe_ingredient_list(
+            [record.data() for record in results])
+
+
+class RecipeList(Resource):
+    method_decorators = [cached_by_graph_version]
+
+    def get(self):
+        return list_nodes(
+            'Recipe', queries.RECIPE_FIELDS, serializeRecipe)
 
-        if not results:
-            return {'message': 'Recipe not found'}, 404
 
-        recipe = results[0]['c'][0]['name']
-        ingredient_list = []
+class Recipe(Resource):
+    method_decorators = [cached_by_graph_version]
 
+    def get(self, id):
+        db = get_db()
+        results = db.read_transaction(
+            lambda tx: metrics.fetch(tx, queries.RECIPE, id=id))
         if results:
-            for item in results:
-                c_array = item['c']
-                quantity = item['quantity']
-                measure = item['measure']
-
-                # Extract node and relationship information
-                if c_array[0]['name'] != recipe:
-                    return {'message': 'Multiple recipes found'}, 500
-                relationship = {}
-                relationship['quantity'] = quantity
-                relationship['measure'] = measure if measure != '<unit>' else ''
-                ingredient = c_array[2]
-
-                link = {'ingredient': ingredient,
-                        'relationship': relationship}
-
-                # Add nodes to nodeItemMap if not already present
-                ingredient_list.append(link)
-
-        return {
-            'ingredient_list': ingredient_list
-        }
+            return serializeRecipe(results[0])
+        return {'message': 'Recipe not found'}, 404
 
 
-class RecipeList(Resource):
+class IngredientListByPrefix(Resource):
     def get(self):
-        db = get_db()
-        results = db.read_transaction(lambda tx: list(tx.run(
-            'MATCH (r:Recipe) RETURN ID(r) as id, r.name as name, r.url as url, r.totalTime as totalTime')))
-        return [serializeRecipe(record) for record in results]
+        """
+        Typeahead search over ingredient names. Returns the ingredients with a
+        word starting with `q`, those in the most recipes first.
+        """
+        q = request.args.get('q')
+        limit, error = parse_search(q, request.args.get('limit', type=int))
+        if error:
+            return {'message': error}, 400
+        return ingredient_search.search(q, limit)
+
+
+def get_substitutes(tx, id, limit):
+    if id not in ingredient_vectors:
+        # Not embedded: unknown, or no in-vocab token at export time
+        if metrics.fetch(tx, queries.INGREDIENT, id=id):
+            return []
+        return {'message': 'Ingredient not found'}, 404
 
+    neighbours = ingredient_vectors.nearest(id, limit * NEIGHBOUR_OVERFETCH)
+    nodes = metrics.fetch(
+        tx, queries.BATCH_INGREDIENTS, ids=[id for id, _ in neighbours])
+    return substitutes_payload(neighbours, nodes, limit)
+
+
+class IngredientSubstitutes(Resource):
+    method_decorators = [cached_by_graph_version]
 
-class Recipe(Resource):
     def get(self, id):
+        """
+        Returns the ingredients closest to this one in the Word2Vec space,
+        most similar first.
+        """
+        if ingredient_vectors is None:
+            return {'message': 'Ingredient vectors are not configured'}, 503
+        limit, error = parse_neighbours(request.args.get('limit', type=int))
+        if error:
+            return {'message': error}, 400
+
         db = get_db()
-        result = db.read_transaction(
-            lambda tx: tx.run(
-                'MATCH (r:Recipe) WHERE id(r) = $id RETURN ID(r) as id, r.name as name, r.url as url, r.totalTime as totalTime',
-                id=id).single())
-        if result:
-            return serializeRecipe(result)
+        return db.read_transaction(get_substitutes, id, limit)
+
+
+def get_similar_recipes(tx, id, limit):
+    if id not in recipe_vectors:
+        # Not embedded: unknown, or no embedded ingredient at export time
+        if metrics.fetch(tx, queries.RECIPE, id=id):
+            return []
         return {'message': 'Recipe not found'}, 404
 
+    neighbours = recipe_vectors.nearest(id, limit * NEIGHBOUR_OVERFETCH)
+    nodes = metrics.fetch(
+        tx, queries.BATCH_RECIPES, ids=[id for id, _ in neighbours])
+    return similar_recipes_payload(neighbours, nodes, limit)
+
+
+class SimilarRecipes(Resource):
+    method_decorators = [cached_by_graph_version]
+
+    def get(self, id):
+        """
+        Returns the recipes whose ingredients are closest to this one's in
+        the Word2Vec space, most similar first.
+        """
+        if recipe_vectors is None:
+            return {'message': 'Recipe vectors are not configured'}, 503
+        limit, error = parse_neighbours(request.args.get('limit', type=int))
+        if error:
+            return {'message': error}, 400
+
+        db = get_db()
+        return db.read_transaction(get_similar_recipes, id, limit)
+
 
 class RecipeListByIngredient(Resource):
+    method_decorators = [cached_by_graph_version]
+
     def get(self, id):
         db = get_db()
         results = db.read_transaction(
-            lambda tx: list(tx.run(
-                '''
-                MATCH (i:Ingredient)<-[:CONTAINS]-(r:Recipe)
-                WHERE id(i) = $id
-                RETURN ID(r) as id, r.name as name, r.url as url, r.totalTime as totalTime
-                ''', id=id)))
+            lambda tx: metrics.fetch(tx, queries.INGREDIENT_RECIPES, id=id))
         if results:
             return [serializeRecipe(record) for record in results]
         return {'message': 'Ingredient not found'}, 404
 
 
+def get_matched_recipes(tx, ingredient_ids, top_k):
+    ingredients = metrics.fetch(
+        tx, queries.MATCHED_INGREDIENTS, ingredientIds=ingredient_ids)
+    matches = metrics.fetch(
+        tx, queries.matched_recipes_query(top_k),
+        ingredientIds=ingredient_ids, topK=top_k)
+
+    with metrics.SCORE_SECONDS.labels('pushdown').time():
+        return rank_matches(
+            [record.values() for record in ingredients],
+            [record.data() for record in matches])
+
+
 class RecipesByMultipleIngredients(Resource):
     def post(self):
-        ingredient_ids = request.json.get('ingredientIds')
-
-        if not ingredient_ids:
-            return {'message': 'No ingredient IDs provided'}, 400
+        ingredient_ids, top_k, error = parse_by_ingredients(request.json)
+        if error:
+            return {'message': error}, 400
+
+        serialize = to_compact_payload if wants_compact() else to_payload
+
+        if recipe_index is not None and recipe_index.ready:
+            with metrics.SCORE_SECONDS.labels('index').time():
+                graph = recipe_index.search(ingredient_ids, top_k)
+        elif RECIPE_SCORING_PUSHDOWN:
+            graph = get_db().read_transaction(
+                get_matched_recipes, ingredient_ids, top_k)
+        else:
+            result = get_db().read_transaction(lambda tx: metrics.fetch(
+                tx, queries.PATHS_BY_INGREDIENTS, ingredientIds=ingredient_ids))
+            with metrics.SCORE_SECONDS.labels('paths').time():
+                graph = rank_paths(
+                    [record.data() for record in result], top_k)
+
+        with metrics.ENCODE_SECONDS.labels(serialize.__name__).time():
+            return serialize(graph)
+
+
+def get_batch(tx, ids):
+    return batch_payload(
+        ids,
+        metrics.fetch(tx, queries.BATCH_RECIPES, ids=ids['recipeIds']),
+        metrics.fetch(tx, queries.BATCH_INGREDIENTS, ids=ids['ingredientIds']),
+        metrics.fetch(tx, queries.BATCH_RECIPE_INGREDIENTS,
+                      ids=ids['recipeIngredientIds']))
+
+
+class Batch(Resource):
+    def post(self):
+        """
+        Resolves many recipes, ingredients and recipe ingredient lists in one
+        request, with one UNWIND query per kind.
+        """
+        ids, error = parse_batch(request.json)
+        if error:
+            return {'message': error}, 400
 
         db = get_db()
+        return db.read_transaction(get_batch, ids)
 
-        query = """
-        MATCH p=(ingredient:Ingredient)-[:PART_OF]->(recipe:Recipe)
-        WHERE ID(ingredient) in $ingredientIds
-        RETURN ID(recipe), p
-        """
-        result = db.read_transaction(lambda tx: tx.run(
-            query, ingredientIds=ingredient_ids).data())
-
-        recipe_node_item_map = {}
-        ingredient_node_item_map = {}
-        link_item_map = {}
-        recipe_score = {}
-
-        # return the top recipes
-        for item in result:
-            id = item['ID(recipe)']
-            p_array = item['p']
-
-            # Extract node and relationship information
-            ingredient = p_array[0]
-            relationship_type = p_array[1]
-            recipe = p_array[2]
-
-            # Add nodes to nodeItemMap if not already present
-            if ingredient['name'] not in ingredient_node_item_map:
-                ingredient['type'] = 'ingredient'
-                ingredient_node_item_map[ingredient['name']
-                                         ] = ingredient
-            if recipe['name'] not in recipe_node_item_map:
-                recipe['type'] = 'recipe'
-                recipe['id'] = id
-                recipe_node_item_map[recipe['name']] = recipe
-
-            link_id = f"{ingredient['name']}_{relationship_type}_{recipe['name']}"
-            link_item_map[link_id] = {
-                'source': ingredient['name'],
-                'target': recipe['name'],
-                'relationship': relationship_type
-            }
-
-            # For each recipe node, store how many times it appears with an ingredient
-            recipe_score[recipe['name']] = recipe_score.get(
-                recipe['name'], 0) + 1
-
-            # Bind this score to the node data
-            recipe_node_item_map[recipe['name']
-                                 ]['score'] = recipe_score[recipe['name']]
-
-        top_recipes = sorted(recipe_score.items(),
-                             key=lambda x: x[1], reverse=True)
-        # Get the first quartile of the scores
-        q1 = top_recipes[int(len(top_recipes) * 0.25)][1]
-
-        # Filter out the recipe nodes with scores less than this
-        recipe_node_item_map = {
-            k: v for k, v in recipe_node_item_map.items()
-            if v.get('score', 0) > q1}
-
-        # Filter out the links based on nodes
-        link_item_map = {
-            k: v for k, v in link_item_map.items()
-            if v['source'] in ingredient_node_item_map and
-            v['target'] in recipe_node_item_map}
-
-        return {
-            'recipeNodes': json.dumps(recipe_node_item_map),
-            'ingredientNodes': json.dumps(ingredient_node_item_map),
-            'links': list(link_item_map.values()),
-            'topRecipes': top_recipes[:min(10, len(recipe_node_item_map))]
-        }
+
+@app.route('/metrics')
+def metrics_endpoint():
+    body, content_type = metrics.exposition()
+    return Response(body, content_type=content_type)
 
 
 ########## LINKING ##########
 api.add_resource(IngredientList, '/ingredients')
-api.add_resource(Ingredient, '/ingredients/<int:id>')
+api.add_resource(IngredientListByPrefix, '/ingredients/search')
+api.add_resource(Ingredient, '/ingredients/<id>')
 api.add_resource(IngredientListByRecipe,
-                 '/recipes/<int:id>/ingredients')
+                 '/recipes/<id>/ingredients')
 api.add_resource(RecipeList, '/recipes')
-api.add_resource(Recipe, '/recipes/<int:id>')
+api.add_resource(Recipe, '/recipes/<id>')
 api.add_resource(RecipeListByIngredient,
-                 '/ingredients/<int:id>/recipes')
+                 '/ingredients/<id>/recipes')
+api.add_resource(IngredientSubstitutes,
+                 '/ingredients/<id>/substitutes')
+api.add_resource(SimilarRecipes, '/recipes/<id>/similar')
 api.add_resource(RecipesByMultipleIngredients,
                  '/recipes/by-ingredients')
+api.add_resource(Batch, '/batch')
@@ -0,0 +1,547 @@
+'''
+ASGI serving mode. Serves the same resources as the Flask app in `app.py`
+on the async Neo4j driver, so a worker keeps serving other requests while
+it waits on the database:
+
+    gunicorn -k uvicorn.workers.UvicornWorker asgi:app
+
+Settings, serializers and cache keys are shared with the Flask app through
+`settings` and `payloads`, so the same URL gets the same body, ETag and
+caching behaviour in either mode. This module does not import `app`: its
+caches, indexes and driver are its own, and all reads go through the async
+driver.
+'''
+import json
+import re
+import time
+from contextlib import asynccontextmanager
+from functools import wraps
+from urllib.parse import urlencode
+
+from flask_restful.utils import unpack
+from neo4j import AsyncGraphDatabase, basic_auth
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header, parse_etags
+
+import metrics
+import payloads
+import queries
+import settings
+from auth_cache import AuthCache
+from graph_cache import AsyncGraphVersion, ResponseCache, etag_for
+from ingredient_search import AsyncIngredientSearch
+from recipe_graph import (rank_matches, rank_paths, to_compact_payload,
+                          to_payload)
+from recipe_index import AsyncRecipeIndex
+from settings import COMPACT_JSON, MEDIA_TYPES, MSGPACK, msgpack
+from vector_index import VectorIndex
+
+driver = AsyncGraphDatabase.driver(
+    settings.NEO4J_URI,
+    auth=basic_auth(settings.NEO4J_USER, str(settings.NEO4J_PASSWORD)))
+metrics.POOLS.add('async', driver)
+
+# Optional in-memory engine for /recipes/by-ingredients, started with the app
+recipe_index = None
+if settings.RECIPE_INDEX:
+    recipe_index = AsyncRecipeIndex(
+        driver, refresh_interval=settings.RECIPE_INDEX_REFRESH_SECONDS)
+
+RECIPE_SCORING_PUSHDOWN = settings.RECIPE_SCORING_PUSHDOWN
+
+auth_cache = AuthCache(
+    max_size=settings.AUTH_CACHE_SIZE, ttl=settings.AUTH_CACHE_TTL_SECONDS,
+    negative_ttl=settings.AUTH_CACHE_NEGATIVE_TTL_SECONDS)
+
+graph_version = AsyncGraphVersion(
+    driver, ttl=settings.GRAPH_VERSION_TTL_SECONDS)
+response_cache = ResponseCache(max_size=settings.RESPONSE_CACHE_SIZE)
+
+ingredient_search = AsyncIngredientSearch(
+    driver, graph_version,
+    refresh_interval=settings.INGREDIENT_SEARCH_REFRESH_SECONDS)
+
+ingredient_vectors = None
+if settings.INGREDIENT_VECTORS:
+    ingredient_vectors = VectorIndex(settings.INGREDIENT_VECTORS)
+recipe_vectors = None
+if settings.RECIPE_VECTORS:
+    recipe_vectors = VectorIndex(settings.RECIPE_VECTORS)
+
+
+########## SETUP ##########
+
+
+def accept(request):
+    return parse_accept_header(request.headers.get('Accept'), MIMEAccept)
+
+
+def mediatype(request):
+    return accept(request).best_match(
+        MEDIA_TYPES, default='application/json')
+
+
+def render(request, data, status_code=200, headers=None):
+    """
+    Renders a response body in the media type negotiated with the client,
+    the way the Flask app's representations do.
+    """
+    negotiated = mediatype(request)
+    with metrics.ENCODE_SECONDS.labels(negotiated).time():
+        if negotiated == MSGPACK:
+            return Response(
+                msgpack.packb(data, use_bin_type=True), status_code,
+                headers, media_type=MSGPACK)
+        if isinstance(data, dict):
+            # FlaskJSON adds the status code to object bodies
+            data = dict(data, status=status_code)
+        return JSONResponse(data, status_code, headers, media_type=negotiated)
+
+
+def rendered(handler):
+    """
+    Renders what `handler` returns like Flask-RESTful renders a resource's
+    return value: a body, or a (body, status, headers) tuple. Responses are
+    passed through.
+    """
+    @wraps(handler)
+    async def wrapped(request):
+        result = await handler(request)
+        if isinstance(result, Response):
+            return result
+        data, code, headers = unpack(result)
+        return render(request, data, code, headers)
+    return wrapped
+
+
+def cached_by_graph_version(handler):
+    """
+    Async counterpart of `app.cached_by_graph_version`, with the same cache
+    keys, ETags and headers. Wraps a handler before `rendered`.
+    """
+    @wraps(handler)
+    async def wrapped(request):
+        version = await graph_version.get()
+        if version is None or wants_stream(request):
+            return await handler(request)
+
+        key = (RESOURCE_NAMES.get(request.scope.get('endpoint')),
+               tuple(sorted(request.path_params.items())),
+               request.scope['query_string'], mediatype(request))
+        etag = etag_for(version, key)
+        headers = {
+            'ETag': f'"{etag}"',
+            'Cache-Control': 'no-cache',
+            'Vary': 'Accept'
+        }
+        if parse_etags(request.headers.get('If-None-Match')).contains(etag):
+            return Response(status_code=304, headers=headers)
+
+        entry = response_cache.get(version, key)
+        if entry is None:
+            result = await handler(request)
+            if isinstance(result, Response):
+                return result
+            data, code, extra_headers = unpack(result)
+            if code != 200:
+                return result
+            entry = (data, extra_headers or {})
+            response_cache.set(version, key, entry)
+
+        data, extra_headers = entry
+        return data, 200, dict(extra_headers, **headers)
+    return wrapped
+
+
+def wants_compact(request):
+    return mediatype(request) in (COMPACT_JSON, MSGPACK)
+
+
+def wants_stream(request):
+    return request.query_params.get('stream') == 'true' or \
+        accept(request).best == 'application/x-ndjson'
+
+
+def query_int(request, key):
+    try:
+        return int(request.query_params[key])
+    except (KeyError, ValueError):
+        return None
+
+
+async def json_body(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+async def read(work, *args):
+    metrics.SESSIONS.inc()
+    try:
+        async with driver.session() as session:
+            return await session.execute_read(work, *args)
+    finally:
+        metrics.SESSIONS.dec()
+
+
+async def get_user_by_token(tx, token):
+    records = await metrics.afetch(
+        tx, queries.USER_BY_API_KEY, api_key=token)
+    return records[0] if records else None
+
+
+class MetricsMiddleware:
+    '''
+    Records the latency, status and body size of each request under the
+    same resource names as the Flask app's endpoints.
+    '''
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        response = {'status': 500, 'size': 0}
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+            elif message['type'] == 'http.response.body':
+                response['size'] += len(message.get('body', b''))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            endpoint = scope.get('endpoint')
+            metrics.observe_response(
+                RESOURCE_NAMES.get(endpoint, 'unmatched'), scope['method'],
+                response['status'], time.perf_counter() - start,
+                response['size'])
+
+
+class AuthMiddleware:
+    '''
+    Resolves the `Authorization: Token <key>` header into
+    `request.state.user` like `set_user` does for the Flask app, sharing its
+    API key cache.
+    '''
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        scope.setdefault('state', {})['user'] = {'id': None}
+        headers = dict(scope['headers'])
+        auth_header = headers.get(b'authorization', b'').decode('latin-1')
+        if auth_header:
+            match = re.match(r'^Token (\S+)', auth_header)
+            if not match:
+                response = JSONResponse({
+                    'message':
+                        'invalid authorization format. Follow `Token <token>`',
+                    'status': 401}, 401)
+                return await response(scope, receive, send)
+            token = match.group(1)
+
+            found, user = auth_cache.get(token)
+            if not found:
+                result = await read(get_user_by_token, token)
+                try:
+                    user = result['user']
+                except (KeyError, TypeError):
+                    user = None
+                auth_cache.set(token, user)
+
+            if user is None:
+                response = JSONResponse({
+                    'message': 'invalid authorization key',
+                    'status': 401}, 401)
+                return await response(scope, receive, send)
+            scope['state']['user'] = user
+
+        await self.app(scope, receive, send)
+
+
+########## API ##########
+
+
+async def list_nodes(request, label, returns, serialize):
+    """
+    Async counterpart of `app.list_nodes`, with the same keyset paging and
+    NDJSON streaming.
+    """
+    after = request.query_params.get('after')
+    limit, error = payloads.parse_page(query_int(request, 'limit'), after)
+    if error:
+        return {'message': error}, 400
+
+    query = queries.list_nodes_query(label, returns, after, limit)
+    params = {'after': after, 'limit': limit}
+
+    if wants_stream(request):
+        async def generate():
+            # Auto-commit results are pulled lazily from the driver
+            async with driver.session() as session:
+                start, rows = time.perf_counter(), 0
+                result = await session.run(query, params)
+                async for record in result:
+                    rows += 1
+                    yield json.dumps(serialize(record)) + '\n'
+                metrics.observe_query(query, start, rows)
+        return StreamingResponse(
+            generate(), media_type='application/x-ndjson')
+
+    async def work(tx):
+        return await metrics.afetch(tx, query, **params)
+    items = [serialize(record) for record in await read(work)]
+
+    headers = {}
+    if limit is not None and len(items) == limit:
+        next_page = request.url.path + '?' + urlencode(
+            {'limit': limit, 'after': items[-1]['id']})
+        headers['Link'] = f'<{next_page}>; rel="next"'
+    return items, 200, headers
+
+
+@rendered
+@cached_by_graph_version
+async def ingredient_list(request):
+    return await list_nodes(
+        request, 'Ingredient', queries.INGREDIENT_FIELDS,
+        payloads.serializeIngredient)
+
+
+@rendered
+@cached_by_graph_version
+async def ingredient(request):
+    async def work(tx):
+        return await metrics.afetch(
+            tx, queries.INGREDIENT, id=request.path_params['id'])
+    results = await read(work)
+    if results:
+        return payloads.serializeIngredient(results[0])
+    return {'message': 'Ingredient not found'}, 404
+
+
+@rendered
+@cached_by_graph_version
+async def ingredient_list_by_recipe(request):
+    async def work(tx):
+        return await metrics.afetch(
+            tx, queries.RECIPE_INGREDIENTS, id=request.path_params['id'])
+    return payloads.recipe_ingredient_list(
+        [record.data() for record in await read(work)])
+
+
+@rendered
+@cached_by_graph_version
+async def recipe_list(request):
+    return await list_nodes(
+        request, 'Recipe', queries.RECIPE_FIELDS, payloads.serializeRecipe)
+
+
+@rendered
+@cached_by_graph_version
+async def recipe(request):
+    async def work(tx):
+        return await metrics.afetch(
+            tx, queries.RECIPE, id=request.path_params['id'])
+    results = await read(work)
+    if results:
+        return payloads.serializeRecipe(results[0])
+    return {'message': 'Recipe not found'}, 404
+
+
+@rendered
+async def ingredient_list_by_prefix(request):
+    q = request.query_params.get('q')
+    limit, error = payloads.parse_search(q, query_int(request, 'limit'))
+    if error:
+        return {'message': error}, 400
+    return await ingredient_search.search(q, limit)
+
+
+@rendered
+@cached_by_graph_version
+async def recipe_list_by_ingredient(request):
+    async def work(tx):
+        return await metrics.afetch(
+            tx, queries.INGREDIENT_RECIPES, id=request.path_params['id'])
+    results = await read(work)
+    if results:
+        return [payloads.serializeRecipe(record) for record in results]
+    return {'message': 'Ingredient not found'}, 404
+
+
+async def get_substitutes(tx, id, limit):
+    if id not in ingredient_vectors:
+        if await metrics.afetch(tx, queries.INGREDIENT, id=id):
+            return []
+        return {'message': 'Ingredient not found'}, 404
+
+    neighbours = ingredient_vectors.nearest(
+        id, limit * payloads.NEIGHBOUR_OVERFETCH)
+    nodes = await metrics.afetch(
+        tx, queries.BATCH_INGREDIENTS, ids=[id for id, _ in neighbours])
+    return payloads.substitutes_payload(neighbours, nodes, limit)
+
+
+@rendered
+@cached_by_graph_version
+async def ingredient_substitutes(request):
+    if ingredient_vectors is None:
+        return {'message': 'Ingredient vectors are not configured'}, 503
+    limit, error = payloads.parse_neighbours(query_int(request, 'limit'))
+    if error:
+        return {'message': error}, 400
+
+    return await read(get_substitutes, request.path_params['id'], limit)
+
+
+async def get_similar_recipes(tx, id, limit):
+    if id not in recipe_vectors:
+        if await metrics.afetch(tx, queries.RECIPE, id=id):
+            return []
+        return {'message': 'Recipe not found'}, 404
+
+    neighbours = recipe_vectors.nearest(
+        id, limit * payloads.NEIGHBOUR_OVERFETCH)
+    nodes = await metrics.afetch(
+        tx, queries.BATCH_RECIPES, ids=[id for id, _ in neighbours])
+    return payloads.similar_recipes_payload(neighbours, nodes, limit)
+
+
+@rendered
+@cached_by_graph_version
+async def similar_recipes(request):
+    if recipe_vectors is None:
+        return {'message': 'Recipe vectors are not configured'}, 503
+    limit, error = payloads.parse_neighbours(query_int(request, 'limit'))
+    if error:
+        return {'message': error}, 400
+
+    return await read(get_similar_recipes, request.path_params['id'], limit)
+
+
+async def get_matched_recipes(tx, ingredient_ids, top_k):
+    ingredients = await metrics.afetch(
+        tx, queries.MATCHED_INGREDIENTS, ingredientIds=ingredient_ids)
+    matches = await metrics.afetch(
+        tx, queries.matched_recipes_query(top_k),
+        ingredientIds=ingredient_ids, topK=top_k)
+
+    with metrics.SCORE_SECONDS.labels('pushdown').time():
+        return rank_matches(
+            [record.values() for record in ingredients],
+            [record.data() for record in matches])
+
+
+async def get_paths(tx, ingredient_ids):
+    return await metrics.afetch(
+        tx, queries.PATHS_BY_INGREDIENTS, ingredientIds=ingredient_ids)
+
+
+@rendered
+async def recipes_by_multiple_ingredients(request):
+    ingredient_ids, top_k, error = payloads.parse_by_ingredients(
+        await json_body(request))
+    if error:
+        return {'message': error}, 400
+
+    serialize = to_compact_payload if wants_compact(request) else to_payload
+
+    if recipe_index is not None and recipe_index.ready:
+        with metrics.SCORE_SECONDS.labels('index').time():
+            graph = recipe_index.search(ingredient_ids, top_k)
+    elif RECIPE_SCORING_PUSHDOWN:
+        graph = await read(get_matched_recipes, ingredient_ids, top_k)
+    else:
+        result = await read(get_paths, ingredient_ids)
+        with metrics.SCORE_SECONDS.labels('paths').time():
+            graph = rank_paths([record.data() for record in result], top_k)
+
+    with metrics.ENCODE_SECONDS.labels(serialize.__name__).time():
+        return serialize(graph)
+
+
+async def get_batch(tx, ids):
+    return payloads.batch_payload(
+        ids,
+        await metrics.afetch(tx, queries.BATCH_RECIPES, ids=ids['recipeIds']),
+        await metrics.afetch(
+            tx, queries.BATCH_INGREDIENTS, ids=ids['ingredientIds']),
+        await metrics.afetch(tx, queries.BATCH_RECIPE_INGREDIENTS,
+                             ids=ids['recipeIngredientIds']))
+
+
+@rendered
+async def batch(request):
+    ids, error = payloads.parse_batch(await json_body(request))
+    if error:
+        return {'message': error}, 400
+
+    return await read(get_batch, ids)
+
+
+async def metrics_endpoint(request):
+    body, content_type = metrics.exposition()
+    return Response(body, headers={'Content-Type': content_type})
+
+
+########## LINKING ##########
+
+
+@asynccontextmanager
+async def lifespan(app):
+    refresh = recipe_index.start() if recipe_index is not None else None
+    yield
+    if refresh is not None:
+        refresh.cancel()
+    await driver.close()
+
+
+# Route names match the Flask app's endpoints so metrics line up
+routes = [
+    Route('/ingredients', ingredient_list, name='ingredientlist'),
+    Route('/ingredients/search', ingredient_list_by_prefix,
+          name='ingredientlistbyprefix'),
+    Route('/ingredients/{id}', ingredient, name='ingredient'),
+    Route('/recipes/{id}/ingredients', ingredient_list_by_recipe,
+          name='ingredientlistbyrecipe'),
+    Route('/recipes', recipe_list, name='recipelist'),
+    Route('/recipes/{id}', recipe, name='recipe'),
+    Route('/ingredients/{id}/recipes', recipe_list_by_ingredient,
+          name='recipelistbyingredient'),
+    Route('/ingredients/{id}/substitutes', ingredient_substitutes,
+          name='ingredientsubstitutes'),
+    Route('/recipes/{id}/similar', similar_recipes, name='similarrecipes'),
+    Route('/recipes/by-ingredients', recipes_by_multiple_ingredients,
+          methods=['POST'], name='recipesbymultipleingredients'),
+    Route('/batch', batch, methods=['POST'], name='batch'),
+    Route('/metrics', metrics_endpoint, name='metrics_endpoint'),
+]
+RESOURCE_NAMES = {route.endpoint: route.name for route in routes}
+
+app = Starlette(
+    routes=routes,
+    middleware=[
+        Middleware(MetricsMiddleware),
+        # Echoes the request's origin with `Vary: Origin`, as flask-cors does
+        Middleware(CORSMiddleware, allow_origin_regex='.*',
+                   allow_methods=['*'], allow_headers=['*']),
+        Middleware(AuthMiddleware),
+    ],
+    lifespan=lifespan)
@@ -0,0 +1,43 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class AuthCache:
+    '''
+    Bounded LRU cache of API key -> user for `set_user`. Users expire after
+    `ttl` seconds and unknown keys are remembered as None for `negative_ttl`
+    seconds, so repeated bad keys do not reach the database either.
+    Each worker process has its own cache; the TTLs bound how long a
+    revoked or newly issued key can be served stale.
+    '''
+
+    def __init__(self, max_size=1024, ttl=300, negative_ttl=30):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, api_key):
+        """
+        Returns a (found, user) pair, where user is None for a cached bad key.
+        """
+        with self._lock:
+            entry = self._entries.get(api_key)
+            if entry is None:
+                return False, None
+            user, expires = entry
+            if expires < time.monotonic():
+                del self._entries[api_key]
+                return False, None
+            self._entries.move_to_end(api_key)
+            return True, user
+
+    def set(self, api_key, user):
+        ttl = self.ttl if user is not None else self.negative_ttl
+        with self._lock:
+            self._entries[api_key] = (user, time.monotonic() + ttl)
+            self._entries.move_to_end(api_key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
@@ -0,0 +1,104 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class GraphVersion:
+    '''
+    Reads the version stamp that GraphBuilder bumps on the
+    `(:GraphMeta {name: 'graph'})` node after every write, at most once every
+    `ttl` seconds. The version is None until a builder has stamped the graph.
+    If a read fails, the last known version is kept until the next check.
+    '''
+
+    QUERY = '''
+    MATCH (m:GraphMeta {name: 'graph'})
+    RETURN m.version AS version
+    '''
+
+    def __init__(self, driver, ttl=5):
+        self.driver = driver
+        self.ttl = ttl
+        self._version = None
+        self._checked = 0
+        self._lock = threading.Lock()
+
+    def _due(self):
+        """
+        Whether the caller should read the version now. Only one caller per
+        `ttl` gets True; the others keep using the last known version
+        instead of waiting on the read.
+        """
+        with self._lock:
+            if time.monotonic() - self._checked < self.ttl:
+                return False
+            self._checked = time.monotonic()
+            return True
+
+    def get(self):
+        if self._due():
+            try:
+                with self.driver.session() as session:
+                    result = session.read_transaction(
+                        lambda tx: tx.run(self.QUERY).single())
+                self._version = result['version'] if result else None
+            except Exception as e:
+                print(f"Graph version check failed: {e}")
+        return self._version
+
+
+class AsyncGraphVersion(GraphVersion):
+    '''
+    GraphVersion read through the async Neo4j driver, for the ASGI app.
+    '''
+
+    async def get(self):
+        if self._due():
+            try:
+                async with self.driver.session() as session:
+                    result = await session.execute_read(self._read)
+                self._version = result['version'] if result else None
+            except Exception as e:
+                print(f"Graph version check failed: {e}")
+        return self._version
+
+    async def _read(self, tx):
+        result = await tx.run(self.QUERY)
+        return await result.single()
+
+
+class ResponseCache:
+    '''
+    Bounded LRU of rendered read responses for one graph version. All
+    entries are dropped as soon as a new version is seen.
+    '''
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, version, key):
+        with self._lock:
+            if version != self.version:
+                self._entries.clear()
+                self.version = version
+                return None
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, version, key, entry):
+        with self._lock:
+            if version != self.version:
+                return
+            self._entries[key] = entry
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+def etag_for(version, key):
+    return hashlib.sha1(repr((version, key)).encode('utf-8')).hexdigest()
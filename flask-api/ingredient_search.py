@@ -0,0 +1,155 @@
+import asyncio
+import re
+import threading
+import time
+
+import numpy as np
+
+import queries
+
+
+def normalize(text):
+    return re.sub(r'\s+', ' ', text.lower()).strip()
+
+
+class PrefixIndex:
+    '''
+    Immutable sorted array of the normalized ingredient names and every
+    word-aligned suffix of them, so "sau" finds both "sauce" and
+    "soy sauce". A prefix is two binary searches into `terms`.
+    '''
+
+    def __init__(self, rows):
+        # Positions follow name order, so ties rank alphabetically
+        rows = sorted(rows, key=lambda row: row['name'] or '')
+        self.ids = [row['id'] for row in rows]
+        self.names = [row['name'] for row in rows]
+        self.categories = [row['category'] for row in rows]
+        self.recipe_counts = np.array(
+            [row['recipes'] for row in rows], dtype=np.int64)
+
+        terms = []
+        owners = []
+        for position, name in enumerate(self.names):
+            words = normalize(name or '').split(' ')
+            for start in range(len(words)):
+                terms.append(' '.join(words[start:]))
+                owners.append(position)
+        order = np.argsort(np.array(terms, dtype=str), kind='stable')
+        self.terms = np.array(terms, dtype=str)[order]
+        self.owners = np.array(owners, dtype=np.int64)[order]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, prefix, limit=10):
+        """
+        Returns the ingredients with a word starting with `prefix`, most used
+        first.
+        """
+        prefix = normalize(prefix)
+        start = np.searchsorted(self.terms, prefix, side='left')
+        end = np.searchsorted(self.terms, prefix + '\uffff', side='left')
+        matched = np.unique(self.owners[start:end])
+        counts = self.recipe_counts[matched]
+        if len(matched) > limit:
+            # Only the best `limit`, and ties with the last, need sorting
+            cutoff = np.partition(-counts, limit - 1)[limit - 1]
+            keep = -counts <= cutoff
+            matched = matched[keep]
+            counts = counts[keep]
+        # Most recipes first, then alphabetically
+        matched = matched[np.lexsort((matched, -counts))[:limit]]
+
+        return [
+            {
+                'id': self.ids[i],
+                'name': self.names[i],
+                'category': self.categories[i],
+                'recipeCount': int(self.recipe_counts[i])
+            }
+            for i in matched]
+
+
+class IngredientSearch:
+    '''
+    Serves /ingredients/search from an in-memory PrefixIndex that is rebuilt
+    when the graph version changes, or every `refresh_interval` seconds for
+    graphs without a version stamp. The index is built on first use.
+    '''
+
+    def __init__(self, driver, graph_version, refresh_interval=300):
+        self.driver = driver
+        self.graph_version = graph_version
+        self.refresh_interval = refresh_interval
+        self.index = None
+        self.version = None
+        self.loaded = 0
+        self._lock = threading.Lock()
+
+    def _stale(self, version):
+        if self.index is None or version != self.version:
+            return True
+        return version is None and \
+            time.monotonic() - self.loaded > self.refresh_interval
+
+    def get(self):
+        version = self.graph_version.get()
+        if not self._stale(version):
+            return self.index
+        with self._lock:
+            # Another request may have rebuilt it while we waited
+            if self._stale(version):
+                start = time.time()
+                with self.driver.session() as session:
+                    rows = session.read_transaction(lambda tx: tx.run(
+                        queries.INGREDIENT_SEARCH_ROWS).data())
+                self._swap(PrefixIndex(rows), version, start)
+        return self.index
+
+    def _swap(self, index, version, start):
+        self.index = index
+        self.version = version
+        self.loaded = time.monotonic()
+        print(
+            f"Ingredient search indexed {len(self.index)} ingredients in "
+            f"{time.time() - start:.2f} seconds")
+
+    def search(self, prefix, limit=10):
+        return self.get().search(prefix, limit)
+
+
+class AsyncIngredientSearch(IngredientSearch):
+    '''
+    IngredientSearch for the ASGI app, reading through the async driver and
+    an AsyncGraphVersion. The index is built off the event loop.
+    '''
+
+    def __init__(self, driver, graph_version, refresh_interval=300):
+        super().__init__(driver, graph_version, refresh_interval)
+        # Created on first use, inside the event loop
+        self._rebuild = None
+
+    async def get(self):
+        version = await self.graph_version.get()
+        if not self._stale(version):
+            return self.index
+        if self._rebuild is None:
+            self._rebuild = asyncio.Lock()
+        async with self._rebuild:
+            if self._stale(version):
+                start = time.time()
+                async with self.driver.session() as session:
+                    rows = await session.execute_read(self._rows)
+                index = await asyncio.get_running_loop().run_in_executor(
+                    None, PrefixIndex, rows)
+                self._swap(index, version, start)
+        return self.index
+
+    @staticmethod
+    async def _rows(tx):
+        result = await tx.run(queries.INGREDIENT_SEARCH_ROWS)
+        return await result.data()
+
+    async def search(self, prefix, limit=10):
+        return (await self.get()).search(prefix, limit)
@@ -0,0 +1,158 @@
+import os
+import time
+
+import neo4j
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY,
+                               CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest)
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.multiprocess import MultiProcessCollector
+
+import queries
+
+# Names of the shared Cypher queries, used as the `query` label
+QUERY_NAMES = {
+    value: name.lower() for name, value in vars(queries).items()
+    if name.isupper() and isinstance(value, str)}
+QUERY_NAMES[queries.matched_recipes_query(1)] = 'matched_recipes'
+
+REQUEST_SECONDS = Histogram(
+    'foodkg_request_seconds', 'Request latency by resource.',
+    ['resource', 'method'])
+REQUESTS = Counter(
+    'foodkg_requests_total', 'Requests by resource and status code.',
+    ['resource', 'method', 'status'])
+RESPONSE_BYTES = Histogram(
+    'foodkg_response_bytes', 'Response body size by resource.',
+    ['resource'], buckets=(
+        256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216))
+QUERY_SECONDS = Histogram(
+    'foodkg_query_seconds',
+    'Time to run a Cypher query and read all of its records.', ['query'])
+QUERY_ROWS = Histogram(
+    'foodkg_query_rows', 'Records returned by a Cypher query.', ['query'],
+    buckets=(0, 1, 10, 100, 1000, 10000, 100000, 1000000))
+SCORE_SECONDS = Histogram(
+    'foodkg_score_seconds',
+    'Time spent ranking /recipes/by-ingredients matches in Python.',
+    ['engine'])
+ENCODE_SECONDS = Histogram(
+    'foodkg_encode_seconds',
+    'Time spent serializing and encoding response bodies.', ['step'])
+SESSIONS = Gauge(
+    'foodkg_sessions_in_use', 'Neo4j sessions held by requests.',
+    multiprocess_mode='livesum')
+
+
+def query_name(query):
+    name = QUERY_NAMES.get(query)
+    if name is None and query.startswith('MATCH (n:'):
+        return 'list_' + query[len('MATCH (n:'):query.index(')')].lower()
+    return name or 'other'
+
+
+def observe_query(query, start, rows):
+    name = query_name(query)
+    QUERY_SECONDS.labels(name).observe(time.perf_counter() - start)
+    QUERY_ROWS.labels(name).observe(rows)
+
+
+def fetch(tx, query, **params):
+    """
+    Runs `query` and returns all of its records, recording the query's
+    latency and row count.
+    """
+    start = time.perf_counter()
+    records = list(tx.run(query, params))
+    observe_query(query, start, len(records))
+    return records
+
+
+async def afetch(tx, query, **params):
+    """
+    Async counterpart of `fetch` for the async driver.
+    """
+    start = time.perf_counter()
+    result = await tx.run(query, params)
+    records = [record async for record in result]
+    observe_query(query, start, len(records))
+    return records
+
+
+def observe_response(resource, method, status, seconds, size=None):
+    REQUEST_SECONDS.labels(resource, method).observe(seconds)
+    REQUESTS.labels(resource, method, status).inc()
+    if size is not None:
+        RESPONSE_BYTES.labels(resource).observe(size)
+
+
+# Driver releases whose private pool layout PoolCollector was checked against
+POOL_INTERNALS_VERSIONS = ('5.',)
+
+
+class PoolCollector:
+    '''
+    Reports the connections of this process's Neo4j driver pools by state,
+    labelled with the pid since each worker has its own pools. The driver
+    has no public pool statistics, so this reads its private pool, only on
+    driver versions in POOL_INTERNALS_VERSIONS, and skips drivers whose
+    internals do not match.
+    '''
+
+    def __init__(self):
+        self.drivers = {}
+        self.supported = neo4j.__version__.startswith(POOL_INTERNALS_VERSIONS)
+        if not self.supported:
+            print(
+                f"Neo4j pool metrics are disabled on driver {neo4j.__version__}")
+
+    def add(self, name, driver):
+        self.drivers[name] = driver
+
+    def collect(self):
+        connections = GaugeMetricFamily(
+            'foodkg_pool_connections', 'Neo4j pool connections by state.',
+            labels=['driver', 'pid', 'address', 'state'])
+        size = GaugeMetricFamily(
+            'foodkg_pool_max_size', 'Maximum Neo4j pool size per address.',
+            labels=['driver', 'pid'])
+        pid = str(os.getpid())
+        for name, driver in list(self.drivers.items()):
+            if not self.supported:
+                break
+            pool = getattr(driver, '_pool', None)
+            try:
+                rows = []
+                for address, pooled in list(pool.connections.items()):
+                    in_use = sum(
+                        1 for connection in pooled if connection.in_use)
+                    rows.append((str(address), in_use, len(pooled) - in_use))
+                max_size = pool.pool_config.max_connection_pool_size
+            except (AttributeError, TypeError):
+                continue
+            for address, in_use, idle in rows:
+                connections.add_metric([name, pid, address, 'in_use'], in_use)
+                connections.add_metric([name, pid, address, 'idle'], idle)
+            size.add_metric([name, pid], max_size)
+        yield connections
+        yield size
+
+
+POOLS = PoolCollector()
+REGISTRY.register(POOLS)
+
+
+def exposition():
+    """
+    Renders the metrics in the Prometheus text format. Returns the body and
+    its content type.
+    """
+    registry = REGISTRY
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        # Aggregate the metrics of every gunicorn worker
+        registry = CollectorRegistry()
+        MultiProcessCollector(registry)
+        # Pools are per process, so only the worker serving the scrape is
+        # reported, under its pid
+        registry.register(POOLS)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
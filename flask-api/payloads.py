@@ -0,0 +1,213 @@
+'''
+Serializers and request validation shared by the WSGI app and the ASGI
+app. Everything here is a pure function of its arguments.
+'''
+from settings import RECIPE_TOP_K
+
+
+def serializeIngredient(ingredient):
+    return {
+        'id': ingredient['id'],
+        'name': ingredient['name'],
+        'category': ingredient['category'],
+    }
+
+
+def serializeRecipe(recipe):
+    return {
+        'id': recipe['id'],
+        'name': recipe['name'],
+        'url': recipe['url'],
+        'totalTime': recipe['totalTime']
+    }
+
+
+def serializeRecipeIngredient(ingredient, quantity, measure):
+    return {
+        'ingredient': ingredient,
+        'relationship': {
+            'quantity': quantity,
+            'measure': measure if measure != '<unit>' else ''
+        }
+    }
+
+
+def recipe_ingredient_list(results):
+    """
+    Serializes `(Recipe)-[:CONTAINS]->(Ingredient)` path rows of one recipe.
+    """
+    if not results:
+        return {'message': 'Recipe not found'}, 404
+
+    recipe = results[0]['c'][0]['name']
+    ingredient_list = []
+
+    for item in results:
+        c_array = item['c']
+        quantity = item['quantity']
+        measure = item['measure']
+
+        # Extract node and relationship information
+        if c_array[0]['name'] != recipe:
+            return {'message': 'Multiple recipes found'}, 500
+        ingredient = c_array[2]
+
+        link = serializeRecipeIngredient(ingredient, quantity, measure)
+
+        # Add nodes to nodeItemMap if not already present
+        ingredient_list.append(link)
+
+    return {
+        'ingredient_list': ingredient_list
+    }
+
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def parse_page(limit, after):
+    """
+    Validates the `limit` and `after` keyset parameters. Returns the page
+    size to use, None for an unpaged list, and an error message if any.
+    """
+    if limit is not None and not 0 < limit <= MAX_PAGE_SIZE:
+        return None, f'limit must be between 1 and {MAX_PAGE_SIZE}'
+    if limit is None and after is not None:
+        return DEFAULT_PAGE_SIZE, None
+    return limit, None
+
+
+DEFAULT_SEARCH_LIMIT = 10
+MAX_SEARCH_LIMIT = 100
+
+
+def parse_search(q, limit):
+    """
+    Validates the /ingredients/search parameters. Returns the result limit
+    and an error message if any.
+    """
+    if not q or not q.strip():
+        return None, 'No search query provided'
+    if limit is None:
+        return DEFAULT_SEARCH_LIMIT, None
+    if not 0 < limit <= MAX_SEARCH_LIMIT:
+        return None, f'limit must be between 1 and {MAX_SEARCH_LIMIT}'
+    return limit, None
+
+
+DEFAULT_NEIGHBOURS = 10
+MAX_NEIGHBOURS = 100
+# Neighbours fetched per requested one, so that enough remain after
+# dropping those deleted since the vectors were exported
+NEIGHBOUR_OVERFETCH = 2
+
+
+def parse_neighbours(limit):
+    """
+    Validates the limit of /ingredients/<id>/substitutes and
+    /recipes/<id>/similar. Returns the number of neighbours and an error
+    message if any.
+    """
+    if limit is None:
+        return DEFAULT_NEIGHBOURS, None
+    if not 0 < limit <= MAX_NEIGHBOURS:
+        return None, f'limit must be between 1 and {MAX_NEIGHBOURS}'
+    return limit, None
+
+
+def substitutes_payload(neighbours, ingredients, limit):
+    """
+    Serializes the first `limit` nearest neighbours of an ingredient in
+    similarity order, dropping those no longer in the graph.
+    """
+    ingredients = {record['id']: record for record in ingredients}
+    return [
+        dict(serializeIngredient(ingredients[id]), similarity=similarity)
+        for id, similarity in neighbours if id in ingredients][:limit]
+
+
+def similar_recipes_payload(neighbours, recipes, limit):
+    """
+    Serializes the first `limit` nearest neighbours of a recipe in
+    similarity order, dropping those no longer in the graph.
+    """
+    recipes = {record['id']: record for record in recipes}
+    return [
+        dict(serializeRecipe(recipes[id]), similarity=similarity)
+        for id, similarity in neighbours if id in recipes][:limit]
+
+
+def parse_by_ingredients(body):
+    """
+    Validates a /recipes/by-ingredients body. Returns the ingredient ids,
+    the top-k limit and an error message if any.
+    """
+    body = {} if body is None else body
+    if not isinstance(body, dict):
+        return None, None, 'Request body must be a JSON object'
+    ingredient_ids = body.get('ingredientIds')
+    if not ingredient_ids:
+        return None, None, 'No ingredient IDs provided'
+    if not isinstance(ingredient_ids, list) or not all(
+            isinstance(id, str) for id in ingredient_ids):
+        return None, None, 'ingredientIds must be a list of string ids'
+
+    top_k = body.get('topK', RECIPE_TOP_K)
+    # bool is an int subclass, but true is not a limit
+    if top_k is not None and (
+            isinstance(top_k, bool) or not isinstance(top_k, int) or
+            top_k < 1):
+        return None, None, 'topK must be a positive integer'
+    return ingredient_ids, top_k, None
+
+
+MAX_BATCH_SIZE = 500
+
+
+def batch_payload(ids, recipes, ingredients, recipe_ingredients):
+    """
+    Keys the rows of the three batch queries by the requested ids, with None
+    for ids that were not found.
+    """
+    recipes = {record['id']: serializeRecipe(record) for record in recipes}
+    ingredients = {
+        record['id']: serializeIngredient(record) for record in ingredients}
+
+    ingredient_lists = {}
+    for record in recipe_ingredients:
+        ingredient_lists.setdefault(record['id'], []).append(
+            serializeRecipeIngredient(
+                record['ingredient'], record['quantity'], record['measure']))
+
+    return {
+        'recipes': {
+            str(id): recipes.get(id) for id in ids['recipeIds']},
+        'ingredients': {
+            str(id): ingredients.get(id) for id in ids['ingredientIds']},
+        'recipeIngredients': {
+            str(id): {'ingredient_list': ingredient_lists[id]}
+            if id in ingredient_lists else None
+            for id in ids['recipeIngredientIds']}
+    }
+
+
+def parse_batch(body):
+    """
+    Validates a /batch body. Returns the id lists by key and an error
+    message if any.
+    """
+    body = {} if body is None else body
+    if not isinstance(body, dict):
+        return None, 'Request body must be a JSON object'
+    ids = {}
+    for key in ('recipeIds', 'ingredientIds', 'recipeIngredientIds'):
+        ids[key] = body.get(key) or []
+        if not isinstance(ids[key], list) or not all(
+                isinstance(id, str) for id in ids[key]):
+            return None, f'{key} must be a list of string ids'
+        if len(ids[key]) > MAX_BATCH_SIZE:
+            return None, f'At most {MAX_BATCH_SIZE} {key} per request'
+    if not any(ids.values()):
+        return None, 'No IDs provided'
+    return ids, None
@@ -0,0 +1,99 @@
+'''
+Cypher queries shared by the WSGI app and the ASGI app.
+'''
+
+# Nodes are addressed by the stable `uid` that GraphBuilder assigns, which
+# is unique and indexed, instead of internal ids that change on rebuilds
+INGREDIENT_FIELDS = 'n.uid as id, n.name as name, n.category as category'
+RECIPE_FIELDS = 'n.uid as id, n.name as name, n.url as url, n.totalTime as totalTime'
+
+USER_BY_API_KEY = '''
+MATCH (user:User {api_key: $api_key}) RETURN user
+'''
+
+INGREDIENT = f'MATCH (n:Ingredient {{uid: $id}}) RETURN {INGREDIENT_FIELDS}'
+
+RECIPE = f'MATCH (n:Recipe {{uid: $id}}) RETURN {RECIPE_FIELDS}'
+
+RECIPE_INGREDIENTS = '''
+MATCH c=(r:Recipe {uid: $id})-[rel:CONTAINS]->(i:Ingredient)
+RETURN c, rel.quantity AS quantity, rel.measure AS measure
+'''
+
+INGREDIENT_RECIPES = f'''
+MATCH (i:Ingredient {{uid: $id}})<-[:CONTAINS]-(n:Recipe)
+RETURN {RECIPE_FIELDS}
+'''
+
+INGREDIENT_SEARCH_ROWS = '''
+MATCH (i:Ingredient)
+OPTIONAL MATCH (i)-[p:PART_OF]->(:Recipe)
+RETURN i.uid AS id, i.name AS name, i.category AS category,
+       count(p) AS recipes
+'''
+
+PATHS_BY_INGREDIENTS = '''
+MATCH p=(ingredient:Ingredient)-[:PART_OF]->(recipe:Recipe)
+WHERE ingredient.uid IN $ingredientIds
+RETURN recipe.uid AS recipeId, p
+'''
+
+MATCHED_INGREDIENTS = '''
+MATCH (i:Ingredient)
+WHERE i.uid IN $ingredientIds AND (i)-[:PART_OF]->(:Recipe)
+RETURN i.uid AS id, properties(i) AS props
+'''
+
+# Recipes are scored and cut at the first quartile in the database,
+# so only the kept ones are sent over the wire
+MATCHED_RECIPES = '''
+MATCH (ingredient:Ingredient)-[:PART_OF]->(recipe:Recipe)
+WHERE ingredient.uid IN $ingredientIds
+WITH recipe, count(*) AS score, collect(ingredient.uid) AS ingredients
+ORDER BY score DESC
+WITH collect({recipe: recipe, score: score, ingredients: ingredients}) AS matches
+WITH matches, matches[toInteger(size(matches) * 0.25)].score AS q1
+UNWIND matches AS m
+WITH m WHERE m.score > q1
+RETURN m.recipe.uid AS id, properties(m.recipe) AS recipe,
+       m.score AS score, m.ingredients AS ingredients
+'''
+
+BATCH_RECIPES = f'''
+UNWIND $ids AS id
+MATCH (n:Recipe {{uid: id}})
+RETURN {RECIPE_FIELDS}
+'''
+
+BATCH_INGREDIENTS = f'''
+UNWIND $ids AS id
+MATCH (n:Ingredient {{uid: id}})
+RETURN {INGREDIENT_FIELDS}
+'''
+
+BATCH_RECIPE_INGREDIENTS = '''
+UNWIND $ids AS id
+MATCH (r:Recipe {uid: id})-[rel:CONTAINS]->(i:Ingredient)
+RETURN id, properties(i) AS ingredient,
+       rel.quantity AS quantity, rel.measure AS measure
+'''
+
+
+def list_nodes_query(label, returns, after=None, limit=None):
+    """
+    Lists the nodes of `label`, or one keyset page of them ordered by id
+    when `limit` is given.
+    """
+    query = f'MATCH (n:{label})'
+    if after is not None:
+        query += ' WHERE n.uid > $after'
+    query += f' RETURN {returns}'
+    if limit is not None:
+        query += ' ORDER BY id LIMIT $limit'
+    return query
+
+
+def matched_recipes_query(top_k=None):
+    if top_k is None:
+        return MATCHED_RECIPES
+    return MATCHED_RECIPES + 'LIMIT $topK\n'
@@ -0,0 +1,147 @@
+import json
+from collections import namedtuple
+
+# Scored ingredient/recipe subgraph behind /recipes/by-ingredients.
+# `links` holds (ingredient index, recipe index) pairs into the node lists
+# and `top_recipes` the (name, score) pairs of the best recipes.
+RecipeGraph = namedtuple(
+    'RecipeGraph', ['ingredients', 'recipes', 'links', 'top_recipes'])
+
+
+def rank_paths(rows, top_k=None):
+    """
+    Scores `(Ingredient)-[:PART_OF]->(Recipe)` path rows and keeps the
+    recipes whose score is above the first quartile, or only the `top_k`
+    best of them.
+    """
+    recipe_node_item_map = {}
+    ingredient_node_item_map = {}
+    link_item_map = {}
+    recipe_score = {}
+
+    for item in rows:
+        id = item['recipeId']
+        p_array = item['p']
+
+        # Extract node and relationship information
+        ingredient = p_array[0]
+        recipe = p_array[2]
+
+        # Add nodes to nodeItemMap if not already present
+        if ingredient['name'] not in ingredient_node_item_map:
+            ingredient['type'] = 'ingredient'
+            ingredient_node_item_map[ingredient['name']] = ingredient
+        if recipe['name'] not in recipe_node_item_map:
+            recipe['type'] = 'recipe'
+            recipe['id'] = id
+            recipe_node_item_map[recipe['name']] = recipe
+
+        link_item_map[(ingredient['name'], recipe['name'])] = True
+
+        # For each recipe node, store how many times it appears with an ingredient
+        recipe_score[recipe['name']] = recipe_score.get(
+            recipe['name'], 0) + 1
+
+        # Bind this score to the node data
+        recipe_node_item_map[recipe['name']
+                             ]['score'] = recipe_score[recipe['name']]
+
+    if not recipe_score:
+        return RecipeGraph([], [], [], [])
+
+    top_recipes = sorted(recipe_score.items(),
+                         key=lambda x: x[1], reverse=True)
+    # Get the first quartile of the scores
+    q1 = top_recipes[int(len(top_recipes) * 0.25)][1]
+
+    # Filter out the recipe nodes with scores less than this
+    recipe_node_item_map = {
+        k: v for k, v in recipe_node_item_map.items()
+        if v.get('score', 0) > q1}
+    if top_k is not None:
+        top_names = {name for name, _ in top_recipes[:top_k]}
+        recipe_node_item_map = {
+            k: v for k, v in recipe_node_item_map.items()
+            if k in top_names}
+
+    ingredient_index = {
+        name: i for i, name in enumerate(ingredient_node_item_map)}
+    recipe_index = {name: i for i, name in enumerate(recipe_node_item_map)}
+
+    # Filter out the links based on nodes
+    links = [
+        (ingredient_index[source], recipe_index[target])
+        for source, target in link_item_map
+        if target in recipe_index]
+
+    return RecipeGraph(
+        list(ingredient_node_item_map.values()),
+        list(recipe_node_item_map.values()),
+        links,
+        top_recipes[:min(10, len(recipe_node_item_map))])
+
+
+def rank_matches(ingredients, matches):
+    """
+    Builds a RecipeGraph from matches already scored and cut at the first
+    quartile by Neo4j. `ingredients` are (id, properties) rows of the
+    matched ingredients and `matches` the kept recipes in score order, each
+    with the ids of the selected ingredients it contains.
+    """
+    ingredient_index = {id: i for i, (id, _) in enumerate(ingredients)}
+    recipes = [
+        dict(match['recipe'], type='recipe', id=match['id'],
+             score=match['score'])
+        for match in matches]
+    links = [
+        (ingredient_index[ingredient_id], i)
+        for i, match in enumerate(matches)
+        for ingredient_id in dict.fromkeys(match['ingredients'])]
+
+    return RecipeGraph(
+        [dict(props, type='ingredient') for _, props in ingredients],
+        recipes,
+        links,
+        [(recipe['name'], recipe['score']) for recipe in recipes[:10]])
+
+
+def to_payload(graph):
+    """
+    Serializes a RecipeGraph into the response format the web client reads.
+    """
+    recipe_node_item_map = {
+        recipe['name']: recipe for recipe in graph.recipes}
+    ingredient_node_item_map = {
+        ingredient['name']: ingredient for ingredient in graph.ingredients}
+
+    return {
+        'recipeNodes': json.dumps(recipe_node_item_map),
+        'ingredientNodes': json.dumps(ingredient_node_item_map),
+        'links': [
+            {
+                'source': graph.ingredients[source]['name'],
+                'target': graph.recipes[target]['name'],
+                'relationship': 'PART_OF'
+            }
+            for source, target in graph.links],
+        'topRecipes': graph.top_recipes
+    }
+
+
+def to_compact_payload(graph):
+    """
+    Serializes a RecipeGraph once, with nodes as indexed arrays, links as
+    [ingredient index, recipe index] pairs and top recipes as
+    [recipe index, score] pairs.
+    """
+    recipe_index = {
+        recipe['name']: i for i, recipe in enumerate(graph.recipes)}
+
+    return {
+        'ingredients': graph.ingredients,
+        'recipes': graph.recipes,
+        'links': [[source, target] for source, target in graph.links],
+        'topRecipes': [
+            [recipe_index[name], score]
+            for name, score in graph.top_recipes]
+    }
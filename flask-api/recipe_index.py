@@ -0,0 +1,250 @@
+import asyncio
+import threading
+import time
+
+import numpy as np
+
+from recipe_graph import RecipeGraph
+
+
+# Counts come from the count store, so this is cheap to poll
+COUNTS = '''
+MATCH (i:Ingredient) WITH count(i) AS ingredients
+MATCH (r:Recipe) WITH ingredients, count(r) AS recipes
+MATCH ()-[p:PART_OF]->()
+RETURN ingredients, recipes, count(p) AS links
+'''
+# Property-only edits leave the counts alone but bump the graph version
+VERSION = '''
+MATCH (m:GraphMeta {name: 'graph'})
+RETURN m.version AS version
+'''
+INGREDIENT_ROWS = \
+    'MATCH (i:Ingredient) RETURN i.uid AS id, properties(i) AS props'
+RECIPE_ROWS = 'MATCH (r:Recipe) RETURN r.uid AS id, properties(r) AS props'
+LINK_ROWS = '''
+MATCH (i:Ingredient)-[:PART_OF]->(r:Recipe)
+RETURN i.uid AS ingredient, r.uid AS recipe
+'''
+
+
+def _fingerprint(counts, meta):
+    return tuple(counts) + (meta['version'] if meta else None,)
+
+
+def _graph_fingerprint(tx):
+    return _fingerprint(tx.run(COUNTS).single(), tx.run(VERSION).single())
+
+
+async def _agraph_fingerprint(tx):
+    counts = await (await tx.run(COUNTS)).single()
+    meta = await (await tx.run(VERSION)).single()
+    return _fingerprint(counts, meta)
+
+
+def _positions(ids, keys):
+    """
+    Returns the positions of `keys` in the sorted array `ids`, or -1 for
+    keys that are not in it.
+    """
+    keys = np.array(keys, dtype=str)
+    if not len(ids):
+        return np.full(len(keys), -1, dtype=np.int64)
+    positions = np.minimum(np.searchsorted(ids, keys), len(ids) - 1)
+    return np.where(ids[positions] == keys, positions, -1)
+
+
+def _load_postings(tx):
+    return PostingLists(
+        tx.run(INGREDIENT_ROWS).values(), tx.run(RECIPE_ROWS).values(),
+        tx.run(LINK_ROWS).values())
+
+
+async def _aload_rows(tx):
+    return [await (await tx.run(query)).values()
+            for query in (INGREDIENT_ROWS, RECIPE_ROWS, LINK_ROWS)]
+
+
+class PostingLists:
+    '''
+    Immutable CSR view of the ingredient -> recipe bipartite graph.
+    Nodes are addressed by their position in the sorted uid arrays, and the
+    recipes of ingredient `i` are `indices[indptr[i]:indptr[i + 1]]`.
+    '''
+
+    def __init__(self, ingredients, recipes, links):
+        # Legacy nodes without a uid cannot be addressed
+        ingredients = sorted(
+            (row for row in ingredients if row[0] is not None),
+            key=lambda row: row[0])
+        recipes = sorted(
+            (row for row in recipes if row[0] is not None),
+            key=lambda row: row[0])
+
+        self.ingredient_ids = np.array(
+            [id for id, _ in ingredients], dtype=str)
+        self.recipe_ids = np.array(
+            [id for id, _ in recipes], dtype=str)
+        self.ingredient_props = [props for _, props in ingredients]
+        self.recipe_props = [props for _, props in recipes]
+
+        links = [(ingredient, recipe) for ingredient, recipe in links
+                 if ingredient is not None and recipe is not None]
+        sources = _positions(
+            self.ingredient_ids, [ingredient for ingredient, _ in links])
+        targets = _positions(
+            self.recipe_ids, [recipe for _, recipe in links])
+        # Links are read apart from the nodes, so a concurrent build can add
+        # links to nodes missing from the arrays
+        known = (sources >= 0) & (targets >= 0)
+        sources = sources[known]
+        targets = targets[known]
+        order = np.argsort(sources, kind='stable')
+
+        counts = np.bincount(sources, minlength=len(self.ingredient_ids))
+        self.indptr = np.zeros(len(self.ingredient_ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.indptr[1:])
+        self.indices = targets[order].astype(np.int32)
+
+    def search(self, ingredient_ids, top_k=None):
+        """
+        Scores recipes by how many of the given ingredients they contain and
+        keeps the ones above the first quartile, or the `top_k` best of them,
+        like `rank_paths`.
+        """
+        if not len(self.ingredient_ids):
+            return RecipeGraph([], [], [], [])
+
+        selected = np.unique(np.array(ingredient_ids, dtype=str))
+        positions = _positions(self.ingredient_ids, selected)
+        positions = positions[positions >= 0]
+
+        starts = self.indptr[positions]
+        lengths = self.indptr[positions + 1] - starts
+        positions = positions[lengths > 0]
+        starts = starts[lengths > 0]
+        lengths = lengths[lengths > 0]
+        if not len(positions):
+            return RecipeGraph([], [], [], [])
+
+        # Gather every posting of the selected ingredients in one pass
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        postings = self.indices[offsets + np.arange(lengths.sum())]
+        owners = np.repeat(np.arange(len(positions)), lengths)
+
+        matched, inverse, scores = np.unique(
+            postings, return_inverse=True, return_counts=True)
+        order = np.argsort(-scores, kind='stable')
+        # Get the first quartile of the scores
+        q1 = scores[order[int(len(order) * 0.25)]]
+        kept = order[scores[order] > q1][:top_k]
+
+        kept_index = np.full(len(matched), -1, dtype=np.int64)
+        kept_index[kept] = np.arange(len(kept))
+        targets = kept_index[inverse]
+        links = np.unique(
+            np.stack([owners, targets], axis=1)[targets >= 0], axis=0)
+
+        ingredients = [
+            dict(self.ingredient_props[position], type='ingredient')
+            for position in positions]
+        recipes = [
+            dict(self.recipe_props[matched[i]],
+                 type='recipe',
+                 id=str(self.recipe_ids[matched[i]]),
+                 score=int(scores[i]))
+            for i in kept]
+        top_recipes = [
+            (recipe['name'], recipe['score']) for recipe in recipes[:10]]
+
+        return RecipeGraph(
+            ingredients, recipes, links.tolist(), top_recipes)
+
+
+class RecipeIndex:
+    '''
+    Serves /recipes/by-ingredients from in-memory posting lists instead of
+    streaming every matching path over Bolt. The graph is loaded once and
+    reloaded by a background thread whenever its node or link counts or its
+    version change.
+    '''
+
+    def __init__(self, driver, refresh_interval=60):
+        self.driver = driver
+        self.refresh_interval = refresh_interval
+        self.postings = None
+        self.fingerprint = None
+
+    @property
+    def ready(self):
+        return self.postings is not None
+
+    def start(self):
+        thread = threading.Thread(
+            target=self._refresh_forever, name='recipe-index', daemon=True)
+        thread.start()
+        return thread
+
+    def _refresh_forever(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                # Keep serving the last snapshot until the graph is reachable
+                print(f"Recipe index refresh failed: {e}")
+            time.sleep(self.refresh_interval)
+
+    def refresh(self):
+        with self.driver.session() as session:
+            fingerprint = session.read_transaction(_graph_fingerprint)
+            if fingerprint == self.fingerprint:
+                return False
+
+            start = time.time()
+            postings = session.read_transaction(_load_postings)
+
+        self._swap(postings, fingerprint, start)
+        return True
+
+    def _swap(self, postings, fingerprint, start):
+        # Swap the whole snapshot so readers never see a partial index
+        self.postings = postings
+        self.fingerprint = fingerprint
+        print(
+            f"Recipe index loaded {len(postings.indices)} links in "
+            f"{time.time() - start:.2f} seconds")
+
+    def search(self, ingredient_ids, top_k=None):
+        return self.postings.search(ingredient_ids, top_k)
+
+
+class AsyncRecipeIndex(RecipeIndex):
+    '''
+    RecipeIndex for the ASGI app, refreshed by a task on the event loop
+    through the async driver. The posting lists are built off the loop.
+    '''
+
+    def start(self):
+        return asyncio.get_running_loop().create_task(self._refresh_forever())
+
+    async def _refresh_forever(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"Recipe index refresh failed: {e}")
+            await asyncio.sleep(self.refresh_interval)
+
+    async def refresh(self):
+        async with self.driver.session() as session:
+            fingerprint = await session.execute_read(_agraph_fingerprint)
+            if fingerprint == self.fingerprint:
+                return False
+
+            start = time.time()
+            rows = await session.execute_read(_aload_rows)
+
+        postings = await asyncio.get_running_loop().run_in_executor(
+            None, PostingLists, *rows)
+        self._swap(postings, fingerprint, start)
+        return True
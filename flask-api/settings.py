@@ -0,0 +1,70 @@
+'''
+Settings shared by the WSGI app and the ASGI app, read from the environment
+(and `.env`). Importing this module opens no connections and starts no
+threads, so either app can read its configuration from here.
+'''
+import ast
+import os
+
+from dotenv import load_dotenv
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+load_dotenv()
+
+
+def env(key, default=None, required=True):
+    """
+    Retrieves environment variables and returns Python natives.
+    """
+    try:
+        value = os.environ[key]
+        return ast.literal_eval(value)
+    except (SyntaxError, ValueError):
+        return value
+    except KeyError:
+        if default or not required:
+            return default
+        raise RuntimeError(
+            "Missing required environment variable '%s'" % key)
+
+
+NEO4J_URI = env('NEO4J_URI')
+NEO4J_USER = env('NEO4J_USER')
+NEO4J_PASSWORD = env('NEO4J_PASSWORD')
+
+COMPACT_JSON = 'application/vnd.foodkg.compact+json'
+MSGPACK = 'application/x-msgpack'
+# Media types responses can be rendered in, in order of preference
+MEDIA_TYPES = ['application/json', COMPACT_JSON] + (
+    [MSGPACK] if msgpack is not None else [])
+
+# Optional in-memory engine for /recipes/by-ingredients
+RECIPE_INDEX = env('RECIPE_INDEX', False, required=False)
+RECIPE_INDEX_REFRESH_SECONDS = env(
+    'RECIPE_INDEX_REFRESH_SECONDS', 60, required=False)
+# Score /recipes/by-ingredients in Cypher and only fetch the kept recipes
+RECIPE_SCORING_PUSHDOWN = env('RECIPE_SCORING_PUSHDOWN', False, required=False)
+# Default number of recipes returned by /recipes/by-ingredients, None for all
+RECIPE_TOP_K = env('RECIPE_TOP_K', None, required=False)
+
+# API key -> user cache
+AUTH_CACHE_SIZE = env('AUTH_CACHE_SIZE', 1024, required=False)
+AUTH_CACHE_TTL_SECONDS = env('AUTH_CACHE_TTL_SECONDS', 300, required=False)
+AUTH_CACHE_NEGATIVE_TTL_SECONDS = env(
+    'AUTH_CACHE_NEGATIVE_TTL_SECONDS', 30, required=False)
+
+# Read responses are cached until GraphBuilder bumps the graph version
+GRAPH_VERSION_TTL_SECONDS = env('GRAPH_VERSION_TTL_SECONDS', 5, required=False)
+RESPONSE_CACHE_SIZE = env('RESPONSE_CACHE_SIZE', 1024, required=False)
+
+INGREDIENT_SEARCH_REFRESH_SECONDS = env(
+    'INGREDIENT_SEARCH_REFRESH_SECONDS', 300, required=False)
+
+# Optional memory-mapped vectors behind /ingredients/<id>/substitutes and
+# /recipes/<id>/similar, made by utils/export_vectors.py
+INGREDIENT_VECTORS = env('INGREDIENT_VECTORS', None, required=False)
+RECIPE_VECTORS = env('RECIPE_VECTORS', None, required=False)
@@ -1,2 +1,6 @@
 #!/bin/bash
-exec gunicorn -b 0.0.0.0:5000 app:appbash
\ No newline at end of file
+# SERVER_MODE=asgi serves the async app on uvicorn workers
+if [ "$SERVER_MODE" = "asgi" ]; then
+    exec gunicorn -b 0.0.0.0:5000 -k uvicorn.workers.UvicornWorker asgi:app
+fi
+exec gunicorn -b 0.0.0.0:5000 app:app
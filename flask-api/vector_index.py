@@ -0,0 +1,43 @@
+import time
+
+import numpy as np
+from gensim.models import KeyedVectors
+
+
+class VectorIndex:
+    '''
+    Read-only nearest-neighbour index over the unit vectors exported by
+    `utils/export_vectors.py`, keyed by node uid. The vectors are memory
+    mapped, so every worker process shares one copy through the page cache,
+    and cosine similarity is a single matrix-vector product.
+    '''
+
+    def __init__(self, path):
+        start = time.time()
+        self.vectors = KeyedVectors.load(path, mmap='r')
+        self.matrix = self.vectors.vectors
+        print(
+            f"Mapped {len(self)} vectors from {path} in "
+            f"{time.time() - start:.2f} seconds")
+
+    def __len__(self):
+        return len(self.vectors.index_to_key)
+
+    def __contains__(self, key):
+        return key in self.vectors.key_to_index
+
+    def nearest(self, key, k=10):
+        """
+        Returns the `k` keys most similar to `key`, excluding itself, with
+        their cosine similarities, most similar first.
+        """
+        row = self.vectors.key_to_index[key]
+        scores = self.matrix @ self.matrix[row]
+        scores[row] = -np.inf
+        k = min(k, len(scores) - 1)
+        if k < 1:
+            return []
+        # Only the best `k` need sorting
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(self.vectors.index_to_key[i], float(scores[i])) for i in top]
@@ -0,0 +1,314 @@
+'''
+Offline microbenchmarks for the API resources and the graph builder.
+
+Needs no Neo4j, network or trained models: the Flask app and GraphBuilder
+read a synthetic graph from in-memory fakes, and Word2Vec/Phraser are
+replaced with tiny random models. Run from the repository root:
+
+    python test/benchmark.py --scales 100 1000 10000 --output benchmark.json
+
+Each timing is reported in milliseconds per call over `--repeat` runs.
+'''
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'flask-api'), os.path.join(ROOT, 'utils'),
+                os.path.dirname(os.path.abspath(__file__))]
+
+from fakes import (FakeDriver, FakePy2neoGraph, SyntheticGraph,  # noqa: E402
+                   fake_models)
+
+
+def measure(fn, repeat, setup=None):
+    """
+    Calls `fn` `repeat` times after one warm-up call and returns timing
+    statistics in milliseconds. `setup` runs untimed before every call.
+    """
+    timings = []
+    for run in range(repeat + 1):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        if run:
+            timings.append((time.perf_counter() - start) * 1000)
+    return {
+        'runs': repeat,
+        'min_ms': min(timings),
+        'median_ms': statistics.median(timings),
+        'mean_ms': statistics.mean(timings),
+    }
+
+
+# The app keeps the driver it was imported with, so every scale shares one
+DRIVER = FakeDriver()
+
+
+def load_app():
+    import neo4j
+
+    os.environ.setdefault('NEO4J_URI', 'bolt://localhost:7687')
+    os.environ.setdefault('NEO4J_USER', 'neo4j')
+    os.environ.setdefault('NEO4J_PASSWORD', 'benchmark')
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    neo4j.GraphDatabase.driver = staticmethod(lambda *args, **kwargs: DRIVER)
+
+    import app
+    return app
+
+
+def save_vectors(path, keys, vector_size=200, seed=0):
+    """
+    Saves random unit vectors for `keys` the way utils/export_vectors.py
+    does, so they can be memory mapped.
+    """
+    import numpy as np
+    from gensim.models import KeyedVectors
+
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal(
+        (len(keys), vector_size)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    exported = KeyedVectors(vector_size)
+    exported.add_vectors(list(keys), vectors)
+    exported.save(path, separately=['vectors'])
+
+
+def bench_api(scale, repeat):
+    app = load_app()
+    from recipe_index import RecipeIndex
+    from vector_index import VectorIndex
+
+    graph = SyntheticGraph(scale, max(50, scale // 4))
+    DRIVER.graph = graph
+    vectors_dir = tempfile.TemporaryDirectory()
+    vectors_path = os.path.join(vectors_dir.name, 'ingredient_vectors.kv')
+    save_vectors(vectors_path, graph.ingredients)
+    app.ingredient_vectors = VectorIndex(vectors_path)
+    recipe_vectors_path = os.path.join(vectors_dir.name, 'recipe_vectors.kv')
+    save_vectors(recipe_vectors_path, graph.recipes, seed=1)
+    app.recipe_vectors = VectorIndex(recipe_vectors_path)
+    client = app.app.test_client()
+
+    ingredient_id = max(graph.part_of, key=lambda id: len(graph.part_of[id]))
+    recipe_id = next(iter(graph.recipes))
+    selected = sorted(graph.part_of, key=lambda id: -len(graph.part_of[id]))
+    by_ingredients = {'ingredientIds': selected[:10]}
+    batch = {'recipeIds': list(graph.recipes)[:100],
+             'ingredientIds': list(graph.ingredients)[:100],
+             'recipeIngredientIds': list(graph.recipes)[:100]}
+    compact = {'Accept': app.COMPACT_JSON}
+
+    def request(method, url, **kwargs):
+        def call():
+            response = client.open(url, method=method, **kwargs)
+            response.get_data()
+            # Do not time error responses by mistake
+            if response.status_code != 200:
+                raise RuntimeError(
+                    f'{method} {url} returned {response.status_code}')
+        return call
+
+    def get(url, **kwargs):
+        return request('GET', url, **kwargs)
+
+    def post(url, body, **kwargs):
+        return request('POST', url, json=body, **kwargs)
+
+    cases = [
+        ('GET /ingredients', get('/ingredients')),
+        ('GET /ingredients?limit=100', get('/ingredients?limit=100')),
+        ('GET /ingredients?stream=true', get('/ingredients?stream=true')),
+        ('GET /recipes', get('/recipes')),
+        ('GET /ingredients/search?q=sa', get('/ingredients/search?q=sa')),
+        ('GET /ingredients/search?q=soy sauce',
+         get('/ingredients/search?q=soy%20sauce')),
+        ('GET /ingredients/<id>', get(f'/ingredients/{ingredient_id}')),
+        ('GET /recipes/<id>', get(f'/recipes/{recipe_id}')),
+        ('GET /recipes/<id>/ingredients',
+         get(f'/recipes/{recipe_id}/ingredients')),
+        ('GET /ingredients/<id>/recipes',
+         get(f'/ingredients/{ingredient_id}/recipes')),
+        ('GET /ingredients/<id>/substitutes',
+         get(f'/ingredients/{ingredient_id}/substitutes')),
+        ('GET /recipes/<id>/similar', get(f'/recipes/{recipe_id}/similar')),
+        ('POST /batch', post('/batch', batch)),
+    ]
+
+    results = [dict(name=name, **measure(fn, repeat)) for name, fn in cases]
+
+    # /recipes/by-ingredients through each scoring engine
+    app.recipe_index = None
+    app.RECIPE_SCORING_PUSHDOWN = False
+    for name, headers in (('paths', None), ('paths compact', compact)):
+        results.append(dict(
+            name=f'POST /recipes/by-ingredients ({name})',
+            **measure(post('/recipes/by-ingredients', by_ingredients,
+                           headers=headers), repeat)))
+
+    app.RECIPE_SCORING_PUSHDOWN = True
+    results.append(dict(
+        name='POST /recipes/by-ingredients (pushdown)',
+        **measure(post('/recipes/by-ingredients', by_ingredients), repeat)))
+    app.RECIPE_SCORING_PUSHDOWN = False
+
+    app.recipe_index = RecipeIndex(DRIVER)
+    start = time.perf_counter()
+    app.recipe_index.refresh()
+    results.append({
+        'name': 'RecipeIndex.refresh', 'runs': 1,
+        'min_ms': (time.perf_counter() - start) * 1000})
+    results.append(dict(
+        name='POST /recipes/by-ingredients (index)',
+        **measure(post('/recipes/by-ingredients', by_ingredients), repeat)))
+    app.recipe_index = None
+    app.ingredient_vectors = None
+    app.recipe_vectors = None
+    vectors_dir.cleanup()
+
+    return results
+
+
+def load_graph_builder(model, phrase_model):
+    """
+    Imports graph_builder with the fake models in place of the trained ones.
+    Falls back to an identity lemmatizer when the WordNet data is missing,
+    since it cannot be downloaded offline.
+    """
+    import resources
+    resources.word2vec.set(model)
+    resources.phrase_model.set(phrase_model)
+
+    import graph_builder
+
+    lemmatizer = 'wordnet'
+    try:
+        resources.lemmatizer.get().lemmatize('tomatoes')
+    except LookupError:
+        class IdentityLemmatizer:
+            def lemmatize(self, token):
+                return token
+        resources.lemmatizer.set(IdentityLemmatizer())
+        lemmatizer = 'identity'
+    return graph_builder, lemmatizer
+
+
+def new_builder(graph_builder, nodes, dedupe_index):
+    from py2neo import Node
+
+    graph = FakePy2neoGraph(
+        Node('Ingredient', name=node['name'], category=node['category'],
+             key=node['key'], uid=node['uid'])
+        for node in nodes)
+    graph_builder.Graph = lambda *args, **kwargs: graph
+    return graph_builder.GraphBuilder(
+        'bolt://localhost:7687', 'neo4j', 'benchmark',
+        dedupe_index=dedupe_index)
+
+
+def bench_builder(scale, repeat, graph_builder):
+    graph = SyntheticGraph(0, max(50, scale // 4), seed=scale)
+    nodes = list(graph.ingredients.values())
+    # Half known names, half new ones that go through similarity dedupe
+    probes = SyntheticGraph(0, 100, seed=scale + 1)
+    queries = [
+        {'food': node['name'].upper(), 'foodCategory': node['category']}
+        for node in nodes[:50]] + [
+        {'food': node['name'], 'foodCategory': node['category']}
+        for node in probes.ingredients.values()][:50]
+    names = [query['food'] for query in queries]
+    pairs = list(zip(names, reversed(names)))
+
+    results = []
+    for dedupe_index in (False, True):
+        builder = new_builder(graph_builder, nodes, dedupe_index)
+
+        def reset():
+            # Nodes created by a run are dropped so every run sees the same graph
+            builder.graph.ingredients = builder.graph.ingredients[:len(nodes)]
+            if builder.ingredient_index is not None:
+                builder.ingredient_index = builder.load_ingredient_index()
+
+        def dedupe():
+            for query in queries:
+                builder.get_or_create_ingredient_node(query)
+        mode = 'index' if dedupe_index else 'cypher'
+        results.append(dict(
+            name=f'GraphBuilder.get_or_create_ingredient_node x{len(queries)} ({mode})',
+            **measure(dedupe, repeat, setup=reset)))
+
+    builder = new_builder(graph_builder, nodes, False)
+    results.append(dict(
+        name=f'GraphBuilder.calculate_similarity x{len(pairs)}',
+        **measure(lambda: [
+            builder.calculate_similarity(first, second)
+            for first, second in pairs], repeat)))
+    results.append(dict(
+        name=f'GraphBuilder.preprocess_ingredient x{len(names)}',
+        **measure(lambda: [
+            builder.preprocess_ingredient(name) for name in names], repeat)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument(
+        '--scales', type=int, nargs='+', default=[100, 1000, 10000],
+        help='numbers of recipes in the synthetic graphs')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--suites', nargs='+', default=['api', 'builder'],
+                        choices=['api', 'builder'])
+    parser.add_argument('--output', default='benchmark.json')
+    args = parser.parse_args()
+
+    meta = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scales': args.scales,
+        'repeat': args.repeat,
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    results = []
+    skipped = {}
+
+    graph_builder = None
+    if 'builder' in args.suites:
+        try:
+            model, phrase_model = fake_models()
+            graph_builder, meta['lemmatizer'] = load_graph_builder(
+                model, phrase_model)
+        except ImportError as e:
+            skipped['builder'] = f'missing dependency: {e}'
+
+    for scale in args.scales:
+        suites = []
+        if 'api' in args.suites:
+            suites.append(('api', bench_api))
+        if graph_builder is not None:
+            suites.append(('builder', lambda scale, repeat: bench_builder(
+                scale, repeat, graph_builder)))
+        for suite, bench in suites:
+            for result in bench(scale, args.repeat):
+                result.update(suite=suite, scale=scale)
+                results.append(result)
+                print(f"{suite:8} {scale:>7} {result['name']:70} "
+                      f"{result.get('median_ms', result['min_ms']):10.3f} ms")
+
+    with open(args.output, 'w') as f:
+        json.dump(
+            {'meta': meta, 'skipped': skipped, 'results': results}, f,
+            indent=2)
+    for suite, reason in skipped.items():
+        print(f"Skipped {suite}: {reason}")
+    print(f"Wrote {len(results)} results to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+'''
+Shared fixtures for the offline tests. Like the benchmarks, they need no
+Neo4j, network or trained models: everything runs against the in-memory
+fakes from `fakes.py`.
+'''
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'flask-api'), os.path.join(ROOT, 'utils'),
+                os.path.dirname(os.path.abspath(__file__))]
+
+# The settings module reads these on import, as load_app does
+for name, value in (('NEO4J_URI', 'bolt://localhost:7687'),
+                    ('NEO4J_USER', 'neo4j'), ('NEO4J_PASSWORD', 'benchmark'),
+                    ('SECRET_KEY', 'benchmark')):
+    os.environ.setdefault(name, value)
+
+import benchmark  # noqa: E402
+from fakes import SyntheticGraph, fake_models  # noqa: E402
+
+
+@pytest.fixture
+def graph():
+    return SyntheticGraph(200, 60)
+
+
+@pytest.fixture
+def api(graph):
+    """
+    The Flask app reading `graph`, with every optional engine switched off.
+    """
+    from graph_cache import ResponseCache
+
+    app = benchmark.load_app()
+    benchmark.DRIVER.graph = graph
+    # Responses are cached per graph version, which every graph shares
+    app.response_cache = ResponseCache()
+    app.recipe_index = None
+    app.RECIPE_SCORING_PUSHDOWN = False
+    yield app
+    app.recipe_index = None
+    app.RECIPE_SCORING_PUSHDOWN = False
+
+
+@pytest.fixture(scope='session')
+def graph_builder():
+    """
+    The graph_builder module with the fake Word2Vec and Phraser models.
+    """
+    module, _ = benchmark.load_graph_builder(*fake_models())
+    return module
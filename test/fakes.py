@@ -0,0 +1,413 @@
+'''
+In-memory stand-ins for Neo4j and the embedding models, used by the offline
+benchmarks. A SyntheticGraph of any size is served both through the neo4j
+driver API the Flask app uses and the py2neo Graph API GraphBuilder uses.
+'''
+import random
+
+import numpy as np
+
+WORDS = [
+    'salt', 'pepper', 'olive', 'oil', 'garlic', 'onion', 'red', 'green',
+    'white', 'black', 'sugar', 'brown', 'flour', 'butter', 'milk', 'cream',
+    'cheese', 'chicken', 'beef', 'pork', 'fish', 'sauce', 'soy', 'lemon',
+    'lime', 'juice', 'tomato', 'paste', 'rice', 'wine', 'vinegar', 'honey',
+    'ginger', 'ground', 'fresh', 'dried', 'chili', 'powder', 'stock', 'egg',
+    'bean', 'corn', 'potato', 'carrot', 'celery', 'basil', 'parsley', 'mint',
+    'thyme', 'oregano', 'cumin', 'paprika', 'yogurt', 'bread', 'pasta',
+    'noodle', 'sesame', 'peanut', 'almond', 'coconut', 'maple', 'syrup',
+    'mustard', 'mushroom']
+CATEGORIES = ['Condiments and sauces', 'Vegetables', 'Meats', 'Dairy',
+              'Grains', 'Oils', 'Spices']
+MEASURES = ['<unit>', 'gram', 'cup', 'tablespoon', 'teaspoon', 'ounce']
+
+
+class SyntheticGraph:
+    '''
+    Random recipe/ingredient graph with `recipes` recipes over `ingredients`
+    ingredients, each recipe containing `per_recipe` of them. Ingredient
+    names are one to three words so word-overlap dedupe has work to do.
+    '''
+
+    def __init__(self, recipes, ingredients, per_recipe=8, seed=0):
+        rng = random.Random(seed)
+        names = set()
+        while len(names) < ingredients:
+            names.add(' '.join(rng.sample(WORDS, rng.randint(1, 3))))
+
+        # Nodes are keyed by uid, with `id` standing for the returned alias
+        self.ingredients = {}
+        for n, name in enumerate(sorted(names)):
+            uid = f'{n:016x}'
+            self.ingredients[uid] = {
+                'id': uid, 'uid': uid, 'key': name, 'name': name,
+                'category': rng.choice(CATEGORIES)}
+        self.recipes = {}
+        for n in range(ingredients, ingredients + recipes):
+            uid = f'{n:016x}'
+            self.recipes[uid] = {
+                'id': uid, 'uid': uid, 'name': f'recipe {n}',
+                'url': f'https://example.com/recipes/{n}',
+                'totalTime': str(rng.randint(10, 120))}
+
+        # Unstamped like a graph no builder has written to, and no users
+        self.version = None
+        self.users = {}
+
+        self.contains = {}
+        self.part_of = {id: [] for id in self.ingredients}
+        ingredient_ids = list(self.ingredients)
+        for recipe_id in self.recipes:
+            chosen = rng.sample(
+                ingredient_ids, min(per_recipe, len(ingredient_ids)))
+            self.contains[recipe_id] = [
+                (id, rng.randint(1, 4), rng.choice(MEASURES))
+                for id in chosen]
+            for id in chosen:
+                self.part_of[id].append(recipe_id)
+
+    def links(self):
+        return sum(len(rows) for rows in self.contains.values())
+
+
+class Record(dict):
+    '''
+    Dict with the parts of `neo4j.Record` the app uses.
+    '''
+
+    def data(self):
+        return dict(self)
+
+    def values(self):
+        return list(dict.values(self))
+
+
+class Result:
+    def __init__(self, rows):
+        self.rows = [Record(row) for row in rows]
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def single(self):
+        return self.rows[0] if self.rows else None
+
+    def data(self):
+        return [row.data() for row in self.rows]
+
+    def values(self):
+        return [row.values() for row in self.rows]
+
+
+class FakeTransaction:
+    '''
+    Answers the Cypher queries of the Flask app and the recipe index from a
+    SyntheticGraph. Queries are recognised by their text, so an unknown
+    query fails loudly instead of timing nothing.
+    '''
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def run(self, query, parameters=None, **kwparameters):
+        params = dict(parameters or {}, **kwparameters)
+        return Result(self._rows(query, params))
+
+    def _rows(self, query, params):
+        graph = self.graph
+        query = ' '.join(query.split())
+
+        if 'GraphMeta' in query:
+            return [] if graph.version is None else [
+                {'version': graph.version}]
+        if 'User' in query:
+            user = graph.users.get(params['api_key'])
+            return [] if user is None else [{'user': user}]
+        if query.startswith('MATCH (i:Ingredient) WITH count(i)'):
+            return [{'ingredients': len(graph.ingredients),
+                     'recipes': len(graph.recipes),
+                     'links': graph.links()}]
+        if query.startswith('MATCH (n:Ingredient') or \
+                query.startswith('MATCH (n:Recipe'):
+            return self._nodes(query, params)
+        if query.startswith('UNWIND'):
+            return self._batch(query, params)
+        if query.startswith('MATCH (i:Ingredient) OPTIONAL MATCH'):
+            return [dict(node, recipes=len(graph.part_of[id]))
+                    for id, node in graph.ingredients.items()]
+        if 'properties(i) AS props' in query and '$ingredientIds' in query:
+            return [
+                {'id': id, 'props': self._props(graph.ingredients[id])}
+                for id in params['ingredientIds']
+                if id in graph.ingredients and graph.part_of[id]]
+        if 'count(*) AS score' in query:
+            return self._matches(params)
+        if query.startswith('MATCH p=(ingredient:Ingredient)'):
+            return [
+                {'recipeId': recipe_id,
+                 'p': [self._props(graph.ingredients[id]), 'PART_OF',
+                       self._props(graph.recipes[recipe_id])]}
+                for id in params['ingredientIds']
+                if id in graph.part_of
+                for recipe_id in graph.part_of[id]]
+        if query.startswith('MATCH c=(r:Recipe'):
+            return [
+                {'c': [self._props(graph.recipes[params['id']]), 'CONTAINS',
+                       self._props(graph.ingredients[id])],
+                 'quantity': quantity, 'measure': measure}
+                for id, quantity, measure in graph.contains.get(
+                    params['id'], [])]
+        if '<-[:CONTAINS]-(n:Recipe)' in query:
+            return [graph.recipes[recipe_id]
+                    for recipe_id in graph.part_of.get(params['id'], [])]
+        if query == 'MATCH (i:Ingredient) RETURN i.uid AS id, properties(i) AS props':
+            return [{'id': id, 'props': self._props(node)}
+                    for id, node in graph.ingredients.items()]
+        if query == 'MATCH (r:Recipe) RETURN r.uid AS id, properties(r) AS props':
+            return [{'id': id, 'props': self._props(node)}
+                    for id, node in graph.recipes.items()]
+        if query.startswith('MATCH (i:Ingredient)-[:PART_OF]->(r:Recipe) RETURN'):
+            return [{'ingredient': id, 'recipe': recipe_id}
+                    for id, recipe_ids in graph.part_of.items()
+                    for recipe_id in recipe_ids]
+        raise NotImplementedError(f'Unexpected query: {query}')
+
+    @staticmethod
+    def _props(node):
+        return {key: value for key, value in node.items() if key != 'id'}
+
+    def _nodes(self, query, params):
+        nodes = self.graph.ingredients if 'Ingredient' in query \
+            else self.graph.recipes
+        if '{uid: $id}' in query:
+            node = nodes.get(params['id'])
+            return [node] if node else []
+        rows = [node for id, node in sorted(nodes.items())
+                if params.get('after') is None or id > params['after']]
+        if 'LIMIT $limit' in query:
+            rows = rows[:params['limit']]
+        return rows
+
+    def _batch(self, query, params):
+        graph = self.graph
+        if 'CONTAINS' in query:
+            return [
+                {'id': recipe_id,
+                 'ingredient': self._props(graph.ingredients[id]),
+                 'quantity': quantity, 'measure': measure}
+                for recipe_id in params['ids']
+                for id, quantity, measure in graph.contains.get(
+                    recipe_id, [])]
+        nodes = graph.recipes if 'Recipe' in query else graph.ingredients
+        return [nodes[id] for id in params['ids'] if id in nodes]
+
+    def _matches(self, params):
+        graph = self.graph
+        scores = {}
+        selected = {}
+        for id in params['ingredientIds']:
+            for recipe_id in graph.part_of.get(id, []):
+                scores[recipe_id] = scores.get(recipe_id, 0) + 1
+                selected.setdefault(recipe_id, []).append(id)
+        if not scores:
+            return []
+        ranked = sorted(scores.items(), key=lambda item: -item[1])
+        q1 = ranked[int(len(ranked) * 0.25)][1]
+        rows = [
+            {'id': recipe_id,
+             'recipe': self._props(graph.recipes[recipe_id]),
+             'score': score, 'ingredients': selected[recipe_id]}
+            for recipe_id, score in ranked if score > q1]
+        if params.get('topK') is not None:
+            rows = rows[:params['topK']]
+        return rows
+
+
+class FakeSession(FakeTransaction):
+    def read_transaction(self, work, *args, **kwargs):
+        return work(FakeTransaction(self.graph), *args, **kwargs)
+
+    execute_read = read_transaction
+    write_transaction = read_transaction
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FakeDriver:
+    '''
+    Stand-in for `neo4j.GraphDatabase.driver`. Swap `graph` to change the
+    data every new session sees.
+    '''
+
+    def __init__(self, graph=None):
+        self.graph = graph
+
+    def session(self, **config):
+        return FakeSession(self.graph)
+
+    def close(self):
+        pass
+
+
+class AsyncFakeResult:
+    def __init__(self, result):
+        self.result = result
+        self.rows = iter(result.rows)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self.rows)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def single(self):
+        return self.result.single()
+
+    async def data(self):
+        return self.result.data()
+
+    async def values(self):
+        return self.result.values()
+
+
+class AsyncFakeTransaction:
+    def __init__(self, graph):
+        self.transaction = FakeTransaction(graph)
+
+    async def run(self, query, parameters=None, **kwparameters):
+        return AsyncFakeResult(
+            self.transaction.run(query, parameters, **kwparameters))
+
+
+class AsyncFakeSession(AsyncFakeTransaction):
+    def __init__(self, graph):
+        super().__init__(graph)
+        self.graph = graph
+
+    async def execute_read(self, work, *args, **kwargs):
+        return await work(AsyncFakeTransaction(self.graph), *args, **kwargs)
+
+    async def close(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+class AsyncFakeDriver:
+    '''
+    Stand-in for `neo4j.AsyncGraphDatabase.driver`, serving the graph of
+    `driver`, so the ASGI app and the Flask app read the same data.
+    '''
+
+    def __init__(self, driver):
+        self.driver = driver
+
+    def session(self, **config):
+        return AsyncFakeSession(self.driver.graph)
+
+    async def close(self):
+        pass
+
+
+class FakePy2neoGraph:
+    '''
+    Stand-in for the py2neo Graph behind GraphBuilder, holding ingredient
+    nodes in memory and answering the builder's ingredient lookups.
+    '''
+
+    def __init__(self, ingredients=()):
+        self.ingredients = list(ingredients)
+
+    def create(self, subgraph):
+        if getattr(subgraph, 'has_label', None) and \
+                subgraph.has_label('Ingredient'):
+            self.ingredients.append(subgraph)
+
+    def merge(self, subgraph, label=None, *property_keys):
+        if label == 'Ingredient' and any(
+                node['uid'] == subgraph['uid'] for node in self.ingredients):
+            return
+        self.create(subgraph)
+
+    def run(self, query, **params):
+        query = ' '.join(query.split())
+        if '{key: $key}' in query:
+            rows = [{'i': node} for node in self.ingredients
+                    if node['key'] == params['key']]
+        elif '$normWords' in query:
+            rows = [{'i': node} for node in self.ingredients
+                    if any(word in node['name'].lower()
+                           for word in params['normWords'])]
+        elif query == 'MATCH (i:Ingredient) RETURN i':
+            rows = [{'i': node} for node in self.ingredients]
+        elif 'GraphMeta' in query:
+            rows = [{'version': 1}]
+        elif 'CREATE CONSTRAINT' in query or 'IS NULL' in query or \
+                'AS duplicates' in query or query.startswith('UNWIND'):
+            # Schema migration; the benchmark graph is already migrated
+            rows = []
+        else:
+            raise NotImplementedError(f'Unexpected query: {query}')
+        return Result(rows)
+
+
+class FakePhraser:
+    '''
+    Tiny Phraser that joins a fixed set of bigrams with underscores.
+    '''
+
+    def __init__(self, bigrams):
+        self.bigrams = set(bigrams)
+
+    def __getitem__(self, tokens):
+        phrased = []
+        i = 0
+        while i < len(tokens):
+            if i + 1 < len(tokens) and \
+                    (tokens[i], tokens[i + 1]) in self.bigrams:
+                phrased.append(f'{tokens[i]}_{tokens[i + 1]}')
+                i += 2
+            else:
+                phrased.append(tokens[i])
+                i += 1
+        return phrased
+
+
+class FakeWord2Vec:
+    '''
+    Tiny Word2Vec with random unit vectors for `words`, exposing real
+    gensim KeyedVectors as `wv`.
+    '''
+
+    def __init__(self, words, vector_size=16, seed=0):
+        from gensim.models import KeyedVectors
+
+        rng = np.random.default_rng(seed)
+        self.wv = KeyedVectors(vector_size)
+        self.wv.add_vectors(
+            list(words),
+            rng.standard_normal((len(words), vector_size)).astype(np.float32))
+
+
+def fake_models(seed=0):
+    """
+    Builds a FakeWord2Vec and FakePhraser over the synthetic vocabulary.
+    """
+    rng = random.Random(seed)
+    bigrams = {tuple(rng.sample(WORDS, 2)) for _ in range(len(WORDS) // 2)}
+    phrases = [f'{first}_{second}' for first, second in bigrams]
+    return FakeWord2Vec(WORDS + phrases, seed=seed), FakePhraser(bigrams)
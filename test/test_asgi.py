@@ -0,0 +1,112 @@
+import json
+
+import pytest
+
+import benchmark
+from fakes import AsyncFakeDriver
+
+
+@pytest.fixture
+def clients(api, graph):
+    """
+    Test clients of the Flask and ASGI apps, reading `graph` stamped with a
+    version, so both cache responses and send ETags.
+    """
+    import neo4j
+    from starlette.testclient import TestClient
+
+    from auth_cache import AuthCache
+    from graph_cache import AsyncGraphVersion, GraphVersion, ResponseCache
+
+    neo4j.AsyncGraphDatabase.driver = staticmethod(
+        lambda *args, **kwargs: AsyncFakeDriver(benchmark.DRIVER))
+    import asgi
+
+    graph.version = 7
+    graph.users['secret'] = {'id': 'user', 'username': 'cook'}
+    # Module-level state shared with earlier tests
+    api.graph_version = GraphVersion(benchmark.DRIVER, ttl=0)
+    asgi.graph_version = AsyncGraphVersion(asgi.driver, ttl=0)
+    asgi.response_cache = ResponseCache()
+    api.auth_cache = AuthCache()
+    asgi.auth_cache = AuthCache()
+    with TestClient(asgi.app) as client:
+        yield api.app.test_client(), client
+
+
+# Sent by browsers on cross-origin requests; CORS headers answer it
+ORIGIN = {'Origin': 'https://example.com'}
+
+
+def parsed(body):
+    return [json.loads(line) for line in body.decode().splitlines()]
+
+
+def assert_same(flask_response, asgi_response):
+    assert asgi_response.status_code == flask_response.status_code
+    assert parsed(asgi_response.content) == parsed(flask_response.data)
+    for header in ('ETag', 'Cache-Control', 'Vary', 'Link',
+                   'Access-Control-Allow-Origin'):
+        # flask-cors adds its Vary as a second header
+        assert asgi_response.headers.get(header) == (', '.join(
+            flask_response.headers.getlist(header)) or None), header
+
+
+def routes(graph):
+    recipe_id = next(iter(graph.recipes))
+    ingredient_id = next(iter(graph.ingredients))
+    return [
+        '/ingredients', '/ingredients?limit=5',
+        f'/recipes?limit=3&after={recipe_id}',
+        '/ingredients?stream=true', '/ingredients/search?q=sa',
+        f'/ingredients/{ingredient_id}', f'/recipes/{recipe_id}',
+        f'/recipes/{recipe_id}/ingredients',
+        f'/ingredients/{ingredient_id}/recipes', '/recipes/missing',
+        '/ingredients?limit=0',
+    ]
+
+
+def test_get_routes_match(clients, graph):
+    flask_client, asgi_client = clients
+    for url in routes(graph):
+        assert_same(flask_client.get(url, headers=ORIGIN),
+                    asgi_client.get(url, headers=ORIGIN))
+
+
+def test_not_modified_matches(clients, graph):
+    flask_client, asgi_client = clients
+    url = f'/recipes/{next(iter(graph.recipes))}'
+    etag = asgi_client.get(url).headers['ETag']
+    assert flask_client.get(url).headers['ETag'] == etag
+    for response in (flask_client.get(url, headers={'If-None-Match': etag}),
+                     asgi_client.get(url, headers={'If-None-Match': etag})):
+        assert response.status_code == 304
+        assert response.headers['ETag'] == etag
+
+    graph.version += 1
+    assert asgi_client.get(
+        url, headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_posts_match(clients, graph):
+    flask_client, asgi_client = clients
+    ingredient_ids = sorted(
+        graph.part_of, key=lambda id: -len(graph.part_of[id]))[:5]
+    for url, body in (
+            ('/recipes/by-ingredients', {'ingredientIds': ingredient_ids}),
+            ('/recipes/by-ingredients', {'ingredientIds': []}),
+            ('/batch', {'recipeIds': list(graph.recipes)[:3] + ['missing'],
+                        'ingredientIds': ingredient_ids}),
+            ('/batch', ['missing'])):
+        assert_same(flask_client.post(url, json=body, headers=ORIGIN),
+                    asgi_client.post(url, json=body, headers=ORIGIN))
+
+
+@pytest.mark.parametrize('authorization', [
+    'Token secret', 'Token unknown', 'Bearer secret'])
+def test_auth_matches(clients, graph, authorization):
+    flask_client, asgi_client = clients
+    url = f'/recipes/{next(iter(graph.recipes))}'
+    headers = dict(ORIGIN, Authorization=authorization)
+    assert_same(flask_client.get(url, headers=headers),
+                asgi_client.get(url, headers=headers))
@@ -0,0 +1,45 @@
+import pytest
+
+import auth_cache
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(auth_cache.time, 'monotonic', clock)
+    return clock
+
+
+def test_expires_users_and_bad_keys(clock):
+    cache = auth_cache.AuthCache(ttl=300, negative_ttl=30)
+    cache.set('good', {'name': 'user'})
+    cache.set('bad', None)
+    assert cache.get('good') == (True, {'name': 'user'})
+    assert cache.get('bad') == (True, None)
+
+    clock.now += 31
+    assert cache.get('bad') == (False, None)
+    assert cache.get('good') == (True, {'name': 'user'})
+
+    clock.now += 300
+    assert cache.get('good') == (False, None)
+
+
+def test_evicts_least_recently_used(clock):
+    cache = auth_cache.AuthCache(max_size=2)
+    cache.set('a', 'A')
+    cache.set('b', 'B')
+    cache.get('a')
+    cache.set('c', 'C')
+    assert cache.get('b') == (False, None)
+    assert cache.get('a') == (True, 'A')
+    assert cache.get('c') == (True, 'C')
+
@@ -0,0 +1,38 @@
+import pytest
+
+
+def test_batch_matches_single_routes(api, graph):
+    client = api.app.test_client()
+    recipe_ids = list(graph.recipes)[:3] + ['missing']
+    ingredient_ids = list(graph.ingredients)[:3] + ['missing']
+    response = client.post('/batch', json={
+        'recipeIds': recipe_ids, 'ingredientIds': ingredient_ids,
+        'recipeIngredientIds': recipe_ids})
+    assert response.status_code == 200
+    batch = response.get_json()
+
+    def single(url):
+        response = client.get(url)
+        if response.status_code != 200:
+            return None
+        payload = response.get_json()
+        # The single routes also echo the status in their body
+        payload.pop('status', None)
+        return payload
+
+    assert batch['recipes'] == {
+        id: single(f'/recipes/{id}') for id in recipe_ids}
+    assert batch['ingredients'] == {
+        id: single(f'/ingredients/{id}') for id in ingredient_ids}
+    assert batch['recipeIngredients'] == {
+        id: single(f'/recipes/{id}/ingredients') for id in recipe_ids}
+    assert batch['recipes']['missing'] is None
+
+
+@pytest.mark.parametrize('body', [
+    {}, [], ['r1'], {'recipeIds': 'r1'}, {'ingredientIds': [1]},
+    {'recipeIds': [str(i) for i in range(501)]},
+])
+def test_batch_rejects(api, body):
+    response = api.app.test_client().post('/batch', json=body)
+    assert response.status_code == 400
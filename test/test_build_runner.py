@@ -0,0 +1,302 @@
+import multiprocessing
+import time
+
+import pytest
+
+import benchmark
+import build_runner
+import recipe_scraper
+from build_runner import (BuildCheckpoint, BuildRunner, ParallelBuildRunner,
+                          SeenRecipes)
+from bulk_writer import COMPLETE_RECIPES, MERGE_RELATIONSHIPS, BulkWriter
+
+
+def test_checkpoint_resumes(tmp_path):
+    path = str(tmp_path / 'checkpoint.json')
+    checkpoint = BuildCheckpoint(path)
+    checkpoint.next_round()
+    checkpoint.start_count = 120
+    checkpoint.seen.add({'label': 'pasta', 'url': 'https://a.com/pasta'})
+    checkpoint.complete('0:cuisine:Italian')
+
+    resumed = BuildCheckpoint(path)
+    assert resumed.round == 1
+    assert resumed.completed == ['0:cuisine:Italian']
+    assert resumed.start_count == 120
+    assert {'label': 'pasta', 'url': 'https://b.com/other'} in resumed.seen
+    assert {'label': 'other', 'url': 'https://a.com/pasta'} in resumed.seen
+    assert {'label': 'other', 'url': 'https://b.com/other'} not in resumed.seen
+
+
+def test_unreadable_checkpoint_starts_over(tmp_path):
+    path = tmp_path / 'checkpoint.json'
+    path.write_text('{"round": 3, "compl')
+    checkpoint = BuildCheckpoint(str(path))
+    assert (checkpoint.round, checkpoint.completed) == (0, [])
+
+
+class RecipeKeys:
+    '''
+    Graph answering SeenRecipes.prefetch with a fixed set of recipes.
+    '''
+
+    def __init__(self, records):
+        self.records = records
+
+    def run(self, query):
+        return self
+
+    def data(self):
+        return self.records
+
+
+class Builder:
+    def __init__(self, records=()):
+        self.graph = RecipeKeys(list(records))
+        self.seen_recipes = None
+
+
+def test_resumed_round_skips_completed_queries(tmp_path):
+    path = str(tmp_path / 'checkpoint.json')
+    queries = [('cuisine', 'Italian'), ('ingredient', 'rice'),
+               ('cuisine', 'Italian')]
+    checkpoint = BuildCheckpoint(path)
+    runner = BuildRunner(Builder(), checkpoint)
+    steps = runner.steps(queries)
+    assert [step for step, _, _, _ in steps] == \
+        ['0:cuisine:Italian', '1:ingredient:rice', '2:cuisine:Italian']
+    # Repeats of a query read the next cached occurrence
+    assert [occurrence for _, _, _, occurrence in steps] == [0, 0, 1]
+    checkpoint.complete(steps[0][0])
+
+    resumed = BuildRunner(Builder(), BuildCheckpoint(path))
+    assert resumed.steps(queries) == steps[1:]
+
+
+def test_runner_shares_seen_recipes(tmp_path):
+    checkpoint = BuildCheckpoint(str(tmp_path / 'checkpoint.json'))
+    checkpoint.seen = SeenRecipes(['saved'], ['https://a.com/saved'])
+    builder = Builder([{'name': 'built', 'url': 'https://a.com/built'}])
+    BuildRunner(builder, checkpoint)
+    assert builder.seen_recipes is checkpoint.seen
+    assert builder.seen_recipes.labels == {'saved', 'built'}
+
+
+class Page:
+    def instructions_list(self):
+        return ['mix']
+
+    def total_time(self):
+        return 10
+
+
+# Shared counters of the fake page fetches, inherited by forked workers
+fetches = {}
+
+
+def fake_scrape_me(url, wild_mode=False, timeout=None):
+    domain = url.split('/')[2]
+    with fetches['lock']:
+        active = fetches['active'].get(domain, 0) + 1
+        fetches['active'][domain] = active
+        fetches['peak'][domain] = max(fetches['peak'].get(domain, 0), active)
+    time.sleep(0.05)
+    with fetches['lock']:
+        fetches['active'][domain] -= 1
+    return Page()
+
+
+class FakeSearch:
+    '''
+    Recipe search answering every query with `per_query` recipes spread
+    over two sites.
+    '''
+
+    per_query = 12
+
+    def __init__(self, cache=None):
+        pass
+
+    def by_cuisine(self, cuisine, occurrence=None):
+        return [
+            {'recipe': {'label': f'{cuisine} {n}',
+                        'url': f'https://site{n % 2}.com/{cuisine}/{n}'}}
+            for n in range(self.per_query)]
+
+    by_ingredient = by_cuisine
+
+
+class RecordingBuilder(Builder):
+    def __init__(self, records=()):
+        super().__init__(records)
+        self.built = []
+
+    def build_recipes(self, recipes, pages=None):
+        self.built.append((recipes, pages))
+
+
+def parallel_runner(tmp_path, workers=3, per_domain=2):
+    config = {
+        'cache_dir': None, 'cache_ttl': 0, 'cache_negative_ttl': 0,
+        'cache_max_bytes': 0, 'offline': False, 'scrape_workers': 8,
+        'scrape_per_domain': per_domain, 'scrape_timeout': 1}
+    return ParallelBuildRunner(
+        RecordingBuilder(), BuildCheckpoint(str(tmp_path / 'checkpoint.json')),
+        workers, config)
+
+
+@pytest.fixture
+def fake_fetches(monkeypatch):
+    monkeypatch.setattr(build_runner, 'RecipeSearch', FakeSearch)
+    monkeypatch.setattr(recipe_scraper, 'scrape_me', fake_scrape_me)
+    with multiprocessing.Manager() as manager:
+        fetches.update(
+            lock=manager.Lock(), active=manager.dict(), peak=manager.dict())
+        yield fetches
+        fetches.clear()
+
+
+QUERIES = [('cuisine', name) for name in ('Italian', 'Thai', 'Greek')]
+
+
+def test_parallel_build_caps_requests_per_domain(tmp_path, fake_fetches):
+    runner = parallel_runner(tmp_path, workers=3, per_domain=2)
+    runner.run_round(runner.steps(QUERIES))
+    assert dict(fake_fetches['peak']) == {'site0.com': 2, 'site1.com': 2}
+
+
+def test_unshared_slots_exceed_the_cap(tmp_path, fake_fetches, monkeypatch):
+    # Without shared slots every process had its own cap
+    monkeypatch.setattr(
+        build_runner, 'SharedDomainSlots', lambda manager, per_domain: None)
+    runner = parallel_runner(tmp_path, workers=3, per_domain=2)
+    runner.run_round(runner.steps(QUERIES))
+    assert max(fake_fetches['peak'].values()) > 2
+
+
+def test_parallel_round_builds_in_query_order(tmp_path, fake_fetches):
+    runner = parallel_runner(tmp_path)
+    queries = QUERIES + [('ingredient', 'salt')]
+    steps = runner.steps(queries)
+    runner.run_round(steps)
+
+    built = runner.graph_builder.built
+    assert [recipes[0]['recipe']['label'] for recipes, _ in built] == \
+        ['Italian 0', 'Thai 0', 'Greek 0', 'salt 0']
+    for recipes, pages in built:
+        assert set(pages) == {recipe['recipe']['url'] for recipe in recipes}
+        assert all(page == {'instructions': ['mix'], 'totalTime': 10}
+                   for page in pages.values())
+    completed = [step for step, _, _, _ in steps]
+    assert runner.checkpoint.completed == completed
+    assert BuildCheckpoint(runner.checkpoint.path).completed == completed
+
+
+def test_parallel_round_skips_seen_and_completed(tmp_path, fake_fetches):
+    runner = parallel_runner(tmp_path)
+    runner.checkpoint.complete('0:cuisine:Italian')
+    seen = FakeSearch().by_cuisine('Thai')[:5]
+    for recipe in seen:
+        runner.checkpoint.seen.add(recipe['recipe'])
+    runner.run_round(runner.steps(QUERIES))
+
+    built = runner.graph_builder.built
+    assert [recipes[0]['recipe']['label'] for recipes, _ in built] == \
+        ['Thai 0', 'Greek 0']
+    # Seen recipes are still handed to the builder, which skips them, but
+    # their pages are not fetched
+    thai_pages = built[0][1]
+    assert len(thai_pages) == FakeSearch.per_query - 5
+    assert not {recipe['recipe']['url'] for recipe in seen} & set(thai_pages)
+    assert runner.checkpoint.completed == [
+        '0:cuisine:Italian', '1:cuisine:Thai', '2:cuisine:Greek']
+
+
+class QueryLog:
+    '''
+    py2neo Graph stand-in that records the queries it runs, answers node
+    merges with fresh identities and can fail on the `fail_at`th query.
+    '''
+
+    def __init__(self, fail_at=None):
+        self.fail_at = fail_at
+        self.queries = []
+        self.transactions = []
+
+    def run(self, query, **params):
+        if len(self.queries) == self.fail_at:
+            raise ConnectionError("database went away")
+        self.queries.append((query, params))
+        rows = [{'name': row['name'], 'id': 100 + n}
+                for n, row in enumerate(params.get('rows', []))
+                if 'name' in row]
+        return Rows(rows)
+
+    def begin(self):
+        return QueryLog()
+
+    def commit(self, tx):
+        self.transactions.append(tx.queries)
+
+
+class Rows:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def data(self):
+        return self.rows
+
+
+def recipe_relationships(name, ingredients):
+    from py2neo import Node
+
+    recipe = Node('Recipe', name=name, uid=name)
+    return recipe, [
+        (recipe, Node('Ingredient', name=ingredient, uid=ingredient), 1, 'cup')
+        for ingredient in ingredients]
+
+
+def buffered(graph):
+    writer = BulkWriter(graph, batch_size=2)
+    for name, ingredients in (('soup', 'abc'), ('stew', 'de')):
+        recipe, relationships = recipe_relationships(name, ingredients)
+        writer.add_node(recipe)
+        for relationship in relationships:
+            writer.add_node(relationship[1])
+            writer.add_relationship(*relationship)
+        writer.add_complete(recipe)
+    return writer
+
+
+def test_bulk_flush_marks_recipes_complete_after_their_edges():
+    graph = QueryLog()
+    buffered(graph).flush()
+    queries = [query for query, _ in graph.queries]
+    assert queries[-1] == COMPLETE_RECIPES
+    assert graph.queries[-1][1]['ids'] == [100, 101]
+    assert queries.count(MERGE_RELATIONSHIPS) == 3
+    assert queries.index(COMPLETE_RECIPES) > \
+        max(i for i, query in enumerate(queries) if query == MERGE_RELATIONSHIPS)
+
+
+def test_failed_flush_leaves_recipes_incomplete():
+    # Fails on the first edge chunk, after the recipe and ingredient merges
+    graph = QueryLog(fail_at=4)
+    with pytest.raises(ConnectionError):
+        buffered(graph).flush()
+    assert COMPLETE_RECIPES not in [query for query, _ in graph.queries]
+
+
+def test_edges_and_marker_share_a_transaction(graph_builder):
+    builder = benchmark.new_builder(graph_builder, [], False)
+    builder.graph = QueryLog()
+    recipe, relationships = recipe_relationships('soup', 'ab')
+    for n, node in enumerate([recipe] + [row[1] for row in relationships]):
+        node.identity = n
+    builder.create_relationships(recipe, relationships)
+
+    [queries] = builder.graph.transactions
+    assert [query for query, _ in queries] == \
+        [MERGE_RELATIONSHIPS, COMPLETE_RECIPES]
+    assert queries[1][1] == {'ids': [0]}
+    assert 'MERGE (r)-[c:CONTAINS]->(i)' in MERGE_RELATIONSHIPS
@@ -0,0 +1,97 @@
+from py2neo import Node
+
+from bulk_writer import COMPLETE_RECIPES, MERGE_RELATIONSHIPS, BulkWriter
+
+
+class Rows:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def data(self):
+        return self.rows
+
+
+class MergeGraph:
+    '''
+    Answers the BulkWriter queries like Neo4j would: nodes are merged on
+    their uid, and every query is recorded with its parameters.
+    '''
+
+    def __init__(self):
+        self.ids = {}
+        self.queries = []
+
+    def run(self, query, **params):
+        self.queries.append((query, params))
+        if 'MERGE (n:' in query:
+            rows = []
+            for row in params['rows']:
+                id = self.ids.setdefault(row['uid'], len(self.ids))
+                rows.append({'name': row['name'], 'id': id})
+            return Rows(rows)
+        return Rows([])
+
+    def ran(self, query):
+        return [params for text, params in self.queries if text == query]
+
+
+def recipe(name):
+    return Node('Recipe', name=name, uid=f'recipe-{name}')
+
+
+def ingredient(name):
+    return Node('Ingredient', name=name, uid=f'ingredient-{name}')
+
+
+def test_flush_binds_buffered_nodes():
+    graph = MergeGraph()
+    writer = BulkWriter(graph)
+    salt = ingredient('salt')
+    soup = recipe('soup')
+    writer.add_node(soup)
+    writer.add_node(salt)
+    writer.add_relationship(soup, salt, 1.0, 'pinch')
+    assert len(writer) == 3
+    writer.flush()
+
+    assert (soup.identity, salt.identity) == (0, 1)
+    assert soup.graph is graph
+    assert graph.ran(MERGE_RELATIONSHIPS) == [{'rows': [
+        {'recipe': 0, 'ingredient': 1, 'quantity': 1.0, 'measure': 'pinch'}]}]
+    assert len(writer) == 0
+
+
+def test_flush_merges_nodes_written_before():
+    graph = MergeGraph()
+    writer = BulkWriter(graph)
+    writer.add_node(ingredient('salt'))
+    writer.flush()
+    # A recipe written again after a crash reuses the stored ingredient
+    again = ingredient('salt')
+    writer.add_node(again)
+    writer.add_node(ingredient('pepper'))
+    writer.flush()
+    assert again.identity == 0
+    assert graph.ids == {'ingredient-salt': 0, 'ingredient-pepper': 1}
+
+
+def test_flush_writes_in_chunks():
+    graph = MergeGraph()
+    writer = BulkWriter(graph, batch_size=2)
+    soup = recipe('soup')
+    writer.add_node(soup)
+    for name in 'abcde':
+        node = ingredient(name)
+        writer.add_node(node)
+        writer.add_relationship(soup, node, 1.0, 'cup')
+    writer.add_complete(soup)
+    writer.flush()
+
+    merges = [params['rows'] for query, params in graph.queries
+              if 'MERGE (n:Ingredient' in query]
+    assert [len(rows) for rows in merges] == [2, 2, 1]
+    edges = graph.ran(MERGE_RELATIONSHIPS)
+    assert [len(params['rows']) for params in edges] == [2, 2, 1]
+    assert [row['ingredient'] for params in edges
+            for row in params['rows']] == [1, 2, 3, 4, 5]
+    assert graph.ran(COMPLETE_RECIPES) == [{'ids': [0]}]
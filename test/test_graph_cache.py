@@ -0,0 +1,23 @@
+import graph_cache
+
+
+def test_response_cache_drops_entries_of_older_versions():
+    cache = graph_cache.ResponseCache(max_size=2)
+    assert cache.get(1, 'a') is None
+    cache.set(1, 'a', 'A')
+    cache.set(1, 'b', 'B')
+    cache.get(1, 'a')
+    cache.set(1, 'c', 'C')
+    assert cache.get(1, 'b') is None
+    assert cache.get(1, 'a') == 'A'
+
+    assert cache.get(2, 'a') is None
+    # Responses rendered for the old version are not stored
+    cache.set(1, 'a', 'A')
+    assert cache.get(2, 'a') is None
+
+
+def test_etag_depends_on_version_and_key():
+    assert graph_cache.etag_for(1, 'a') == graph_cache.etag_for(1, 'a')
+    assert graph_cache.etag_for(1, 'a') != graph_cache.etag_for(2, 'a')
+    assert graph_cache.etag_for(1, 'a') != graph_cache.etag_for(1, 'b')
@@ -0,0 +1,114 @@
+import random
+
+import pytest
+
+import graph_snapshot
+from fakes import SyntheticGraph
+
+
+class Rows:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def data(self):
+        return self.rows
+
+
+class SnapshotGraph:
+    '''
+    Serves the export queries of graph_snapshot from a SyntheticGraph, with
+    internal ids and row order shuffled by `seed`.
+    '''
+
+    def __init__(self, graph, seed=0):
+        rng = random.Random(seed)
+        uids = list(graph.recipes) + list(graph.ingredients)
+        rng.shuffle(uids)
+        self.ids = {uid: id for id, uid in enumerate(uids)}
+        self.nodes = {
+            label: [{'id': self.ids[uid], 'props': self.props(node)}
+                    for uid, node in nodes.items()]
+            for label, nodes in (('Recipe', graph.recipes),
+                                 ('Ingredient', graph.ingredients))}
+        self.edges = [
+            {'recipe': self.ids[recipe_id], 'ingredient': self.ids[id],
+             'props': {'quantity': float(quantity), 'measure': measure}}
+            for recipe_id, rows in graph.contains.items()
+            for id, quantity, measure in rows]
+        for rows in list(self.nodes.values()) + [self.edges]:
+            rng.shuffle(rows)
+
+    @staticmethod
+    def props(node):
+        return {key: value for key, value in node.items() if key != 'id'}
+
+    def run(self, query):
+        for label, rows in self.nodes.items():
+            if query.startswith(f'MATCH (n:{label})'):
+                return Rows([dict(row) for row in rows])
+        if query == graph_snapshot.CONTAINS:
+            return Rows([dict(row) for row in self.edges])
+        raise NotImplementedError(f'Unexpected query: {query}')
+
+
+@pytest.fixture
+def synthetic():
+    graph = SyntheticGraph(50, 30)
+    recipes = list(graph.recipes.values())
+    # Values the columns cannot hold, and properties without a column
+    recipes[0]['totalTime'] = '1 hour'
+    recipes[1]['rating'] = 4.5
+    recipes[2]['cuisineType'] = []
+    recipes[3]['totalTime'] = 45
+    list(graph.ingredients.values())[0]['aliases'] = ['salt', 'sea salt']
+    return graph
+
+
+def test_round_trip(tmp_path, synthetic):
+    path = str(tmp_path / 'graph.npz')
+    source = SnapshotGraph(synthetic)
+    assert graph_snapshot.export_snapshot(source, path) == (80, 400)
+
+    nodes, edges = graph_snapshot.read_snapshot(path)
+    for label, rows in source.nodes.items():
+        expected = sorted((row['props'] for row in rows),
+                          key=lambda props: props['uid'])
+        assert nodes[label] == expected
+    uids = {label: [props['uid'] for props in rows]
+            for label, rows in nodes.items()}
+    assert sorted(
+        (uids['Recipe'][recipe], uids['Ingredient'][ingredient],
+         props['quantity'], props['measure'])
+        for recipe, ingredient, props in edges) == sorted(
+        (recipe_id, id, float(quantity), measure)
+        for recipe_id, rows in synthetic.contains.items()
+        for id, quantity, measure in rows)
+
+
+def test_snapshots_of_one_graph_are_identical(tmp_path, synthetic):
+    paths = [str(tmp_path / f'{seed}.npz') for seed in range(2)]
+    for seed, path in enumerate(paths):
+        graph_snapshot.export_snapshot(SnapshotGraph(synthetic, seed), path)
+    first, second = (open(path, 'rb').read() for path in paths)
+    assert first == second
+
+
+def test_diff(tmp_path, synthetic):
+    old = str(tmp_path / 'old.npz')
+    new = str(tmp_path / 'new.npz')
+    graph_snapshot.export_snapshot(SnapshotGraph(synthetic), old)
+    recipe_id = next(iter(synthetic.recipes))
+    removed = synthetic.contains[recipe_id].pop()
+    graph_snapshot.export_snapshot(SnapshotGraph(synthetic), new)
+
+    changes = graph_snapshot.diff_snapshots(old, new)
+    assert changes['Recipe'] == (set(), set())
+    assert changes['Ingredient'] == (set(), set())
+    assert changes['CONTAINS'] == (set(), {(recipe_id, removed[0])})
+
+
+def test_unsupported_properties_fail_loudly(tmp_path, synthetic):
+    next(iter(synthetic.recipes.values()))['created'] = object()
+    with pytest.raises(ValueError, match='Recipe.*created'):
+        graph_snapshot.export_snapshot(
+            SnapshotGraph(synthetic), str(tmp_path / 'graph.npz'))
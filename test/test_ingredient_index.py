@@ -0,0 +1,35 @@
+import pytest
+
+import benchmark
+from fakes import SyntheticGraph
+
+
+@pytest.fixture
+def builders(graph_builder):
+    nodes = list(SyntheticGraph(0, 80).ingredients.values())
+    return (benchmark.new_builder(graph_builder, nodes, False),
+            benchmark.new_builder(graph_builder, nodes, True))
+
+
+def test_index_scores_match_calculate_similarity(builders):
+    builder, indexed = builders
+    probes = SyntheticGraph(0, 40, seed=1).ingredients.values()
+    compared = 0
+    for probe in probes:
+        normalized_name = indexed.preprocess_ingredient(probe['name'])
+        nodes, scores = indexed.find_similar_ingredients(normalized_name)
+        for node, score in zip(nodes, scores):
+            expected = builder.calculate_similarity(
+                normalized_name, builder.preprocess_ingredient(node['name']))
+            assert score == pytest.approx(expected, abs=1e-5)
+            compared += 1
+    assert compared
+
+
+def test_index_dedupes_like_cypher(builders):
+    probes = list(SyntheticGraph(0, 40, seed=1).ingredients.values())
+    for probe in probes:
+        query = {'food': probe['name'], 'foodCategory': probe['category']}
+        found = [builder.get_or_create_ingredient_node(query)['uid']
+                 for builder in builders]
+        assert found[0] == found[1], probe['name']
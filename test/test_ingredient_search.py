@@ -0,0 +1,43 @@
+from ingredient_search import PrefixIndex
+
+
+def index():
+    return PrefixIndex([
+        {'id': '1', 'name': 'soy sauce', 'category': 'Condiments', 'recipes': 5},
+        {'id': '2', 'name': 'salt', 'category': 'Spices', 'recipes': 9},
+        {'id': '3', 'name': 'sauce', 'category': 'Condiments', 'recipes': 5},
+        {'id': '4', 'name': 'sausage', 'category': 'Meats', 'recipes': 1},
+        {'id': '5', 'name': 'brown  sugar', 'category': 'Sugars',
+         'recipes': 3},
+    ])
+
+
+def ids(results):
+    return [result['id'] for result in results]
+
+
+def test_prefix_matches_any_word():
+    # Most used first, ties by name
+    assert ids(index().search('sa')) == ['2', '3', '1', '4']
+    assert ids(index().search('sau')) == ['3', '1', '4']
+    assert ids(index().search('sauc')) == ['3', '1']
+
+
+def test_prefix_is_normalized():
+    assert ids(index().search('  SOY   sa')) == ['1']
+    assert ids(index().search('brown sugar')) == ['5']
+
+
+def test_limit_keeps_the_most_used():
+    assert ids(index().search('s', limit=2)) == ['2', '3']
+    assert ids(index().search('sa', limit=1)) == ['2']
+
+
+def test_no_match():
+    assert index().search('pepper') == []
+    assert PrefixIndex([]).search('sa') == []
+
+
+def test_results_carry_recipe_counts():
+    assert index().search('salt') == [
+        {'id': '2', 'name': 'salt', 'category': 'Spices', 'recipeCount': 9}]
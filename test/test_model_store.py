@@ -0,0 +1,105 @@
+import importlib.util
+import os
+
+import pytest
+from gensim.models import Word2Vec
+from gensim.models.phrases import Phraser
+
+import resources
+from model_store import IngestLog, ModelStore
+
+TRAIN_SCRIPT = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'utils',
+    'train_word2vec_model', 'train_ingredient_word2vec_model.py')
+
+SENTENCES = [
+    'olive oil and sea salt', 'fresh olive oil', 'sea salt flakes',
+    'garlic and olive oil', 'black pepper and sea salt',
+] * 4
+
+
+@pytest.fixture(scope='module')
+def train():
+    spec = importlib.util.spec_from_file_location('train', TRAIN_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def publish_first(train, store):
+    sentences = [sentence.split() for sentence in SENTENCES]
+    phrases = train.build_phrases(sentences)
+    phraser = Phraser(phrases)
+    model = Word2Vec(
+        [phraser[sentence] for sentence in sentences], vector_size=8,
+        min_count=1, workers=1, seed=0)
+    return store.publish(model, phraser, phrases, log_offset=0)
+
+
+def test_publish_switches_current_and_keeps_newest(tmp_path, train):
+    store = ModelStore(str(tmp_path))
+    assert store.current() is None
+    versions = [publish_first(train, store) for _ in range(4)]
+    assert versions == [1, 2, 3, 4]
+    assert store.current() == 4
+    assert store.versions() == [2, 3, 4]
+    assert store.manifest(4)['parent'] == 3
+    assert not [name for name in os.listdir(str(tmp_path))
+                if name.startswith('.staging-')]
+
+
+def test_ingest_log_reads_complete_lines_once(tmp_path):
+    log = IngestLog(str(tmp_path / 'ingested.txt'))
+    log.add(['Smoked Paprika, to taste', ''])
+    log.flush()
+    sentences, offset = log.read()
+    assert sentences == [['smoked', 'paprika', 'to', 'taste']]
+    assert offset == log.size()
+
+    with open(log.path, 'a') as file:
+        file.write('half written')
+    assert log.read(offset) == ([], offset)
+
+
+def test_update_models_trains_on_new_sentences_only(tmp_path, train):
+    store = ModelStore(str(tmp_path / 'models'))
+    log = IngestLog(str(tmp_path / 'ingested.txt'))
+    publish_first(train, store)
+    assert train.update_models(store, log) is None
+
+    # One sentence per recipe
+    for _ in range(3):
+        log.add(['smoked paprika', 'sea salt'])
+    log.flush()
+    assert train.update_models(store, log) == 2
+    manifest = store.manifest(2)
+    assert manifest['incremental'] is True
+    assert (manifest['log_offset'], manifest['sentences']) == (log.size(), 3)
+    model = Word2Vec.load(store.path(2, train.WORD2VEC_FILE))
+    # The new words are joined by the updated phrase model
+    assert 'smoked_paprika' in model.wv.key_to_index
+    assert 'olive' in model.wv.key_to_index
+
+    # Sentences are trained on once
+    assert train.update_models(store, log) is None
+
+
+def test_refresh_models_switches_versions(tmp_path, train, monkeypatch):
+    store = ModelStore(str(tmp_path))
+    publish_first(train, store)
+    monkeypatch.setenv('GRAPH_BUILDER_MODEL_DIR', str(tmp_path))
+    monkeypatch.setattr(resources, 'loaded_version', None)
+    monkeypatch.setattr(resources, 'word2vec', resources.LazyResource(
+        'Word2Vec model', resources.load_word2vec))
+    monkeypatch.setattr(resources, 'phrase_model', resources.LazyResource(
+        'Phraser', resources.load_phrase_model))
+
+    assert resources.word2vec_path() == store.path(1, train.WORD2VEC_FILE)
+    resources.word2vec.get()
+    assert resources.refresh_models() is False
+
+    publish_first(train, store)
+    assert resources.refresh_models() is True
+    assert not resources.word2vec.loaded
+    assert resources.phrase_model_path() == store.path(2, 'phrase_model.txt')
+    assert len(resources.word2vec.get().wv) > 0
@@ -0,0 +1,34 @@
+import pytest
+
+from payloads import parse_by_ingredients
+
+
+@pytest.mark.parametrize('body', [
+    None, [], ['a'], 'a', {}, {'ingredientIds': []},
+    {'ingredientIds': 'abc'}, {'ingredientIds': [1, 2]},
+    {'ingredientIds': ['a', None]},
+    {'ingredientIds': ['a'], 'topK': True},
+    {'ingredientIds': ['a'], 'topK': 0},
+    {'ingredientIds': ['a'], 'topK': 2.5},
+    {'ingredientIds': ['a'], 'topK': '3'},
+])
+def test_by_ingredients_rejects(body):
+    ingredient_ids, top_k, error = parse_by_ingredients(body)
+    assert error
+    assert ingredient_ids is None
+
+
+def test_by_ingredients_accepts():
+    assert parse_by_ingredients({'ingredientIds': ['a', 'b'], 'topK': 3}) == \
+        (['a', 'b'], 3, None)
+    assert parse_by_ingredients({'ingredientIds': ['a'], 'topK': None}) == \
+        (['a'], None, None)
+
+
+@pytest.mark.parametrize('body', [
+    ['a'], {'ingredientIds': 'abc'}, {'ingredientIds': ['a'], 'topK': True}])
+def test_by_ingredients_endpoint_answers_bad_bodies_with_400(api, body):
+    response = api.app.test_client().post(
+        '/recipes/by-ingredients', json=body)
+    assert response.status_code == 400
+    assert response.get_json()['message']
@@ -0,0 +1,117 @@
+import json
+
+import benchmark
+from recipe_index import PostingLists, RecipeIndex
+
+
+def by_ingredients(app, ingredient_ids, top_k=None):
+    body = {'ingredientIds': ingredient_ids}
+    if top_k is not None:
+        body['topK'] = top_k
+    response = app.app.test_client().post('/recipes/by-ingredients', json=body)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def normalized(payload):
+    """
+    The parts of a /recipes/by-ingredients payload every engine agrees on.
+    Engines break score ties in different orders, so only the scores of
+    the top recipes are compared.
+    """
+    return {
+        'ingredients': json.loads(payload['ingredientNodes']),
+        'recipes': json.loads(payload['recipeNodes']),
+        'links': sorted(
+            (link['source'], link['target']) for link in payload['links']),
+        'topScores': [score for _, score in payload['topRecipes']],
+    }
+
+
+def run_engines(app, ingredient_ids, top_k=None):
+    payloads = {'paths': by_ingredients(app, ingredient_ids, top_k)}
+    app.RECIPE_SCORING_PUSHDOWN = True
+    payloads['pushdown'] = by_ingredients(app, ingredient_ids, top_k)
+    app.RECIPE_SCORING_PUSHDOWN = False
+    app.recipe_index = RecipeIndex(benchmark.DRIVER)
+    app.recipe_index.refresh()
+    payloads['index'] = by_ingredients(app, ingredient_ids, top_k)
+    return payloads
+
+
+def popular(graph, count):
+    return sorted(graph.part_of, key=lambda id: -len(graph.part_of[id]))[:count]
+
+
+def test_engines_agree(api, graph):
+    payloads = run_engines(api, popular(graph, 6))
+    expected = normalized(payloads['paths'])
+    assert expected['recipes']
+    for engine in ('pushdown', 'index'):
+        assert normalized(payloads[engine]) == expected, engine
+
+
+def test_engines_agree_on_top_k_scores(api, graph):
+    payloads = run_engines(api, popular(graph, 6), top_k=5)
+    scores = {
+        engine: sorted(
+            (recipe['score'] for recipe in
+             json.loads(payload['recipeNodes']).values()), reverse=True)
+        for engine, payload in payloads.items()}
+    assert len(scores['paths']) == 5
+    assert scores['pushdown'] == scores['paths']
+    assert scores['index'] == scores['paths']
+
+
+def test_unknown_ingredients_match_nothing(api):
+    payloads = run_engines(api, ['missing'])
+    for engine, payload in payloads.items():
+        assert json.loads(payload['recipeNodes']) == {}, engine
+
+
+INGREDIENTS = [('a', {'name': 'a'}), ('b', {'name': 'b'}),
+               ('d', {'name': 'd'})]
+RECIPES = [('r1', {'name': 'r1'}), ('r2', {'name': 'r2'}),
+           ('r3', {'name': 'r3'})]
+LINKS = [('a', 'r1'), ('b', 'r1'), ('d', 'r1'), ('b', 'r2'), ('d', 'r2'),
+         ('d', 'r3')]
+# Endpoints missing from the node arrays, e.g. written mid-refresh
+DANGLING = [('c', 'r1'), ('a', 'r0'), ('a', 'r4'), ('e', 'r9'),
+            (None, 'r2'), ('b', None)]
+
+
+def test_dangling_links_are_dropped():
+    index = PostingLists(
+        INGREDIENTS + [(None, {'name': 'legacy'})], RECIPES, LINKS + DANGLING)
+    clean = PostingLists(INGREDIENTS, RECIPES, LINKS)
+    assert index.ingredient_ids.tolist() == ['a', 'b', 'd']
+    assert index.indptr.tolist() == clean.indptr.tolist()
+    assert index.indices.tolist() == clean.indices.tolist()
+
+
+def test_dangling_links_with_unknown_ingredients_only():
+    # Every link of an unknown ingredient used to overflow the bincount
+    index = PostingLists(
+        [('a', {}), ('b', {})], [('r1', {})], [('a', 'r1'), ('c', 'r1')])
+    assert index.indptr.tolist() == [0, 1, 1]
+
+
+def synthetic_postings(graph, extra_links=()):
+    links = [(id, recipe_id) for id, recipe_ids in graph.part_of.items()
+             for recipe_id in recipe_ids]
+    return PostingLists(
+        list(graph.ingredients.items()), list(graph.recipes.items()),
+        links + list(extra_links))
+
+
+def test_dangling_links_do_not_score(graph):
+    selected = popular(graph, 6)
+    first_recipe = min(graph.recipes)
+    # Unknown uids sorting before, between and after the known ones
+    dangling = [(id, recipe_id) for id in selected
+                for recipe_id in ('0', first_recipe + '0', 'z')]
+    dangling += [(id + '0', first_recipe) for id in selected]
+    clean = synthetic_postings(graph).search(selected + ['missing'])
+    index = synthetic_postings(graph, dangling).search(selected + ['missing'])
+    assert clean.recipes
+    assert index == clean
@@ -0,0 +1,92 @@
+import os
+
+import pytest
+
+import response_cache
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache.time, 'time', clock)
+    return clock
+
+
+class Producer:
+    def __init__(self, value):
+        self.value = value
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.value
+
+
+def test_expires_failures_sooner(tmp_path, clock):
+    cache = response_cache.ResponseCache(
+        str(tmp_path), ttl=100, negative_ttl=10)
+    page = Producer({'instructions': ['mix']})
+    failure = Producer(None)
+    cache.fetch('page', 'ok', page)
+    cache.fetch('page', 'failed', failure)
+
+    clock.now += 11
+    cache.fetch('page', 'ok', page)
+    cache.fetch('page', 'failed', failure)
+    assert (page.calls, failure.calls) == (1, 2)
+
+    clock.now += 100
+    assert cache.fetch('page', 'ok', page) == {'instructions': ['mix']}
+    assert page.calls == 2
+
+
+def test_offline_replays_failures(tmp_path, clock):
+    response_cache.ResponseCache(str(tmp_path)).fetch(
+        'page', 'failed', Producer(None))
+    clock.now += 10 ** 6
+    offline = response_cache.ResponseCache(str(tmp_path), offline=True)
+    assert offline.fetch('page', 'failed', Producer('new'), 'miss') is None
+    assert offline.fetch('page', 'unknown', Producer('new'), 'miss') == 'miss'
+
+
+def test_sequences(tmp_path):
+    cache = response_cache.ResponseCache(str(tmp_path))
+    for value in ('first', 'second'):
+        cache.fetch('search', 'q', Producer(value), sequence=True)
+    replay = response_cache.ResponseCache(str(tmp_path), offline=True)
+    assert [replay.fetch('search', 'q', None, sequence=True)
+            for _ in range(3)] == ['first', 'second', None]
+    assert replay.fetch('search', 'q', None, sequence=True,
+                        occurrence=1) == 'second'
+
+
+def test_evicts_least_recently_read(tmp_path):
+    cache = response_cache.ResponseCache(str(tmp_path))
+    cache.fetch('page', 'size', Producer('x' * 100))
+    size = cache._size
+    cache = response_cache.ResponseCache(
+        str(tmp_path / 'evicting'), max_bytes=int(size * 2.5))
+    for age, url in enumerate(('b', 'a')):
+        cache.fetch('page', url, Producer('x' * 100))
+        os.utime(cache._path(cache._key('page', url)), (age, age))
+
+    cache.fetch('page', 'c', Producer('x' * 100))
+    # Down to 90% of the budget, dropping the oldest entry first
+    assert [os.path.exists(cache._path(cache._key('page', url)))
+            for url in ('b', 'a', 'c')] == [False, True, True]
+
+
+def test_overwrites_count_once(tmp_path, clock):
+    cache = response_cache.ResponseCache(str(tmp_path), ttl=10)
+    for _ in range(3):
+        cache.fetch('page', 'ok', Producer({'instructions': ['mix']}))
+        clock.now += 11
+    assert cache._size == sum(size for _, size, _ in cache._entries())
@@ -0,0 +1,64 @@
+import pytest
+from py2neo.errors import Neo4jError
+
+import schema
+
+
+class Rows:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def data(self):
+        return self.rows
+
+
+class SchemaGraph:
+    '''
+    Fails constraint queries with `error` and answers duplicate checks with
+    `duplicates`, recording every query.
+    '''
+
+    def __init__(self, error=None, duplicates=()):
+        self.error = error
+        self.duplicates = list(duplicates)
+        self.queries = []
+
+    def run(self, query, **params):
+        self.queries.append(query)
+        if 'CREATE CONSTRAINT' in query:
+            if self.error:
+                raise Neo4jError.hydrate(
+                    {'code': f'Neo.ClientError.Schema.{self.error}',
+                     'message': self.error})
+            return Rows([])
+        if 'AS duplicates' in query:
+            return Rows(self.duplicates)
+        if 'IS NULL' in query:
+            return Rows([{'id': 1, 'props': {'name': 'Salt'}},
+                         {'id': 2, 'props': {'name': 'salt'}}])
+        return Rows([])
+
+
+def test_existing_constraints_are_skipped():
+    graph = SchemaGraph('EquivalentSchemaRuleAlreadyExists')
+    schema.create_constraints(graph)
+    assert len(graph.queries) == len(schema.CONSTRAINTS)
+
+
+def test_other_constraint_errors_are_raised():
+    with pytest.raises(Neo4jError, match='ConstraintCreationFailed'):
+        schema.create_constraints(SchemaGraph('ConstraintCreationFailed'))
+
+
+def test_backfill_fails_on_duplicates():
+    graph = SchemaGraph(duplicates=[{'value': 'salt', 'duplicates': 2}])
+    with pytest.raises(RuntimeError, match="Ingredient.key.*'salt' \\(2"):
+        schema.backfill(graph, 'Ingredient', 'key',
+                        lambda props: {'key': props['name'].lower()})
+
+
+def test_backfill_without_duplicates():
+    graph = SchemaGraph()
+    assert schema.backfill(
+        graph, 'Ingredient', 'key',
+        lambda props: {'key': props['name']}) == 2
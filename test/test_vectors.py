@@ -0,0 +1,205 @@
+import numpy as np
+import pytest
+from gensim.models import KeyedVectors
+
+import benchmark
+from fakes import fake_models
+from vector_index import VectorIndex
+
+
+def save_unit_vectors(path, vectors):
+    matrix = np.array(list(vectors.values()), dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    exported = KeyedVectors(matrix.shape[1])
+    exported.add_vectors(list(vectors), matrix)
+    exported.save(path, separately=['vectors'])
+    return VectorIndex(path)
+
+
+@pytest.fixture
+def stale_vectors(api, graph, tmp_path):
+    """
+    Ingredient and recipe vectors where the nodes closest to the first
+    ingredient and recipe were deleted from the graph after the export.
+    """
+    indexes = {}
+    for name, nodes in (('ingredient', graph.ingredients),
+                        ('recipe', graph.recipes)):
+        vectors = {id: [1.0, 0.1 + i] for i, id in enumerate(nodes)}
+        vectors.update({f'deleted{i}': [1.0, 0.01 * i] for i in range(1, 6)})
+        indexes[name] = save_unit_vectors(
+            str(tmp_path / f'{name}_vectors.kv'), vectors)
+    api.ingredient_vectors = indexes['ingredient']
+    api.recipe_vectors = indexes['recipe']
+    yield
+    api.ingredient_vectors = None
+    api.recipe_vectors = None
+
+
+@pytest.mark.parametrize('route, nodes', [
+    ('/ingredients/{}/substitutes', 'ingredients'),
+    ('/recipes/{}/similar', 'recipes'),
+])
+def test_deleted_neighbours_are_replaced(api, graph, stale_vectors,
+                                         route, nodes):
+    ids = list(getattr(graph, nodes))
+    response = api.app.test_client().get(
+        route.format(ids[0]) + '?limit=5')
+    assert response.status_code == 200
+    assert [node['id'] for node in response.get_json()] == ids[1:6]
+
+
+@pytest.fixture
+def ingredient_vectors(api, graph, tmp_path):
+    """
+    Random vectors for every ingredient but the last, which stands for one
+    with no in-vocab token at export time.
+    """
+    path = str(tmp_path / 'ingredient_vectors.kv')
+    benchmark.save_vectors(path, list(graph.ingredients)[:-1], vector_size=16)
+    api.ingredient_vectors = VectorIndex(path)
+    yield api.ingredient_vectors
+    api.ingredient_vectors = None
+
+
+def test_nearest_matches_brute_force(tmp_path):
+    path = str(tmp_path / 'vectors.kv')
+    keys = [f'key{i}' for i in range(50)]
+    benchmark.save_vectors(path, keys, vector_size=16)
+    index = VectorIndex(path)
+    assert isinstance(index.matrix, np.memmap)
+
+    matrix = np.array(index.matrix)
+    scores = matrix @ matrix[3]
+    expected = [keys[i] for i in np.argsort(-scores) if i != 3][:7]
+    neighbours = index.nearest('key3', 7)
+    assert [key for key, _ in neighbours] == expected
+    assert [similarity for _, similarity in neighbours] == pytest.approx(
+        [float(scores[keys.index(key)]) for key in expected])
+    assert len(index.nearest('key3', 100)) == 49
+
+
+def test_substitutes(api, graph, ingredient_vectors):
+    client = api.app.test_client()
+    id = next(iter(graph.ingredients))
+    response = client.get(f'/ingredients/{id}/substitutes?limit=4')
+    assert response.status_code == 200
+    substitutes = response.get_json()
+    assert [substitute['id'] for substitute in substitutes] == [
+        key for key, _ in ingredient_vectors.nearest(id, 4)]
+    assert substitutes[0]['name'] == \
+        graph.ingredients[substitutes[0]['id']]['name']
+    similarities = [substitute['similarity'] for substitute in substitutes]
+    assert similarities == sorted(similarities, reverse=True)
+    assert len(client.get(f'/ingredients/{id}/substitutes').get_json()) == 10
+
+
+def test_substitutes_of_unembedded_and_unknown_ingredients(
+        api, graph, ingredient_vectors):
+    client = api.app.test_client()
+    unembedded = list(graph.ingredients)[-1]
+    response = client.get(f'/ingredients/{unembedded}/substitutes')
+    assert (response.status_code, response.get_json()) == (200, [])
+    assert client.get('/ingredients/missing/substitutes').status_code == 404
+
+
+@pytest.mark.parametrize('limit', [0, 101])
+def test_substitutes_limit(api, graph, ingredient_vectors, limit):
+    id = next(iter(graph.ingredients))
+    response = api.app.test_client().get(
+        f'/ingredients/{id}/substitutes?limit={limit}')
+    assert response.status_code == 400
+
+
+def test_substitutes_without_vectors(api, graph):
+    id = next(iter(graph.ingredients))
+    response = api.app.test_client().get(f'/ingredients/{id}/substitutes')
+    assert response.status_code == 503
+
+
+class Rows:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def data(self):
+        return self.rows
+
+
+class ExportGraph:
+    '''
+    Answers the export_vectors queries from a SyntheticGraph.
+    '''
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def run(self, query):
+        if 'RETURN i.uid AS uid, i.key AS key' in query:
+            return Rows([{'uid': id, 'key': node['key']}
+                         for id, node in self.graph.ingredients.items()])
+        if 'collect(i.uid) AS ingredients' in query:
+            return Rows([
+                {'uid': recipe_id, 'ingredients': [id for id, _, _ in rows]}
+                for recipe_id, rows in self.graph.contains.items()])
+        raise NotImplementedError(f'Unexpected query: {query}')
+
+
+@pytest.fixture
+def exported(api, graph, tmp_path):
+    """
+    The graph's ingredient and recipe vectors, exported with the fake
+    models and served by the app.
+    """
+    import export_vectors
+
+    wv, phrase_model = fake_models()
+    ingredients = export_vectors.ingredient_vectors(
+        ExportGraph(graph), wv.wv, phrase_model)
+    recipes = export_vectors.recipe_vectors(ExportGraph(graph), ingredients)
+    path = str(tmp_path / 'recipe_vectors.kv')
+    recipes.save(path, separately=['vectors'])
+    api.recipe_vectors = VectorIndex(path)
+    yield ingredients, recipes
+    api.recipe_vectors = None
+
+
+def test_recipes_embed_their_ingredients(graph, exported):
+    ingredients, recipes = exported
+    assert len(recipes) == len(graph.recipes)
+    for recipe_id, rows in list(graph.contains.items())[:10]:
+        vector = sum(ingredients[id] for id, _, _ in rows)
+        assert recipes[recipe_id] == pytest.approx(
+            vector / np.linalg.norm(vector), abs=1e-6)
+
+
+def test_similar_recipes(api, graph, exported):
+    _, recipes = exported
+    id = next(iter(graph.recipes))
+    response = api.app.test_client().get(f'/recipes/{id}/similar?limit=5')
+    assert response.status_code == 200
+    similar = response.get_json()
+
+    scores = recipes.vectors @ recipes[id]
+    expected = [recipes.index_to_key[i] for i in np.argsort(-scores)
+                if recipes.index_to_key[i] != id][:5]
+    assert [recipe['id'] for recipe in similar] == expected
+    assert similar[0]['name'] == graph.recipes[expected[0]]['name']
+    assert [recipe['similarity'] for recipe in similar] == pytest.approx(
+        [float(scores[recipes.key_to_index[key]]) for key in expected],
+        abs=1e-6)
+
+
+def test_similar_recipes_of_unembedded_and_unknown_recipes(
+        api, graph, exported):
+    client = api.app.test_client()
+    graph.recipes['unembedded'] = dict(
+        next(iter(graph.recipes.values())), id='unembedded', uid='unembedded')
+    response = client.get('/recipes/unembedded/similar')
+    assert (response.status_code, response.get_json()) == (200, [])
+    assert client.get('/recipes/missing/similar').status_code == 404
+
+
+def test_similar_recipes_without_vectors(api, graph):
+    id = next(iter(graph.recipes))
+    response = api.app.test_client().get(f'/recipes/{id}/similar')
+    assert response.status_code == 503
@@ -0,0 +1,280 @@
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+
+from recipe_scraper import RecipeScraper, SharedDomainSlots
+from recipe_search import RecipeSearch
+from response_cache import ResponseCache
+
+
+class SeenRecipes:
+    '''
+    Labels and URLs of the recipes a build already handled, whether they
+    were written or skipped for lacking a page, so they are skipped without
+    a database round trip. Recipes in the graph only count once they are
+    marked complete, which happens with their last CONTAINS edges, so a
+    recipe a crashed build left partly written is built again.
+    '''
+
+    def __init__(self, labels=(), urls=()):
+        self.labels = set(labels)
+        self.urls = set(urls)
+
+    @classmethod
+    def prefetch(cls, graph):
+        start = time.time()
+        records = graph.run(
+            "MATCH (r:Recipe) WHERE r.complete "
+            "RETURN r.name AS name, r.url AS url").data()
+        seen = cls(
+            (record['name'] for record in records if record['name']),
+            (record['url'] for record in records if record['url']))
+        print(
+            f"Prefetched {len(records)} recipe keys in {time.time() - start:.2f} seconds")
+        return seen
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __contains__(self, recipe):
+        return recipe['label'] in self.labels or recipe['url'] in self.urls
+
+    def add(self, recipe):
+        self.labels.add(recipe['label'])
+        self.urls.add(recipe['url'])
+
+    def update(self, other):
+        self.labels |= other.labels
+        self.urls |= other.urls
+
+
+class BuildCheckpoint:
+    '''
+    Progress of a build: the round, the queries completed in it and the
+    recipes seen so far. With a `path`, it is saved atomically after every
+    completed query, so a crashed build resumes with the query it was on.
+    '''
+
+    def __init__(self, path=None):
+        self.path = path
+        self.round = 0
+        self.completed = []
+        # Node count when the round started
+        self.start_count = None
+        self.seen = SeenRecipes()
+        if path:
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as file:
+                saved = json.load(file)
+        except (OSError, ValueError):
+            return
+        self.round = saved['round']
+        self.completed = saved['completed']
+        self.start_count = saved.get('start_count')
+        self.seen = SeenRecipes(saved['labels'], saved['urls'])
+        print(
+            f"Resuming round {self.round} after {len(self.completed)} queries, "
+            f"{len(self.seen)} recipes seen")
+
+    def save(self):
+        if not self.path:
+            return
+        saved = {
+            'round': self.round,
+            'completed': self.completed,
+            'start_count': self.start_count,
+            'labels': sorted(self.seen.labels),
+            'urls': sorted(self.seen.urls),
+        }
+        directory = os.path.dirname(os.path.abspath(self.path))
+        # Write to a temporary file first so a crash never leaves half a checkpoint
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'w') as file:
+            json.dump(saved, file)
+        os.replace(tmp, self.path)
+
+    def complete(self, step):
+        self.completed.append(step)
+        self.save()
+
+    def next_round(self):
+        self.round += 1
+        self.completed = []
+        self.start_count = None
+        self.save()
+
+
+class BuildRunner:
+    '''
+    Runs rounds of cuisine and ingredient searches through a GraphBuilder
+    until the graph has `target_nodes` nodes, checkpointing after each
+    search. Recipes already in the graph or in the checkpoint are skipped
+    up front.
+    '''
+
+    NODE_COUNT = """
+    MATCH (n)
+    RETURN count(n) AS nodeCount
+    """
+
+    def __init__(self, graph_builder, checkpoint, target_nodes=5000,
+                 offline=False):
+        self.graph_builder = graph_builder
+        self.checkpoint = checkpoint
+        self.target_nodes = target_nodes
+        self.offline = offline
+
+        seen = SeenRecipes.prefetch(graph_builder.graph)
+        seen.update(checkpoint.seen)
+        # Shared, so every recipe the builder handles lands in the checkpoint
+        checkpoint.seen = seen
+        graph_builder.seen_recipes = seen
+
+    def node_count(self):
+        return self.graph_builder.graph.run(
+            self.NODE_COUNT).data()[0]['nodeCount']
+
+    def steps(self, queries):
+        """
+        Returns the (step, kind, value, occurrence) searches of this round
+        not completed yet. A search repeated within or across rounds gets
+        the next occurrence, so its cached random results replay the same
+        however the build was interrupted or split up.
+        """
+        repeats = {}
+        for kind, value in queries:
+            repeats[(kind, value)] = repeats.get((kind, value), 0) + 1
+        seen = {}
+        steps = []
+        for position, (kind, value) in enumerate(queries):
+            index = seen.get((kind, value), 0)
+            seen[(kind, value)] = index + 1
+            # Positions tell repeated queries in a round apart
+            step = f"{position}:{kind}:{value}"
+            if step not in self.checkpoint.completed:
+                occurrence = self.checkpoint.round * repeats[(kind, value)] + index
+                steps.append((step, kind, value, occurrence))
+        return steps
+
+    def run_query(self, kind, value, occurrence):
+        if kind == 'cuisine':
+            self.graph_builder.build_knowledge_graph_by_cuisine(
+                value, occurrence)
+        elif kind == 'ingredient':
+            self.graph_builder.build_knowledge_graph_by_ingredient(value)
+        else:
+            raise ValueError(f"Unknown build query: {kind}")
+
+    def run_round(self, steps):
+        for step, kind, value, occurrence in steps:
+            lap = time.time()
+            self.run_query(kind, value, occurrence)
+            self.checkpoint.complete(step)
+            print(f"Time to build {value}: {time.time() - lap:.2f} seconds")
+
+    def run(self, queries):
+        """
+        Builds rounds of `queries`, a list of (kind, value) pairs where kind
+        is 'cuisine' or 'ingredient', and returns the final node count.
+        """
+        while True:
+            node_count = self.node_count()
+            if node_count > self.target_nodes:
+                return node_count
+            if self.checkpoint.start_count is None:
+                self.checkpoint.start_count = node_count
+                self.checkpoint.save()
+
+            start = time.time()
+            self.run_round(self.steps(queries))
+
+            node_count = self.node_count()
+            print(f"Current node count: {node_count}")
+            print(
+                f"Time to build round {self.checkpoint.round}: {time.time() - start:.2f} seconds")
+            # A replay cannot grow the graph once the cache is exhausted
+            grew = node_count != self.checkpoint.start_count
+            self.checkpoint.next_round()
+            if self.offline and not grew:
+                print("Replayed every cached response")
+                return node_count
+
+
+# State of a build worker process, set up once by init_worker
+worker = {}
+
+
+def init_worker(config, labels, urls, domain_slots=None):
+    cache = None
+    if config['cache_dir']:
+        cache = ResponseCache(
+            config['cache_dir'], ttl=config['cache_ttl'],
+            max_bytes=config['cache_max_bytes'], offline=config['offline'],
+            negative_ttl=config['cache_negative_ttl'])
+    worker['search'] = RecipeSearch(cache)
+    worker['scraper'] = RecipeScraper(
+        config['scrape_workers'], config['scrape_per_domain'],
+        config['scrape_timeout'], cache=cache, domain_slots=domain_slots)
+    worker['seen'] = SeenRecipes(labels, urls)
+
+
+def fetch_step(step):
+    """
+    Runs one search in a worker process and scrapes the pages of its new
+    recipes. Returns the step, the recipes and their pages by URL.
+    """
+    step, kind, value, occurrence = step
+    search = worker['search']
+    if kind == 'cuisine':
+        recipes = search.by_cuisine(value, occurrence)
+    elif kind == 'ingredient':
+        recipes = search.by_ingredient(value)
+    else:
+        raise ValueError(f"Unknown build query: {kind}")
+
+    urls = {recipe['recipe']['url'] for recipe in recipes
+            if recipe['recipe'] not in worker['seen']}
+    futures = worker['scraper'].prefetch(sorted(urls))
+    return step, recipes, {
+        url: future.result() for url, future in futures.items()}
+
+
+class ParallelBuildRunner(BuildRunner):
+    '''
+    BuildRunner that spreads the searches of a round, and the scraping of
+    their pages, across `workers` processes. Every result is still written
+    by the one GraphBuilder of this process, in query order, so ingredient
+    dedupe and writes never race and checkpoints stay ordered. The workers
+    share their per-domain scrape slots, so no site sees more than
+    `scrape_per_domain` requests at a time from the whole build.
+    '''
+
+    def __init__(self, graph_builder, checkpoint, workers, worker_config,
+                 **kwargs):
+        super().__init__(graph_builder, checkpoint, **kwargs)
+        self.workers = workers
+        self.worker_config = worker_config
+
+    def run_round(self, steps):
+        seen = self.checkpoint.seen
+        with multiprocessing.Manager() as manager:
+            domain_slots = SharedDomainSlots(
+                manager, self.worker_config['scrape_per_domain'])
+            with multiprocessing.Pool(
+                    self.workers, initializer=init_worker,
+                    initargs=(self.worker_config, seen.labels, seen.urls,
+                              domain_slots)) as pool:
+                lap = time.time()
+                # Workers run ahead while results are written in order
+                for step, recipes, pages in pool.imap(fetch_step, steps):
+                    print(f"Found {len(recipes)} recipes for {step}")
+                    self.graph_builder.build_recipes(recipes, pages)
+                    self.checkpoint.complete(step)
+                    print(
+                        f"Time to build {step}: {time.time() - lap:.2f} seconds")
+                    lap = time.time()
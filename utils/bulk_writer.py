@@ -0,0 +1,112 @@
+# Edges are merged on their endpoints, so writing a recipe again after a
+# crash does not duplicate them
+MERGE_RELATIONSHIPS = """
+UNWIND $rows AS row
+MATCH (r:Recipe) WHERE ID(r) = row.recipe
+MATCH (i:Ingredient) WHERE ID(i) = row.ingredient
+MERGE (r)-[c:CONTAINS]->(i)
+SET c.quantity = row.quantity, c.measure = row.measure
+MERGE (i)-[p:PART_OF]->(r)
+SET p.quantity = row.quantity, p.measure = row.measure
+"""
+
+# Set once every edge of a recipe is written; resumed builds only skip
+# complete recipes
+COMPLETE_RECIPES = """
+UNWIND $ids AS id
+MATCH (r:Recipe) WHERE ID(r) = id
+SET r.complete = true
+"""
+
+
+def relationship_rows(relationships):
+    return [
+        {
+            'recipe': recipe_node.identity,
+            'ingredient': ingredient_node.identity,
+            'quantity': quantity,
+            'measure': measure
+        }
+        for recipe_node, ingredient_node, quantity, measure in relationships]
+
+
+def chunks(rows, size):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+class BulkWriter:
+    '''
+    Buffers the nodes and relationships created by GraphBuilder and writes
+    them with a few parameterized UNWIND queries per batch, instead of one
+    round trip and transaction per `graph.create`.
+    '''
+
+    def __init__(self, graph, batch_size=500):
+        self.graph = graph
+        self.batch_size = batch_size
+        # Pending nodes by name, so lookups can see them before a flush
+        self.recipes = {}
+        self.ingredients = {}
+        self.relationships = []
+        # Recipes whose relationships are all buffered
+        self.complete = []
+
+    def __len__(self):
+        return len(self.recipes) + len(self.ingredients) + \
+            len(self.relationships)
+
+    def add_node(self, node):
+        if node.has_label("Recipe"):
+            self.recipes[node['name']] = node
+        else:
+            self.ingredients[node['name']] = node
+
+    def add_relationship(
+            self, recipe_node, ingredient_node, quantity, measure):
+        self.relationships.append(
+            (recipe_node, ingredient_node, quantity, measure))
+
+    def add_complete(self, recipe_node):
+        self.complete.append(recipe_node)
+
+    def _merge_nodes(self, label, nodes):
+        # Nodes are merged on their unique external id
+        query = f"""
+        UNWIND $rows AS row
+        MERGE (n:{label} {{uid: row.uid}})
+        ON CREATE SET n += row.props
+        RETURN row.name AS name, ID(n) AS id
+        """
+        rows = [{'name': node['name'], 'uid': node['uid'], 'props': dict(node)}
+                for node in nodes.values()]
+        for chunk in chunks(rows, self.batch_size):
+            for record in self.graph.run(query, rows=chunk).data():
+                # Bind the buffered node as if it had been created directly
+                node = nodes[record['name']]
+                node.graph = self.graph
+                node.identity = record['id']
+
+    def _merge_relationships(self):
+        rows = relationship_rows(self.relationships)
+        for chunk in chunks(rows, self.batch_size):
+            self.graph.run(MERGE_RELATIONSHIPS, rows=chunk)
+
+    def _mark_complete(self):
+        ids = [recipe_node.identity for recipe_node in self.complete]
+        for chunk in chunks(ids, self.batch_size):
+            self.graph.run(COMPLETE_RECIPES, ids=chunk)
+
+    def flush(self):
+        # Nodes first, so every relationship endpoint has an identity
+        self._merge_nodes("Recipe", self.recipes)
+        self._merge_nodes("Ingredient", self.ingredients)
+        self._merge_relationships()
+        # Only after the last relationship chunk, so a crash mid-flush
+        # leaves its recipes incomplete
+        self._mark_complete()
+
+        self.recipes = {}
+        self.ingredients = {}
+        self.relationships = []
+        self.complete = []
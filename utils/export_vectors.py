@@ -0,0 +1,98 @@
+'''
+Exports the Word2Vec embeddings of the ingredients and recipes in the graph
+for the API's /ingredients/<id>/substitutes and /recipes/<id>/similar
+endpoints. Run from the `utils` directory after building the graph:
+
+    python export_vectors.py ingredient_vectors.kv recipe_vectors.kv
+
+Each ingredient is embedded as the normalized sum of the unit vectors of
+its phrase tokens, the same embedding the dedupe index uses, and keyed by
+its uid. Ingredients with no in-vocab token are left out. Each recipe is
+embedded as the normalized sum of its ingredients' embeddings, so recipes
+sharing similar ingredients are close. The vectors are saved as a separate
+.npy file next to each output, so the API can memory map them instead of
+loading the whole model.
+'''
+import os
+import sys
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+from gensim.models import KeyedVectors
+from py2neo import Graph
+
+import resources
+from ingredient_index import embed
+
+
+def ingredient_vectors(graph, wv, phrase_model):
+    """
+    Returns KeyedVectors of the unit embeddings of the graph's ingredients,
+    keyed by uid.
+    """
+    uids = []
+    vectors = []
+    records = graph.run(
+        "MATCH (i:Ingredient) RETURN i.uid AS uid, i.key AS key").data()
+    for record in records:
+        if not record['uid'] or not record['key']:
+            continue
+        vector, _, _ = embed(wv, phrase_model, record['key'])
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            uids.append(record['uid'])
+            vectors.append(vector / norm)
+
+    exported = KeyedVectors(wv.vector_size)
+    if uids:
+        exported.add_vectors(uids, np.array(vectors, dtype=np.float32))
+    print(f"Embedded {len(uids)} of {len(records)} ingredients")
+    return exported
+
+
+def recipe_vectors(graph, ingredients):
+    """
+    Returns KeyedVectors of the unit embeddings of the graph's recipes,
+    keyed by uid, given the ingredient KeyedVectors.
+    """
+    uids = []
+    vectors = []
+    records = graph.run("""
+    MATCH (r:Recipe)-[:CONTAINS]->(i:Ingredient)
+    RETURN r.uid AS uid, collect(i.uid) AS ingredients
+    """).data()
+    for record in records:
+        rows = [ingredients.key_to_index[uid] for uid in record['ingredients']
+                if uid in ingredients.key_to_index]
+        if not record['uid'] or not rows:
+            continue
+        vector = ingredients.vectors[rows].sum(axis=0)
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            uids.append(record['uid'])
+            vectors.append(vector / norm)
+
+    exported = KeyedVectors(ingredients.vector_size)
+    if uids:
+        exported.add_vectors(uids, np.array(vectors, dtype=np.float32))
+    print(f"Embedded {len(uids)} of {len(records)} recipes")
+    return exported
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    output = sys.argv[1] if len(sys.argv) > 1 else "ingredient_vectors.kv"
+    recipe_output = sys.argv[2] if len(sys.argv) > 2 else "recipe_vectors.kv"
+
+    start = time.time()
+    graph = Graph(os.getenv("NEO4J_URI"),
+                  auth=(os.getenv("NEO4J_USER"), os.getenv("NEO4J_PASSWORD")))
+
+    vectors = ingredient_vectors(
+        graph, resources.word2vec.get().wv, resources.phrase_model.get())
+    # Always a separate .npy, which is what KeyedVectors.load can mmap
+    vectors.save(output, separately=['vectors'])
+    recipe_vectors(graph, vectors).save(recipe_output, separately=['vectors'])
+    print(
+        f"Saved {output} and {recipe_output} in {time.time() - start:.2f} seconds")
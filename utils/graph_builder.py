@@ -1,26 +1,26 @@
 import os
-from py2neo import Graph, Node, Relationship
-from recipe_scrapers import scrape_me
-import requests
-from dotenv import load_dotenv
-from nltk.stem import WordNetLemmatizer
-import spacy
+from concurrent.futures import Future
+from py2neo import Graph, Node
 import numpy as np
-from gensim.models import Word2Vec
-from gensim.models.phrases import Phrases, Phraser
 
 import time
 
-load_dotenv()
-APP_ID = os.getenv("EDAMAM_APP_ID")
-APP_KEY = os.getenv("EDAMAM_APP_KEY")
-BASE_URL = os.getenv("EDAMAM_BASE_URL")
+from build_runner import (BuildCheckpoint, BuildRunner, ParallelBuildRunner,
+                          SeenRecipes)
+from bulk_writer import (COMPLETE_RECIPES, MERGE_RELATIONSHIPS, BulkWriter,
+                         relationship_rows)
+import resources
+import schema
+from ingredient_index import IngredientIndex
+from ingredient_normalizer import IngredientNormalizer
+from model_store import IngestLog
+from recipe_scraper import RecipeScraper
+from recipe_search import RecipeSearch
+from response_cache import ResponseCache
 
-
-# Load your Word2Vec model
-model = Word2Vec.load("phrases_ingredient_word2vec.model")
-phrase_model = Phraser.load("phrase_model.txt")
-print("Model loaded successfully")
+# Page of a recipe that was not scraped ahead of time. A prefetched page of
+# None is a failed scrape, which is not retried.
+NOT_PREFETCHED = object()
 
 
 class GraphBuilder:
@@ -30,58 +30,137 @@ class GraphBuilder:
     only be run once.
     '''
 
-    def __init__(self, uri, user, password):
+    def __init__(self, uri, user, password, bulk=False, batch_size=500,
+                 dedupe_index=False, scrape_workers=8, scrape_per_domain=2,
+                 scrape_timeout=10, cache=None, normalizer=None,
+                 ingest_log=None):
         self.graph = Graph(uri, auth=(user, password))
-        self.nlp = spacy.load(
-            "en_core_web_sm", exclude=["ner", "textcat"])
+        # Memoized name -> lemmatized name -> phrase tokens
+        self.normalizer = normalizer or IngredientNormalizer()
+        # Text of new recipes, for incremental model training
+        self.ingest_log = ingest_log
+        # Optional local index of handled recipes, set by BuildRunner
+        self.seen_recipes = None
         self.avoided_dedupes = []
         self.dodgy_dedupes = []
+        # In bulk mode writes are buffered and flushed in batches
+        self.writer = BulkWriter(self.graph, batch_size) if bulk else None
+        # Whether the graph changed since its version was last bumped
+        self.dirty = False
+        # Optionally dedupe ingredients in memory instead of scanning the graph
+        self.ingredient_index = None
+        if dedupe_index:
+            self.ingredient_index = self.load_ingredient_index()
+        # Optional on-disk cache of Edamam responses and scraped pages
+        self.cache = cache
+        self.search = RecipeSearch(cache)
+        self.scraper = RecipeScraper(
+            scrape_workers, scrape_per_domain, scrape_timeout, cache=cache)
+        self.migrate_schema()
+
+    def migrate_schema(self):
+        """
+        Backfills the `key` and `uid` properties of nodes created before they
+        existed, then creates the uniqueness constraints and their indexes.
+        Recipes written before the `complete` marker existed count as
+        complete once they have ingredients; newer recipes are created with
+        `complete` false, so a recipe cut short by a crash is never mistaken
+        for one of them.
+        """
+        start = time.time()
+        updated = schema.backfill(
+            self.graph, "Ingredient", "uid",
+            lambda props: schema.ingredient_properties(
+                self.preprocess_ingredient(props['name'])))
+        updated += schema.backfill(
+            self.graph, "Recipe", "uid",
+            lambda props: schema.recipe_properties(
+                props.get('url') or props['name']))
+        schema.create_constraints(self.graph)
+        self.graph.run("""
+        MATCH (r:Recipe) WHERE r.complete IS NULL AND (r)-[:CONTAINS]->()
+        SET r.complete = true
+        """)
+        if updated:
+            # Node ids served by the API changed
+            self.bump_graph_version()
+        print(
+            f"Migrated schema of {updated} nodes in {pretty_print_time(time.time() - start)}")
+
+    def load_ingredient_index(self):
+        start = time.time()
+        ingredient_index = IngredientIndex(
+            resources.word2vec.get().wv, resources.phrase_model.get(),
+            self.preprocess_ingredient)
+        for record in self.graph.run("MATCH (i:Ingredient) RETURN i"):
+            ingredient_index.add(record['i'])
+        print(
+            f"Indexed {len(ingredient_index)} ingredients in {pretty_print_time(time.time() - start)}")
+        return ingredient_index
+
+    def create_node(self, node):
+        self.dirty = True
+        if self.writer:
+            self.writer.add_node(node)
+        else:
+            # Merged on the unique uid, so concurrent builders cannot fork
+            # an ingredient or recipe
+            label = "Recipe" if node.has_label("Recipe") else "Ingredient"
+            self.graph.merge(node, label, "uid")
+        if self.ingredient_index is not None and node.has_label("Ingredient"):
+            self.ingredient_index.add(node)
+
+    def flush(self):
+        if self.writer:
+            self.writer.flush()
+        if self.dirty:
+            self.bump_graph_version()
+        self.normalizer.save()
+        if self.ingest_log:
+            self.ingest_log.flush()
+
+    def refresh_models(self):
+        """
+        Hot-swaps in a newer published model version, dropping what was
+        derived from the old one.
+        """
+        if not resources.refresh_models():
+            return
+        self.normalizer.refresh()
+        if self.ingredient_index is not None:
+            self.ingredient_index = self.load_ingredient_index()
+
+    def bump_graph_version(self):
+        # Lets the API drop responses cached for the previous version
+        query = """
+        MERGE (m:GraphMeta {name: 'graph'})
+        SET m.version = coalesce(m.version, 0) + 1, m.updatedAt = timestamp()
+        RETURN m.version AS version
+        """
+        version = self.graph.run(query).data()[0]['version']
+        self.dirty = False
+        return version
+
+    def search_recipes(self, params, sequence=False):
+        return self.search.search(params, sequence=sequence)
 
     def search_recipes_by_ingredient(self, ingredient):
-        endpoint = f'{BASE_URL}/'
-        params = {
-            'type': 'public',
-            'q': ingredient,
-            'app_id': APP_ID,
-            'app_key': APP_KEY
-        }
-        response = requests.get(endpoint, params=params)
-        data = response.json()
-
-        return data.get('hits', [])
-
-    def search_recipes_by_cuisine(self, cuisine):
-        endpoint = f'{BASE_URL}/'
-        params = {
-            'type': 'public',
-            'cuisineType': cuisine,
-            'random': 'true',
-            'app_id': APP_ID,
-            'app_key': APP_KEY
-        }
-        response = requests.get(endpoint, params=params)
-        data = response.json()
-
-        return data.get('hits', [])
+        return self.search.by_ingredient(ingredient)
 
-    def preprocess_ingredient(self, ingredient):
-        # Normalize case
-        ingredient = ingredient.lower()
+    def search_recipes_by_cuisine(self, cuisine, occurrence=None):
+        return self.search.by_cuisine(cuisine, occurrence)
 
-        # Lemmatize to reduce words to their base form
-        lemmatizer = WordNetLemmatizer()
-        lemmatized = [
-            lemmatizer.lemmatize(token)
-            for token in ingredient.split(' ')]
-        return ' '.join(lemmatized)
+    def preprocess_ingredient(self, ingredient):
+        # Lowercased and lemmatized to base forms, memoized per name
+        return self.normalizer.normalize(ingredient)
 
     def calculate_similarity(self, word1, word2):
         # Tokenize the input words and generate phrases
-        tokens_word1 = word1.split()
-        tokens_word2 = word2.split()
+        tokens_word1 = self.normalizer.tokens(word1)
+        tokens_word2 = self.normalizer.tokens(word2)
 
-        tokens_word1 = phrase_model[tokens_word1]
-        tokens_word2 = phrase_model[tokens_word2]
+        # Loaded on first use and shared by every builder
+        wv = resources.word2vec.get().wv
 
         similarity_scores = []
 
@@ -90,8 +169,8 @@ class GraphBuilder:
                 # Must have at least one equivalent token to compare
                 if token1 == token2:
                     similarity_scores.append(1)
-                elif token1 in model.wv.key_to_index and token2 in model.wv.key_to_index:
-                    similarity_score = model.wv.similarity(
+                elif token1 in wv.key_to_index and token2 in wv.key_to_index:
+                    similarity_score = wv.similarity(
                         token1, token2)
                     similarity_scores.append(similarity_score)
                 else:
@@ -100,52 +179,74 @@ class GraphBuilder:
         return sum(
             similarity_scores) / len(similarity_scores) if similarity_scores else 0
 
-    def get_or_create_ingredient_node(self, ingredient_data):
-        ingredient_name = ingredient_data['food']
-        normalized_name = self.preprocess_ingredient(ingredient_name)
-        words = normalized_name.split()
+    def find_exact_ingredient(self, normalized_name):
+        if self.ingredient_index is not None:
+            return self.ingredient_index.exact(normalized_name)
 
-        # First, check for exact match
         query = """
-        MATCH (i:Ingredient)
-        WHERE toLower(i.name) = $name
+        MATCH (i:Ingredient {key: $key})
         RETURN i
         """
         matching_ingredient = self.graph.run(
-            query, name=normalized_name).data()
+            query, key=normalized_name).data()
 
         if matching_ingredient:
             return matching_ingredient[0]['i']
+        if self.writer:
+            return self.writer.ingredients.get(normalized_name)
+        return None
+
+    def find_similar_ingredients(self, normalized_name):
+        if self.ingredient_index is not None:
+            return self.ingredient_index.similar(normalized_name)
+
+        words = normalized_name.split()
 
-        # Then, similarity match for ingredients with any common words
+        # Similarity match for ingredients with any common words
         query = """
         MATCH (i:Ingredient)
         WHERE any(word IN $normWords WHERE toLower(i.name) CONTAINS word)
         RETURN i
         """
+        existing_ingredients = [
+            ex_ingredient['i'] for ex_ingredient in self.graph.run(
+                query, normWords=words).data()]
+        # Include buffered ingredients that are not in the graph yet
+        if self.writer:
+            existing_ingredients += [
+                node for node in self.writer.ingredients.values()
+                if any(word in node['name'] for word in words)]
+
+        preprocessed_ex_ingredients = [
+            self.preprocess_ingredient(ex_ingredient['name'])
+            for ex_ingredient in existing_ingredients]
+
+        similarity = [
+            self.calculate_similarity(
+                normalized_name, ex_ingredient)
+            for ex_ingredient in preprocessed_ex_ingredients]
+
+        return existing_ingredients, similarity
 
-        existing_ingredients = self.graph.run(
-            query, normWords=words).data()
-
-        # Then similarity metric filter
-        if existing_ingredients:
-            preprocessed_ex_ingredients = [
-                self.preprocess_ingredient(
-                    ex_ingredient['i']['name'])
-                for ex_ingredient in existing_ingredients]
+    def get_or_create_ingredient_node(self, ingredient_data):
+        ingredient_name = ingredient_data['food']
+        normalized_name = self.preprocess_ingredient(ingredient_name)
 
-            similarity = [
-                self.calculate_similarity(
-                    normalized_name, ex_ingredient)
-                for ex_ingredient in preprocessed_ex_ingredients]
+        # First, check for exact match
+        ingredient_node = self.find_exact_ingredient(normalized_name)
+        if ingredient_node is not None:
+            return ingredient_node
 
+        # Then similarity metric filter
+        existing_ingredients, similarity = self.find_similar_ingredients(
+            normalized_name)
+        if len(existing_ingredients):
             most_similar_score = np.max(similarity)
             most_similar = np.argmax(similarity)
 
             # Hyperparameter that is manually tuned
             if most_similar_score > 0.87:
-                ingredient_node = existing_ingredients[most_similar][
-                    'i']
+                ingredient_node = existing_ingredients[most_similar]
                 # Conditional check for tuning sensitivity
                 if most_similar_score < 0.95:
                     self.dodgy_dedupes.append(
@@ -156,13 +257,14 @@ class GraphBuilder:
             # Conditional check for tuning specificity
             elif most_similar_score > 0.8:
                 self.avoided_dedupes.append(
-                    (ingredient_name, existing_ingredients[most_similar]['i']['name']))
+                    (ingredient_name, existing_ingredients[most_similar]['name']))
         # Else create a new ingredient node
         ingredient_node = Node(
             "Ingredient",
             name=normalized_name,
-            category=ingredient_data['foodCategory'])
-        self.graph.create(ingredient_node)
+            category=ingredient_data['foodCategory'],
+            **schema.ingredient_properties(normalized_name))
+        self.create_node(ingredient_node)
 
         return ingredient_node
 
@@ -173,22 +275,26 @@ class GraphBuilder:
         ingredient_node = Node(
             "Ingredient",
             name=normalized_name,
-            category=ingredient_data['foodCategory'])
-        self.graph.create(ingredient_node)
+            category=ingredient_data['foodCategory'],
+            **schema.ingredient_properties(normalized_name))
+        self.create_node(ingredient_node)
 
         return ingredient_node
 
-    def get_or_create_recipe_node(self, recipe_data):
+    def get_or_create_recipe_node(self, recipe_data, page=NOT_PREFETCHED):
         recipe = recipe_data['recipe']
+        url = recipe['url']
+        recipe_uid = schema.recipe_properties(url)['uid']
+        # Both lookups are served by the recipe constraints' indexes
         recipe_node = self.graph.nodes.match(
-            "Recipe", name=recipe['label']).first()
+            "Recipe", name=recipe['label']).first() or \
+            self.graph.nodes.match("Recipe", uid=recipe_uid).first()
+        if not recipe_node and self.writer:
+            recipe_node = self.writer.recipes.get(recipe['label'])
         if not recipe_node:
-            url = recipe['url']
-            try:
-                scraper = scrape_me(url, wild_mode=True)
-                instructions = scraper.instructions_list()
-                totalTime = scraper.total_time()
-            except:
+            if page is NOT_PREFETCHED:
+                page = self.scraper.scrape(url)
+            if page is None:
                 return None
 
             recipe_node = Node(
@@ -196,55 +302,140 @@ class GraphBuilder:
                 url=url,
                 image=recipe['image'],
                 cuisineType=recipe['cuisineType'],
-                totalTime=totalTime,
-                instructions=instructions,
+                totalTime=page['totalTime'],
+                instructions=page['instructions'],
+                uid=recipe_uid,
+                # Set once all of its ingredients are written
+                complete=False,
             )
-            self.graph.create(recipe_node)
+            self.create_node(recipe_node)
+            if self.ingest_log:
+                self.ingest_log.add(page['instructions'] + [
+                    ingredient['food'] for ingredient in recipe['ingredients']])
         return recipe_node
 
-    def create_relationships(
-            self, recipe_node, ingredient_node, quantity, measure):
-        self.graph.create(
-            Relationship(
-                recipe_node, "CONTAINS", ingredient_node,
-                quantity=quantity,
-                measure=measure))
-        self.graph.create(
-            Relationship(ingredient_node, "PART_OF", recipe_node,
-                         quantity=quantity,
-                         measure=measure))
-
-    def create_recipe_node_with_ingredients(self, recipe_data):
-        recipe_node = self.get_or_create_recipe_node(recipe_data)
+    def create_relationships(self, recipe_node, relationships):
+        """
+        Writes the (recipe node, ingredient node, quantity, measure)
+        relationships of `recipe_node` and marks it complete, in one
+        transaction unless they are buffered for a bulk flush.
+        """
+        self.dirty = True
+        if self.writer:
+            for relationship in relationships:
+                self.writer.add_relationship(*relationship)
+            self.writer.add_complete(recipe_node)
+            return
+        tx = self.graph.begin()
+        if relationships:
+            tx.run(MERGE_RELATIONSHIPS, rows=relationship_rows(relationships))
+        tx.run(COMPLETE_RECIPES, ids=[recipe_node.identity])
+        self.graph.commit(tx)
+
+    def create_recipe_node_with_ingredients(
+            self, recipe_data, page=NOT_PREFETCHED):
+        recipe_node = self.get_or_create_recipe_node(recipe_data, page)
         # We only want recipe nodes with instructions
         if not recipe_node:
             return
 
+        relationships = []
         for ingredient in recipe_data['recipe']['ingredients']:
             ingredient_node = self.get_or_create_ingredient_node(
                 ingredient)
             quantity = ingredient['quantity']
             measure = ingredient['measure']
-            self.create_relationships(
-                recipe_node, ingredient_node, quantity, measure)
+            relationships.append(
+                (recipe_node, ingredient_node, quantity, measure))
+        self.create_relationships(recipe_node, relationships)
 
-    def build_knowledge_graph_by_cuisine(self, cuisine):
-        recipes = self.search_recipes_by_cuisine(cuisine)
-        print(f"Found {len(recipes)} recipes for {cuisine}")
+        if self.writer and \
+                len(self.writer.relationships) >= self.writer.batch_size:
+            self.flush()
+
+    def prefetch_recipe_pages(self, recipes):
+        if self.seen_recipes is not None:
+            # Already filtered against the local index
+            return self.scraper.prefetch([
+                recipe['recipe']['url'] for recipe in recipes])
+
+        # Only new recipes are scraped
+        query = """
+        MATCH (r:Recipe)
+        WHERE r.name IN $names
+        RETURN r.name AS name
+        """
+        existing = {
+            record['name'] for record in self.graph.run(
+                query, names=[
+                    recipe['recipe']['label'] for recipe in recipes]).data()}
+        if self.writer:
+            existing |= set(self.writer.recipes)
+
+        return self.scraper.prefetch([
+            recipe['recipe']['url'] for recipe in recipes
+            if recipe['recipe']['label'] not in existing])
+
+    def unseen_recipes(self, recipes):
+        """
+        Drops the recipes already handled, and repeats within `recipes`,
+        without querying the graph.
+        """
+        batch = SeenRecipes()
+        unseen = []
+        for recipe in recipes:
+            if recipe['recipe'] in self.seen_recipes or recipe['recipe'] in batch:
+                continue
+            batch.add(recipe['recipe'])
+            unseen.append(recipe)
+        print(f"Skipping {len(recipes) - len(unseen)} known recipes")
+        return unseen
+
+    def build_recipes(self, recipes, pages=None):
+        """
+        Writes `recipes` and their ingredients. `pages` maps recipe URLs to
+        pages already scraped elsewhere, e.g. by a build worker process.
+        """
+        # Models retrained since the last batch are picked up here
+        self.refresh_models()
+        if self.seen_recipes is not None:
+            recipes = self.unseen_recipes(recipes)
+        if pages is None:
+            # Pages are scraped concurrently while earlier recipes are written
+            pages = self.prefetch_recipe_pages(recipes)
+        else:
+            pages = {url: completed(page) for url, page in pages.items()}
 
         for recipe in recipes:
             print(
                 f"Building recipe node for {recipe['recipe']['label']}")
-            self.create_recipe_node_with_ingredients(recipe)
+            page = pages.get(recipe['recipe']['url'])
+            self.create_recipe_node_with_ingredients(
+                recipe, NOT_PREFETCHED if page is None else page.result())
+        self.flush()
+        # Only once their edges are written, so a crash never checkpoints a
+        # recipe that is missing its ingredients
+        if self.seen_recipes is not None:
+            for recipe in recipes:
+                self.seen_recipes.add(recipe['recipe'])
+
+    def build_knowledge_graph_by_cuisine(self, cuisine, occurrence=None):
+        recipes = self.search_recipes_by_cuisine(cuisine, occurrence)
+        print(f"Found {len(recipes)} recipes for {cuisine}")
+
+        self.build_recipes(recipes)
 
     def build_knowledge_graph_by_ingredient(self, ingredient):
         recipes = self.search_recipes_by_ingredient(ingredient)
         print(f"Found {len(recipes)} recipes for {ingredient}")
 
-        for recipe in recipes:
-            print(
-                f"Building recipe node for {recipe['recipe']['label']}")
-            self.create_recipe_node_with_ingredients(recipe)
+        self.build_recipes(recipes)
+
+
+def completed(value):
+    future = Future()
+    future.set_result(value)
+    return future
 
 
 def pretty_print_time(seconds):
@@ -262,119 +453,163 @@ if __name__ == "__main__":
     user = os.getenv("NEO4J_USER")
     password = os.getenv("NEO4J_PASSWORD")
 
-    graph_builder = GraphBuilder(uri, user, password)
-
-    # Define your Cypher query to count nodes
-    query = """
-    MATCH (n)
-    RETURN count(n) AS nodeCount
-    """
-
-    while True:
-        # Execute the Cypher query
-        result = graph_builder.graph.run(query).data()
-        node_count = result[0]['nodeCount']
-
-        if node_count > 5000:
-            break
-
-        # # Define initialized ingredients
-        # food_categories = {
-        #     'Meat and Protein':
-        #     ['chicken', 'beef', 'pork', 'fish', 'shrimp', 'tofu', 'tempeh',
-        #      'lentils', 'beans', 'chickpeas', 'eggs', 'turkey', 'salmon',
-        #      'tuna', 'sausage', 'bacon', 'ham', 'steak', 'ground beef',
-        #      'pepperoni', 'crab', 'lobster', 'duck', 'lamb'],
-        #     'Grains':
-        #     ['flour', 'noodles', 'rice', 'pasta', 'quinoa', 'oats', 'bread',
-        #      'barley', 'couscous', 'bulgur', 'cornmeal', 'wheat germ',
-        #      'breadcrumbs', 'polenta', 'farro', 'cereal', 'buckwheat',
-        #      'millet', 'amaranth', 'sorghum', 'spelt', 'teff'],
-        #     'Vegetables':
-        #     ['spring onion', 'onion', 'garlic', 'tomato', 'potato', 'carrot',
-        #      'bell pepper', 'spinach', 'broccoli', 'mushroom', 'zucchini',
-        #      'cucumber', 'celery', 'lettuce', 'cabbage', 'green beans',
-        #      'peas', 'corn', 'sweet potato', 'asparagus', 'kale',
-        #      'brussels sprouts', 'cauliflower', 'artichoke', 'beet',
-        #      'radish', 'turnip', 'eggplant', 'squash', 'pumpkin', 'okra',
-        #      'rhubarb', 'fennel', 'leek', 'shallot', 'scallion', 'chives',
-        #      'ginger', 'chili pepper', 'jalapeno'],
-        #     'Fruits':
-        #     ['apple', 'banana', 'orange', 'strawberry', 'blueberry',
-        #      'lemon', 'lime', 'grape', 'watermelon', 'pineapple', 'mango',
-        #      'kiwi', 'peach', 'pear', 'raspberry', 'blackberry', 'avocado',
-        #      'cranberry', 'cherry', 'coconut', 'pomegranate', 'plum', 'fig',
-        #      'date', 'guava', 'papaya', 'passion fruit', 'lychee',
-        #      'dragonfruit', 'starfruit'],
-        #     'Dairy and Alternatives':
-        #     ['milk', 'cheese', 'yogurt', 'butter', 'cream', 'sour cream',
-        #      'cream cheese', 'cottage cheese', 'ricotta', 'goat cheese',
-        #      'cheddar', 'mozzarella', 'parmesan', 'feta', 'swiss cheese',
-        #      'almond milk', 'soy milk', 'coconut milk', 'cashew milk',
-        #      'oat milk', 'vegan cheese'],
-        #     'Herbs and Spices':
-        #     ['salt', 'pepper', 'oregano', 'basil', 'parsley', 'thyme',
-        #      'sesame seeds', 'rosemary', 'cumin', 'paprika', 'chili powder',
-        #      'cinnamon', 'nutmeg', 'ginger', 'coriander', 'garlic powder',
-        #      'onion powder', 'bay leaf', 'turmeric', 'sage', 'dill',
-        #      'mustard', 'cayenne', 'curry powder', 'cardamom', 'cloves',
-        #      'allspice', 'fennel', 'tarragon'],
-        #     'Sauces':
-        #     ['soy sauce', 'vinegar', 'black vinegar', 'rice vinegar', 'fish sauce',
-        #      'Worcestershire sauce', 'teriyaki sauce', 'hot sauce',
-        #      'barbecue sauce', 'ketchup', 'mayonnaise', 'mustard', 'relish',
-        #      'salsa', 'tahini', 'hoisin sauce', 'sriracha'],
-        #     'Oils': ['oil', 'olive oil', 'coconut oil', 'sesame oil'],
-        #     'Nuts':
-        #     ['peanut butter', 'almonds', 'walnuts', 'cashews', 'peanuts',
-        #      'pecans', 'pistachios', 'macadamia nuts', 'hazelnuts',
-        #      'Brazil nuts'],
-        #     'Juice':
-        #     ['orange juice', 'apple juice', 'grape juice',
-        #      'cranberry juice', 'pineapple juice', 'tomato juice',
-        #      'lemon juice', 'lime juice', 'vegetable juice', 'prune juice'],
-        #     'Sweeteners':
-        #     ['sugar', 'brown sugar', 'honey', 'maple syrup', 'agave nectar',
-        #      'molasses', 'artificial sweeteners'],
-        #     'Canned Foods':
-        #     ['canned beans', 'canned tomatoes', 'canned tuna',
-        #      'canned salmon', 'canned vegetables', 'canned fruit',
-        #      'canned soup', 'canned broth', 'canned coconut milk',
-        #      'canned pumpkin', 'canned olives', 'canned corn',
-        #      'canned chickpeas'], }
-
-        # start = time.time()
-        # # Initialize some ingredients
-        # for category, ingredients_list in food_categories.items():
-        #     for ingredient in ingredients_list:
-        #         graph_builder.force_create_ingredient_node(
-        #             {'food': ingredient, 'foodCategory': category})
-        # print(
-        #     f"Time to build the ingredients: {pretty_print_time(time.time() - start)}")
-
-        print("Building the graph for diverse cuisines")
-
-        cuisines = [
-            'Asian', 'Chinese', 'Japanese', 'South East Asian'] + [
-            'American', 'Asian', 'British', 'Caribbean',
-            'Central Europe', 'Chinese', 'Eastern Europe', 'French',
-            'Indian', 'Italian', 'Japanese', 'Kosher', 'Mediterranean',
-            'Mexican', 'Middle Eastern', 'Nordic', 'South American',
-            'South East Asian']
-
-        # Time this algorithm
-        start = time.time()
-        for cuisine in cuisines:
-            # get time to build each cuisine as a lap
-            lap = time.time()
-            graph_builder.build_knowledge_graph_by_cuisine(cuisine)
-            print(
-                f"Time to build {cuisine}: {pretty_print_time(time.time() - lap)}")
-        node_count = graph_builder.graph.run(query).data()[
-            0]['nodeCount']
-        print(f"Current node count: {node_count}")
-        print(
-            f"Time to build the cuisine graph: {pretty_print_time(time.time() - start)}")
+    # Buffer writes into batched UNWIND transactions
+    bulk = os.getenv("GRAPH_BUILDER_BULK", "false").lower() == "true"
+    batch_size = int(os.getenv("GRAPH_BUILDER_BATCH_SIZE", "500"))
+    # Dedupe ingredients against an in-memory embedding index
+    dedupe_index = os.getenv(
+        "GRAPH_BUILDER_DEDUPE_INDEX", "false").lower() == "true"
+
+    # Concurrent recipe page scraping
+    scrape_workers = int(os.getenv("GRAPH_BUILDER_SCRAPE_WORKERS", "8"))
+    scrape_per_domain = int(os.getenv("GRAPH_BUILDER_SCRAPE_PER_DOMAIN", "2"))
+    scrape_timeout = float(os.getenv("GRAPH_BUILDER_SCRAPE_TIMEOUT", "10"))
+
+    # On-disk response cache, replayed without network in offline mode
+    cache = None
+    cache_dir = os.getenv("GRAPH_BUILDER_CACHE_DIR")
+    cache_ttl = float(os.getenv("GRAPH_BUILDER_CACHE_TTL", 7 * 24 * 3600))
+    cache_negative_ttl = float(
+        os.getenv("GRAPH_BUILDER_CACHE_NEGATIVE_TTL", 3600))
+    cache_max_bytes = int(
+        os.getenv("GRAPH_BUILDER_CACHE_MAX_MB", "512")) * 1024 * 1024
+    offline = os.getenv("GRAPH_BUILDER_OFFLINE", "false").lower() == "true"
+    if cache_dir:
+        cache = ResponseCache(
+            cache_dir, ttl=cache_ttl, max_bytes=cache_max_bytes,
+            offline=offline, negative_ttl=cache_negative_ttl)
+    elif offline:
+        raise RuntimeError("GRAPH_BUILDER_OFFLINE requires GRAPH_BUILDER_CACHE_DIR")
+
+    # Normalized ingredient names, optionally kept on disk across runs
+    normalizer = IngredientNormalizer(
+        path=os.getenv("GRAPH_BUILDER_NORMALIZER_CACHE"),
+        max_size=int(os.getenv("GRAPH_BUILDER_NORMALIZER_CACHE_SIZE", "65536")))
+
+    # Log the text of new recipes for incremental model updates
+    ingest_log = None
+    if os.getenv("GRAPH_BUILDER_INGEST_LOG"):
+        ingest_log = IngestLog(os.getenv("GRAPH_BUILDER_INGEST_LOG"))
+
+    graph_builder = GraphBuilder(
+        uri, user, password, bulk=bulk, batch_size=batch_size,
+        dedupe_index=dedupe_index, scrape_workers=scrape_workers,
+        scrape_per_domain=scrape_per_domain, scrape_timeout=scrape_timeout,
+        cache=cache, normalizer=normalizer, ingest_log=ingest_log)
+
+    # Rounds of cuisine searches, checkpointed after each search so a
+    # crashed build resumes where it stopped
+    checkpoint = BuildCheckpoint(os.getenv("GRAPH_BUILDER_CHECKPOINT"))
+    target_nodes = int(os.getenv("GRAPH_BUILDER_TARGET_NODES", "5000"))
+    # Searches and scraping in worker processes, writes in this one
+    workers = int(os.getenv("GRAPH_BUILDER_WORKERS", "1"))
+    if workers > 1:
+        runner = ParallelBuildRunner(
+            graph_builder, checkpoint, workers, {
+                'cache_dir': cache_dir, 'cache_ttl': cache_ttl,
+                'cache_negative_ttl': cache_negative_ttl,
+                'cache_max_bytes': cache_max_bytes, 'offline': offline,
+                'scrape_workers': scrape_workers,
+                'scrape_per_domain': scrape_per_domain,
+                'scrape_timeout': scrape_timeout},
+            target_nodes=target_nodes, offline=offline)
+    else:
+        runner = BuildRunner(
+            graph_builder, checkpoint, target_nodes=target_nodes,
+            offline=offline)
+
+    # # Define initialized ingredients
+    # food_categories = {
+    #     'Meat and Protein':
+    #     ['chicken', 'beef', 'pork', 'fish', 'shrimp', 'tofu', 'tempeh',
+    #      'lentils', 'beans', 'chickpeas', 'eggs', 'turkey', 'salmon',
+    #      'tuna', 'sausage', 'bacon', 'ham', 'steak', 'ground beef',
+    #      'pepperoni', 'crab', 'lobster', 'duck', 'lamb'],
+    #     'Grains':
+    #     ['flour', 'noodles', 'rice', 'pasta', 'quinoa', 'oats', 'bread',
+    #      'barley', 'couscous', 'bulgur', 'cornmeal', 'wheat germ',
+    #      'breadcrumbs', 'polenta', 'farro', 'cereal', 'buckwheat',
+    #      'millet', 'amaranth', 'sorghum', 'spelt', 'teff'],
+    #     'Vegetables':
+    #     ['spring onion', 'onion', 'garlic', 'tomato', 'potato', 'carrot',
+    #      'bell pepper', 'spinach', 'broccoli', 'mushroom', 'zucchini',
+    #      'cucumber', 'celery', 'lettuce', 'cabbage', 'green beans',
+    #      'peas', 'corn', 'sweet potato', 'asparagus', 'kale',
+    #      'brussels sprouts', 'cauliflower', 'artichoke', 'beet',
+    #      'radish', 'turnip', 'eggplant', 'squash', 'pumpkin', 'okra',
+    #      'rhubarb', 'fennel', 'leek', 'shallot', 'scallion', 'chives',
+    #      'ginger', 'chili pepper', 'jalapeno'],
+    #     'Fruits':
+    #     ['apple', 'banana', 'orange', 'strawberry', 'blueberry',
+    #      'lemon', 'lime', 'grape', 'watermelon', 'pineapple', 'mango',
+    #      'kiwi', 'peach', 'pear', 'raspberry', 'blackberry', 'avocado',
+    #      'cranberry', 'cherry', 'coconut', 'pomegranate', 'plum', 'fig',
+    #      'date', 'guava', 'papaya', 'passion fruit', 'lychee',
+    #      'dragonfruit', 'starfruit'],
+    #     'Dairy and Alternatives':
+    #     ['milk', 'cheese', 'yogurt', 'butter', 'cream', 'sour cream',
+    #      'cream cheese', 'cottage cheese', 'ricotta', 'goat cheese',
+    #      'cheddar', 'mozzarella', 'parmesan', 'feta', 'swiss cheese',
+    #      'almond milk', 'soy milk', 'coconut milk', 'cashew milk',
+    #      'oat milk', 'vegan cheese'],
+    #     'Herbs and Spices':
+    #     ['salt', 'pepper', 'oregano', 'basil', 'parsley', 'thyme',
+    #      'sesame seeds', 'rosemary', 'cumin', 'paprika', 'chili powder',
+    #      'cinnamon', 'nutmeg', 'ginger', 'coriander', 'garlic powder',
+    #      'onion powder', 'bay leaf', 'turmeric', 'sage', 'dill',
+    #      'mustard', 'cayenne', 'curry powder', 'cardamom', 'cloves',
+    #      'allspice', 'fennel', 'tarragon'],
+    #     'Sauces':
+    #     ['soy sauce', 'vinegar', 'black vinegar', 'rice vinegar', 'fish sauce',
+    #      'Worcestershire sauce', 'teriyaki sauce', 'hot sauce',
+    #      'barbecue sauce', 'ketchup', 'mayonnaise', 'mustard', 'relish',
+    #      'salsa', 'tahini', 'hoisin sauce', 'sriracha'],
+    #     'Oils': ['oil', 'olive oil', 'coconut oil', 'sesame oil'],
+    #     'Nuts':
+    #     ['peanut butter', 'almonds', 'walnuts', 'cashews', 'peanuts',
+    #      'pecans', 'pistachios', 'macadamia nuts', 'hazelnuts',
+    #      'Brazil nuts'],
+    #     'Juice':
+    #     ['orange juice', 'apple juice', 'grape juice',
+    #      'cranberry juice', 'pineapple juice', 'tomato juice',
+    #      'lemon juice', 'lime juice', 'vegetable juice', 'prune juice'],
+    #     'Sweeteners':
+    #     ['sugar', 'brown sugar', 'honey', 'maple syrup', 'agave nectar',
+    #      'molasses', 'artificial sweeteners'],
+    #     'Canned Foods':
+    #     ['canned beans', 'canned tomatoes', 'canned tuna',
+    #      'canned salmon', 'canned vegetables', 'canned fruit',
+    #      'canned soup', 'canned broth', 'canned coconut milk',
+    #      'canned pumpkin', 'canned olives', 'canned corn',
+    #      'canned chickpeas'], }
+
+    # start = time.time()
+    # # Initialize some ingredients
+    # for category, ingredients_list in food_categories.items():
+    #     for ingredient in ingredients_list:
+    #         graph_builder.force_create_ingredient_node(
+    #             {'food': ingredient, 'foodCategory': category})
+    # print(
+    #     f"Time to build the ingredients: {pretty_print_time(time.time() - start)}")
+
+    print("Building the graph for diverse cuisines")
+
+    cuisines = [
+        'Asian', 'Chinese', 'Japanese', 'South East Asian'] + [
+        'American', 'Asian', 'British', 'Caribbean',
+        'Central Europe', 'Chinese', 'Eastern Europe', 'French',
+        'Indian', 'Italian', 'Japanese', 'Kosher', 'Mediterranean',
+        'Mexican', 'Middle Eastern', 'Nordic', 'South American',
+        'South East Asian']
+
+    # Time this algorithm
+    start = time.time()
+    node_count = runner.run([('cuisine', cuisine) for cuisine in cuisines])
+    print(f"Final node count: {node_count}")
+    if cache:
+        print(f"Cache hits: {cache.hits}, misses: {cache.misses}")
+    print(
+        f"Time to build the cuisine graph: {pretty_print_time(time.time() - start)}")
 
     # Write the avoided and dodgy dedupes to a file
     with open("dodgy_dedupes.txt", "w") as file:
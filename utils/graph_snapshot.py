@@ -0,0 +1,409 @@
+'''
+Exports the knowledge graph to a compact snapshot file and loads it back
+into an empty database, so a staging or load-test graph can be stood up
+without re-running graph_builder.py. Run from the `utils` directory:
+
+    python graph_snapshot.py export graph.npz
+    python graph_snapshot.py load graph.npz
+    python graph_snapshot.py diff old.npz new.npz
+
+A snapshot is a compressed NumPy .npz of columns. Every string is stored
+once in a UTF-8 string table and columns hold indexes into it (-1 for
+null), lists of strings are stored as offsets into a flat index column,
+and CONTAINS edges are pairs of recipe and ingredient rows. Properties
+without a column, and values that do not fit their column, are kept as a
+JSON object in the `extra` column, so nothing is lost. Nodes are
+sorted by uid and edges by their endpoints, so snapshots of the same graph
+are identical and snapshots of two builds can be diffed.
+'''
+import argparse
+import json
+import math
+import os
+import tempfile
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+from py2neo import Graph
+
+import schema
+from bulk_writer import chunks
+
+FORMAT_VERSION = 2
+# Older formats that still load; they have no extra or presence columns
+READABLE_FORMATS = (1, FORMAT_VERSION)
+
+# Column kinds
+STRING = 'string'
+STRINGS = 'strings'
+INT = 'int'
+FLOAT = 'float'
+
+# (label, column prefix, (property, kind) columns) of the exported nodes
+NODES = [
+    ('Recipe', 'recipe', [
+        ('uid', STRING), ('name', STRING), ('url', STRING),
+        ('image', STRING), ('cuisineType', STRINGS), ('totalTime', INT),
+        ('instructions', STRINGS)]),
+    ('Ingredient', 'ingredient', [
+        ('uid', STRING), ('key', STRING), ('name', STRING),
+        ('category', STRING)]),
+]
+CONTAINS_COLUMNS = [('quantity', FLOAT), ('measure', STRING)]
+
+CONTAINS = """
+MATCH (r:Recipe)-[c:CONTAINS]->(i:Ingredient)
+RETURN ID(r) AS recipe, ID(i) AS ingredient, properties(c) AS props
+"""
+
+
+class StringTable:
+    '''
+    Deduplicated strings, stored as one UTF-8 blob and the offsets of each
+    string in it.
+    '''
+
+    def __init__(self, strings=()):
+        self.strings = list(strings)
+        self.indexes = {string: i for i, string in enumerate(self.strings)}
+
+    def index(self, string):
+        if string is None:
+            return -1
+        string = str(string)
+        index = self.indexes.get(string)
+        if index is None:
+            index = self.indexes[string] = len(self.strings)
+            self.strings.append(string)
+        return index
+
+    def get(self, index):
+        return None if index < 0 else self.strings[index]
+
+    def arrays(self):
+        encoded = [string.encode('utf-8') for string in self.strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(string) for string in encoded])
+        return {
+            'strings': np.frombuffer(b''.join(encoded), dtype=np.uint8),
+            'strings.offsets': offsets,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        blob = arrays['strings'].tobytes()
+        offsets = arrays['strings.offsets']
+        return cls(blob[offsets[i]:offsets[i + 1]].decode('utf-8')
+                   for i in range(len(offsets) - 1))
+
+
+def number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def fits(kind, value):
+    """
+    Whether `value` round trips through a column of `kind`.
+    """
+    if kind == STRING:
+        return isinstance(value, str)
+    if kind == STRINGS:
+        return isinstance(value, list) and \
+            all(isinstance(item, str) for item in value)
+    if isinstance(value, bool):
+        return False
+    if kind == INT:
+        # Stored as a float64, which holds integers exactly up to 2**53
+        return isinstance(value, int) and abs(value) <= 2 ** 53
+    return isinstance(value, float) and not math.isnan(value)
+
+
+def split_properties(columns, row):
+    """
+    Returns the properties of `row` that fit `columns`, and the rest.
+    """
+    kinds = dict(columns)
+    fitted, extra = {}, {}
+    for name, value in row.items():
+        if value is None:
+            continue
+        if name in kinds and fits(kinds[name], value):
+            fitted[name] = value
+        else:
+            extra[name] = value
+    return fitted, extra
+
+
+def encode_extra(extra):
+    if not extra:
+        return None
+    try:
+        return json.dumps(extra, sort_keys=True, allow_nan=False)
+    except (TypeError, ValueError) as e:
+        raise ValueError(
+            f"Cannot snapshot properties {sorted(extra)}: {e}") from e
+
+
+def encode_columns(prefix, columns, rows, strings):
+    """
+    Returns the arrays of the `columns` of property dicts `rows`, with the
+    other properties in the extra column.
+    """
+    split = [split_properties(columns, row) for row in rows]
+    rows = [fitted for fitted, _ in split]
+    extras = [extra for _, extra in split]
+    arrays = {}
+    for name, kind in columns:
+        key = f'{prefix}.{name}'
+        values = [row.get(name) for row in rows]
+        if kind == STRING:
+            arrays[key] = np.array(
+                [strings.index(value) for value in values], dtype=np.int32)
+        elif kind == STRINGS:
+            lists = [value or [] for value in values]
+            offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(value) for value in lists])
+            arrays[key] = np.array(
+                [strings.index(item) for value in lists for item in value],
+                dtype=np.int32)
+            arrays[f'{key}.offsets'] = offsets
+            # Tells a missing list from an empty one
+            arrays[f'{key}.present'] = np.array(
+                [value is not None for value in values], dtype=bool)
+        else:
+            # Numbers are floats with NaN for null, restored by their kind
+            arrays[key] = np.array(
+                [number(value) for value in values], dtype=np.float64)
+    arrays[f'{prefix}.extra'] = np.array(
+        [strings.index(encode_extra(extra)) for extra in extras],
+        dtype=np.int32)
+    return arrays
+
+
+def decode_columns(prefix, columns, arrays, strings, size):
+    """
+    Returns the property dicts of `size` rows, leaving out null properties.
+    """
+    rows = [{} for _ in range(size)]
+    for name, kind in columns:
+        key = f'{prefix}.{name}'
+        values = arrays[key]
+        if kind == STRING:
+            for row, index in zip(rows, values.tolist()):
+                if index >= 0:
+                    row[name] = strings.get(index)
+        elif kind == STRINGS:
+            offsets = arrays[f'{key}.offsets'].tolist()
+            indexes = values.tolist()
+            present = arrays.get(f'{key}.present', np.ones(size, dtype=bool))
+            for i, row in enumerate(rows):
+                if present[i]:
+                    row[name] = [
+                        strings.get(index)
+                        for index in indexes[offsets[i]:offsets[i + 1]]]
+        else:
+            for row, value in zip(rows, values.tolist()):
+                if not np.isnan(value):
+                    row[name] = int(value) if kind == INT else value
+    if f'{prefix}.extra' in arrays:
+        for row, index in zip(rows, arrays[f'{prefix}.extra'].tolist()):
+            if index >= 0:
+                row.update(json.loads(strings.get(index)))
+    return rows
+
+
+def export_snapshot(graph, path):
+    """
+    Writes the graph's recipes, ingredients and CONTAINS edges to `path`.
+    Returns the number of nodes and edges written.
+    """
+    strings = StringTable()
+    arrays = {'format': np.array(FORMAT_VERSION)}
+    # Snapshot row of each node by its internal id
+    rows = {}
+    for label, prefix, columns in NODES:
+        records = graph.run(
+            f"MATCH (n:{label}) RETURN ID(n) AS id, properties(n) AS props").data()
+        records.sort(key=lambda record: record['props'].get('uid') or '')
+        rows[label] = {record['id']: row for row, record in enumerate(records)}
+        try:
+            arrays.update(encode_columns(
+                prefix, columns, [record['props'] for record in records],
+                strings))
+        except ValueError as e:
+            raise ValueError(f"{label}: {e}") from e
+
+    edges = graph.run(CONTAINS).data()
+    recipe = np.array(
+        [rows['Recipe'][edge['recipe']] for edge in edges], dtype=np.int32)
+    ingredient = np.array(
+        [rows['Ingredient'][edge['ingredient']] for edge in edges],
+        dtype=np.int32)
+    quantity = np.array(
+        [number(edge['props'].get('quantity')) for edge in edges])
+    measure = np.array(
+        [str(edge['props'].get('measure')) for edge in edges], dtype=str)
+    # Sorted before encoding, so the string table is in a stable order too
+    order = np.lexsort((measure, quantity, ingredient, recipe))
+    arrays['contains.recipe'] = recipe[order]
+    arrays['contains.ingredient'] = ingredient[order]
+    try:
+        arrays.update(encode_columns(
+            'contains', CONTAINS_COLUMNS,
+            [edges[i]['props'] for i in order], strings))
+    except ValueError as e:
+        raise ValueError(f"CONTAINS: {e}") from e
+    arrays.update(strings.arrays())
+
+    directory = os.path.dirname(os.path.abspath(path))
+    # Write to a temporary file first so a crash never leaves half a snapshot
+    fd, tmp = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, 'wb') as file:
+        np.savez_compressed(file, **arrays)
+    os.replace(tmp, path)
+    return sum(len(nodes) for nodes in rows.values()), len(edges)
+
+
+def read_snapshot(path):
+    """
+    Returns the node property dicts of a snapshot by label, and its
+    (recipe row, ingredient row, properties) edges.
+    """
+    with np.load(path) as file:
+        arrays = dict(file)
+    if int(arrays['format']) not in READABLE_FORMATS:
+        raise ValueError(
+            f"Unsupported snapshot format {int(arrays['format'])} in {path}")
+    strings = StringTable.from_arrays(arrays)
+    nodes = {}
+    for label, prefix, columns in NODES:
+        size = len(arrays[f'{prefix}.uid'])
+        nodes[label] = decode_columns(prefix, columns, arrays, strings, size)
+    properties = decode_columns(
+        'contains', CONTAINS_COLUMNS, arrays, strings,
+        len(arrays['contains.recipe']))
+    edges = list(zip(arrays['contains.recipe'].tolist(),
+                     arrays['contains.ingredient'].tolist(), properties))
+    return nodes, edges
+
+
+def load_snapshot(graph, path, batch_size=1000):
+    """
+    Creates the nodes and edges of a snapshot in an empty database with
+    batched UNWIND transactions. Returns the number of nodes and edges
+    created.
+    """
+    nodes, edges = read_snapshot(path)
+    existing = graph.run(
+        "MATCH (n) WHERE n:Recipe OR n:Ingredient RETURN count(n) AS count"
+    ).data()[0]['count']
+    if existing:
+        raise RuntimeError(
+            f"Snapshots load into an empty database, found {existing} nodes")
+    # Constraints first, so their indexes are built while loading
+    schema.create_constraints(graph)
+
+    # Internal id of each snapshot row
+    ids = {}
+    for label, _, _ in NODES:
+        query = f"""
+        UNWIND $rows AS row
+        CREATE (n:{label})
+        SET n = row.props
+        RETURN row.row AS row, ID(n) AS id
+        """
+        ids[label] = {}
+        rows = [{'row': row, 'props': props}
+                for row, props in enumerate(nodes[label])]
+        for chunk in chunks(rows, batch_size):
+            for record in graph.run(query, rows=chunk).data():
+                ids[label][record['row']] = record['id']
+
+    query = """
+    UNWIND $rows AS row
+    MATCH (r:Recipe) WHERE ID(r) = row.recipe
+    MATCH (i:Ingredient) WHERE ID(i) = row.ingredient
+    CREATE (r)-[c:CONTAINS]->(i)
+    CREATE (i)-[p:PART_OF]->(r)
+    SET c = row.props, p = row.props
+    """
+    rows = [
+        {
+            'recipe': ids['Recipe'][recipe],
+            'ingredient': ids['Ingredient'][ingredient],
+            'props': props
+        }
+        for recipe, ingredient, props in edges]
+    for chunk in chunks(rows, batch_size):
+        graph.run(query, rows=chunk)
+
+    # Lets the API drop responses cached for whatever was served before
+    graph.run("""
+    MERGE (m:GraphMeta {name: 'graph'})
+    SET m.version = coalesce(m.version, 0) + 1, m.updatedAt = timestamp()
+    """)
+    return sum(len(rows) for rows in nodes.values()), len(edges)
+
+
+def diff_snapshots(old_path, new_path):
+    """
+    Returns the uids of the nodes added and removed by label, and the
+    (recipe uid, ingredient uid) CONTAINS edges added and removed.
+    """
+    def keys(path):
+        nodes, edges = read_snapshot(path)
+        uids = {label: [props.get('uid') for props in rows]
+                for label, rows in nodes.items()}
+        pairs = {(uids['Recipe'][recipe], uids['Ingredient'][ingredient])
+                 for recipe, ingredient, _ in edges}
+        return {label: set(values) for label, values in uids.items()}, pairs
+
+    old_nodes, old_edges = keys(old_path)
+    new_nodes, new_edges = keys(new_path)
+    changes = {
+        label: (new_nodes[label] - old_nodes[label],
+                old_nodes[label] - new_nodes[label])
+        for label, _, _ in NODES}
+    changes['CONTAINS'] = (new_edges - old_edges, old_edges - new_edges)
+    return changes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Exports, loads and compares knowledge graph snapshots")
+    commands = parser.add_subparsers(dest='command', required=True)
+    export = commands.add_parser(
+        'export', help="write the graph to a snapshot file")
+    export.add_argument('path')
+    load = commands.add_parser(
+        'load', help="load a snapshot into an empty database")
+    load.add_argument('path')
+    load.add_argument('--batch-size', type=int, default=1000)
+    diff = commands.add_parser(
+        'diff', help="list the nodes and edges two snapshots differ by")
+    diff.add_argument('old')
+    diff.add_argument('new')
+    args = parser.parse_args()
+
+    start = time.time()
+    if args.command == 'diff':
+        for label, (added, removed) in diff_snapshots(
+                args.old, args.new).items():
+            print(f"{label}: {len(added)} added, {len(removed)} removed")
+        print(f"Compared snapshots in {time.time() - start:.2f} seconds")
+    else:
+        load_dotenv()
+        graph = Graph(os.getenv("NEO4J_URI"),
+                      auth=(os.getenv("NEO4J_USER"), os.getenv("NEO4J_PASSWORD")))
+        if args.command == 'export':
+            nodes, edges = export_snapshot(graph, args.path)
+            verb = "Exported"
+        else:
+            nodes, edges = load_snapshot(graph, args.path, args.batch_size)
+            verb = "Loaded"
+        print(
+            f"{verb} {nodes} nodes and {edges} edges in {time.time() - start:.2f} seconds")
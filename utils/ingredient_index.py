@@ -0,0 +1,106 @@
+from collections import defaultdict
+
+import numpy as np
+
+
+def embed(wv, phrase_model, name):
+    """
+    Returns the sum of the unit vectors of the in-vocab phrase tokens of a
+    preprocessed ingredient name, their count and the out-of-vocab tokens.
+    """
+    tokens = phrase_model[name.split()]
+    vector = np.zeros(wv.vector_size, dtype=np.float32)
+    in_vocab = 0
+    oov = defaultdict(int)
+    for token in tokens:
+        if token in wv.key_to_index:
+            vector += wv.get_vector(token, norm=True)
+            in_vocab += 1
+        else:
+            oov[token] += 1
+    return vector, in_vocab, oov
+
+
+class IngredientIndex:
+    '''
+    In-memory dedupe index over the ingredients already in the graph.
+
+    Each ingredient is stored as the sum of the unit vectors of its in-vocab
+    phrase tokens, so the averaged pairwise similarity used by
+    `GraphBuilder.calculate_similarity` reduces to one matrix product:
+
+        (S1 . S2 + E) / (n1 * n2 + E)
+
+    where S is the summed unit vectors, n the number of in-vocab tokens and
+    E the number of identical out-of-vocab token pairs, which score 1.
+    '''
+
+    def __init__(self, wv, phrase_model, preprocess, capacity=1024):
+        self.wv = wv
+        self.phrase_model = phrase_model
+        self.preprocess = preprocess
+        self.nodes = []
+        self.by_name = {}
+        # Raw name word -> positions, used to pick dedupe candidates
+        self.by_word = defaultdict(set)
+        # Out-of-vocab token -> {position: count}
+        self.oov = defaultdict(dict)
+        self.vectors = np.zeros((capacity, wv.vector_size), dtype=np.float32)
+        self.in_vocab = np.zeros(capacity, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def _embed(self, name):
+        return embed(self.wv, self.phrase_model, name)
+
+    def add(self, node):
+        position = len(self.nodes)
+        if position == len(self.vectors):
+            self.vectors = np.resize(
+                self.vectors, (2 * position, self.wv.vector_size))
+            self.in_vocab = np.resize(self.in_vocab, 2 * position)
+
+        name = node['name'].lower()
+        vector, in_vocab, oov = self._embed(self.preprocess(node['name']))
+        self.vectors[position] = vector
+        self.in_vocab[position] = in_vocab
+        for token, count in oov.items():
+            self.oov[token][position] = count
+        for word in set(name.split()):
+            self.by_word[word].add(position)
+
+        self.nodes.append(node)
+        self.by_name.setdefault(name, node)
+
+    def exact(self, normalized_name):
+        return self.by_name.get(normalized_name)
+
+    def similar(self, normalized_name):
+        """
+        Returns the ingredients sharing a word with `normalized_name` and
+        their similarity scores.
+        """
+        candidates = set()
+        for word in normalized_name.split():
+            candidates |= self.by_word.get(word, set())
+        if not candidates:
+            return [], np.zeros(0, dtype=np.float32)
+        candidates = np.fromiter(sorted(candidates), dtype=np.int64)
+
+        vector, in_vocab, oov = self._embed(normalized_name)
+        dots = self.vectors[candidates] @ vector
+
+        slots = {position: slot for slot, position in enumerate(candidates)}
+        equal = np.zeros(len(candidates), dtype=np.float32)
+        for token, count in oov.items():
+            for position, other in self.oov.get(token, {}).items():
+                if position in slots:
+                    equal[slots[position]] += count * other
+
+        pairs = in_vocab * self.in_vocab[candidates] + equal
+        scores = np.divide(
+            dots + equal, pairs,
+            out=np.zeros(len(candidates), dtype=np.float32),
+            where=pairs > 0)
+        return [self.nodes[position] for position in candidates], scores
@@ -0,0 +1,122 @@
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import resources
+
+
+class IngredientNormalizer:
+    '''
+    Memoized ingredient name pipeline: raw name -> lowercased, lemmatized
+    name -> phrase tokens. Both steps are kept in bounded LRUs, since a
+    build normalizes the same few thousand names over and over.
+
+    With a `path`, the entries are also saved to a JSON file by `save()` and
+    loaded again by the next run. Phrase tokens are only reused while the
+    phrase model is the one they were computed with.
+    '''
+
+    def __init__(self, path=None, max_size=65536):
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._names = OrderedDict()
+        self._tokens = OrderedDict()
+        self._dirty = False
+        self._lock = threading.Lock()
+        self.phrase_version = resources.phrase_model_version()
+        if path:
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as file:
+                saved = json.load(file)
+        except (OSError, ValueError):
+            return
+        for name, normalized in saved.get('names', {}).items():
+            self._put(self._names, name, normalized)
+        if saved.get('phrase_version') == self.phrase_version:
+            for name, tokens in saved.get('tokens', {}).items():
+                self._put(self._tokens, name, tuple(tokens))
+        self._dirty = False
+
+    def save(self):
+        """
+        Writes the cached entries to `path`, if any changed since the last
+        save.
+        """
+        if not self.path or not self._dirty:
+            return
+        with self._lock:
+            saved = {
+                'phrase_version': self.phrase_version,
+                'names': dict(self._names),
+                'tokens': {
+                    name: list(tokens) for name, tokens in self._tokens.items()}
+            }
+            self._dirty = False
+        directory = os.path.dirname(os.path.abspath(self.path))
+        # Write to a temporary file first so a crash never leaves half a cache
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'w') as file:
+            json.dump(saved, file)
+        os.replace(tmp, self.path)
+
+    def refresh(self):
+        """
+        Forgets the phrase tokens if the phrase model changed since they were
+        computed.
+        """
+        version = resources.phrase_model_version()
+        if version != self.phrase_version:
+            with self._lock:
+                self._tokens.clear()
+                self.phrase_version = version
+                self._dirty = True
+
+    def _get(self, entries, key):
+        with self._lock:
+            value = entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def _put(self, entries, key, value):
+        with self._lock:
+            entries[key] = value
+            entries.move_to_end(key)
+            while len(entries) > self.max_size:
+                entries.popitem(last=False)
+            self._dirty = True
+
+    def normalize(self, name):
+        """
+        Returns the lowercased name with each word lemmatized to its base
+        form.
+        """
+        name = name.lower()
+        normalized = self._get(self._names, name)
+        if normalized is None:
+            lemmatizer = resources.lemmatizer.get()
+            normalized = ' '.join(
+                lemmatizer.lemmatize(token) for token in name.split(' '))
+            self._put(self._names, name, normalized)
+        return normalized
+
+    def tokens(self, normalized_name):
+        """
+        Returns the phrase tokens of an already normalized name.
+        """
+        tokens = self._get(self._tokens, normalized_name)
+        if tokens is None:
+            phrase_model = resources.phrase_model.get()
+            tokens = tuple(phrase_model[normalized_name.split()])
+            self._put(self._tokens, normalized_name, tokens)
+        return tokens
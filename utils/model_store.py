@@ -0,0 +1,143 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+# Artifact files of one model version
+WORD2VEC_FILE = 'phrases_ingredient_word2vec.model'
+PHRASER_FILE = 'phrase_model.txt'
+# Unfrozen phrase statistics, which incremental updates extend
+PHRASES_FILE = 'phrases.model'
+MANIFEST_FILE = 'manifest.json'
+
+
+def tokenize(text):
+    return text.lower().replace(',', '').split()
+
+
+class ModelStore:
+    '''
+    Directory of versioned Word2Vec/Phraser artifacts:
+
+        <directory>/v<N>/<artifacts and manifest.json>
+        <directory>/CURRENT    the version builders should load
+
+    A version is written under a temporary name and renamed into place
+    before CURRENT is switched to it, so readers only ever see complete
+    versions. Older versions are kept a while for processes still mapping
+    them.
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _current_path(self):
+        return os.path.join(self.directory, 'CURRENT')
+
+    def versions(self):
+        return sorted(
+            int(name[1:]) for name in os.listdir(self.directory)
+            if name.startswith('v') and name[1:].isdigit())
+
+    def current(self):
+        """
+        Returns the published version, or None if nothing was published.
+        """
+        try:
+            with open(self._current_path(), 'r') as file:
+                return int(file.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    def path(self, version, name):
+        return os.path.join(self.directory, f'v{version}', name)
+
+    def manifest(self, version):
+        with open(self.path(version, MANIFEST_FILE), 'r') as file:
+            return json.load(file)
+
+    def publish(self, word2vec, phraser, phrases=None, keep=3, **manifest):
+        """
+        Saves the models as a new version, makes it current and drops all
+        but the newest `keep` versions. Extra keyword arguments are stored
+        in the version's manifest. Returns the new version.
+        """
+        versions = self.versions()
+        version = versions[-1] + 1 if versions else 1
+        staging = tempfile.mkdtemp(dir=self.directory, prefix='.staging-')
+        word2vec.save(os.path.join(staging, WORD2VEC_FILE))
+        phraser.save(os.path.join(staging, PHRASER_FILE))
+        if phrases is not None:
+            phrases.save(os.path.join(staging, PHRASES_FILE))
+        manifest = dict(
+            manifest, version=version, parent=self.current(),
+            created=time.time())
+        with open(os.path.join(staging, MANIFEST_FILE), 'w') as file:
+            json.dump(manifest, file)
+        os.rename(staging, os.path.join(self.directory, f'v{version}'))
+
+        fd, tmp = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'w') as file:
+            file.write(str(version))
+        os.replace(tmp, self._current_path())
+
+        for old in self.versions()[:-keep]:
+            shutil.rmtree(
+                os.path.join(self.directory, f'v{old}'), ignore_errors=True)
+        return version
+
+
+class IngestLog:
+    '''
+    Append-only LineSentence file of the text of newly ingested recipes,
+    one tokenized sentence per line. Incremental training reads it from the
+    byte offset the previous version stopped at.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def add(self, texts):
+        tokens = [token for text in texts for token in tokenize(text)]
+        if tokens:
+            with self._lock:
+                self._pending.append(' '.join(tokens))
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if pending:
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.write('\n'.join(pending) + '\n')
+
+    def size(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def read(self, offset=0):
+        """
+        Returns the sentences logged after byte `offset` and the offset to
+        continue from next time.
+        """
+        sentences = []
+        try:
+            with open(self.path, 'rb') as file:
+                file.seek(offset)
+                for line in file:
+                    # A line still being appended is left for next time
+                    if not line.endswith(b'\n'):
+                        break
+                    offset += len(line)
+                    tokens = line.decode('utf-8').split()
+                    if tokens:
+                        sentences.append(tokens)
+        except OSError:
+            pass
+        return sentences, offset
@@ -0,0 +1,90 @@
+import threading
+import zlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, zip_longest
+from urllib.parse import urlparse
+
+from recipe_scrapers import scrape_me
+
+
+class SharedDomainSlots:
+    '''
+    Per-domain slots shared by every process of a parallel build, so the
+    `per_domain` cap holds across processes instead of per process. Domains
+    are hashed onto a fixed number of semaphores held by a
+    multiprocessing manager; domains that land on the same semaphore share
+    its cap, which only makes the build more polite.
+    '''
+
+    def __init__(self, manager, per_domain, size=64):
+        self.slots = [
+            manager.BoundedSemaphore(per_domain) for _ in range(size)]
+
+    def __getitem__(self, domain):
+        # A stable hash, so every process picks the same slot for a domain
+        return self.slots[zlib.crc32(domain.encode('utf-8')) % len(self.slots)]
+
+
+class RecipeScraper:
+    '''
+    Scrapes recipe pages on a thread pool so the builder can fetch pages
+    ahead of its graph writes. At most `per_domain` pages are fetched from
+    one site at a time, and each fetch gives up after `timeout` seconds.
+    Pages are read from and stored in `cache` when one is given. Pass
+    SharedDomainSlots as `domain_slots` to share the cap between processes.
+    '''
+
+    def __init__(self, max_workers=8, per_domain=2, timeout=10, cache=None,
+                 domain_slots=None):
+        self.timeout = timeout
+        self.cache = cache
+        self.per_domain = per_domain
+        self.pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='scraper')
+        self._domains = domain_slots if domain_slots is not None else \
+            defaultdict(lambda: threading.BoundedSemaphore(self.per_domain))
+        self._domains_lock = threading.Lock()
+
+    def _domain_slot(self, url):
+        with self._domains_lock:
+            return self._domains[urlparse(url).netloc]
+
+    def scrape(self, url):
+        """
+        Returns the instructions and total time of a recipe page, or None
+        when the page cannot be scraped.
+        """
+        if self.cache is None:
+            return self._scrape(url)
+        # Failed scrapes are cached too, so replays drop the same recipes,
+        # but only for the cache's negative TTL when online
+        return self.cache.fetch('page', url, lambda: self._scrape(url))
+
+    def _scrape(self, url):
+        with self._domain_slot(url):
+            try:
+                scraper = scrape_me(url, wild_mode=True, timeout=self.timeout)
+                return {
+                    'instructions': scraper.instructions_list(),
+                    'totalTime': scraper.total_time()
+                }
+            except:
+                return None
+
+    def prefetch(self, urls):
+        """
+        Starts scraping every url and returns a dict of url -> Future.
+        """
+        by_domain = defaultdict(list)
+        for url in dict.fromkeys(urls):
+            by_domain[urlparse(url).netloc].append(url)
+
+        # Interleave domains so one slow site does not hold up the pool
+        ordered = [
+            url for url in chain.from_iterable(
+                zip_longest(*by_domain.values())) if url]
+        return {url: self.pool.submit(self.scrape, url) for url in ordered}
+
+    def close(self):
+        self.pool.shutdown(wait=False)
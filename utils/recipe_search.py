@@ -0,0 +1,59 @@
+import os
+
+import requests
+from dotenv import load_dotenv
+
+load_dotenv()
+APP_ID = os.getenv("EDAMAM_APP_ID")
+APP_KEY = os.getenv("EDAMAM_APP_KEY")
+BASE_URL = os.getenv("EDAMAM_BASE_URL")
+
+
+class RecipeSearch:
+    '''
+    Edamam recipe searches, read from and stored in `cache` when one is
+    given. Holds no graph connection, so build worker processes can run
+    searches on their own.
+    '''
+
+    def __init__(self, cache=None):
+        self.cache = cache
+
+    def search(self, params, sequence=False, occurrence=None):
+        endpoint = f'{BASE_URL}/'
+
+        def fetch():
+            response = requests.get(
+                endpoint,
+                params=dict(params, app_id=APP_ID, app_key=APP_KEY))
+            response.raise_for_status()
+            data = response.json()
+
+            return data.get('hits', [])
+
+        try:
+            if self.cache is None:
+                return fetch()
+            # Credentials are left out of the cache key
+            return self.cache.fetch(
+                'edamam', params, fetch, default=[], sequence=sequence,
+                occurrence=occurrence)
+        except requests.RequestException as e:
+            print(f"Recipe search failed for {params}: {e}")
+            return []
+
+    def by_ingredient(self, ingredient):
+        params = {
+            'type': 'public',
+            'q': ingredient
+        }
+        return self.search(params)
+
+    def by_cuisine(self, cuisine, occurrence=None):
+        params = {
+            'type': 'public',
+            'cuisineType': cuisine,
+            'random': 'true'
+        }
+        # Random searches are cached per call so replays see the same series
+        return self.search(params, sequence=True, occurrence=occurrence)
@@ -0,0 +1,149 @@
+import os
+import threading
+import time
+
+import model_store
+
+# Default model files, relative to the working directory like the scripts
+# expect. GRAPH_BUILDER_WORD2VEC_MODEL and GRAPH_BUILDER_PHRASE_MODEL
+# override them, and with GRAPH_BUILDER_MODEL_DIR the current version of a
+# ModelStore is used instead. Read when the model is loaded so .env files
+# apply.
+WORD2VEC_PATH = "phrases_ingredient_word2vec.model"
+PHRASE_MODEL_PATH = "phrase_model.txt"
+
+# Store version the loaded models come from, when using a model directory
+loaded_version = None
+
+
+class LazyResource:
+    '''
+    A model that is loaded by `load` the first time it is used and then
+    shared by every caller in the process. Loading is thread safe and its
+    duration is reported, so a run shows what it paid for at startup.
+    '''
+
+    def __init__(self, name, load):
+        self.name = name
+        self._load = load
+        self._value = None
+        self.loaded = False
+        self.load_seconds = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if not self.loaded:
+            with self._lock:
+                # Another thread may have loaded it while we waited
+                if not self.loaded:
+                    start = time.time()
+                    self._value = self._load()
+                    self.load_seconds = time.time() - start
+                    self.loaded = True
+                    print(
+                        f"Loaded {self.name} in {self.load_seconds:.2f} seconds")
+        return self._value
+
+    def set(self, value):
+        """
+        Uses an already loaded model, e.g. a freshly trained one.
+        """
+        with self._lock:
+            self._value = value
+            self.loaded = True
+
+    def reset(self):
+        with self._lock:
+            self._value = None
+            self.loaded = False
+
+
+def get_model_store():
+    directory = os.getenv("GRAPH_BUILDER_MODEL_DIR")
+    return model_store.ModelStore(directory) if directory else None
+
+
+def _store_path(store, name):
+    global loaded_version
+    if loaded_version is None:
+        loaded_version = store.current()
+        if loaded_version is None:
+            raise RuntimeError(f"No model version published in {store.directory}")
+    return store.path(loaded_version, name)
+
+
+def word2vec_path():
+    store = get_model_store()
+    if store is not None:
+        return _store_path(store, model_store.WORD2VEC_FILE)
+    return os.getenv("GRAPH_BUILDER_WORD2VEC_MODEL", WORD2VEC_PATH)
+
+
+def load_word2vec(path=None, mmap='r'):
+    """
+    Loads the Word2Vec model. With `mmap='r'` its arrays are memory mapped
+    read-only, so processes share them through the page cache; pass
+    `mmap=None` to load a copy that can be trained further.
+    """
+    from gensim.models import Word2Vec
+
+    return Word2Vec.load(path or word2vec_path(), mmap=mmap)
+
+
+def phrase_model_path():
+    store = get_model_store()
+    if store is not None:
+        return _store_path(store, model_store.PHRASER_FILE)
+    return os.getenv("GRAPH_BUILDER_PHRASE_MODEL", PHRASE_MODEL_PATH)
+
+
+def phrase_model_version():
+    """
+    Identifies the phrase model file by path and modification time, so
+    caches of its output can tell when it was retrained. None if missing.
+    """
+    try:
+        path = phrase_model_path()
+    except RuntimeError:
+        return None
+    try:
+        return f"{os.path.abspath(path)}:{os.path.getmtime(path)}"
+    except OSError:
+        return None
+
+
+def load_phrase_model(path=None):
+    from gensim.models.phrases import Phraser
+
+    return Phraser.load(path or phrase_model_path())
+
+
+def load_lemmatizer():
+    from nltk.stem import WordNetLemmatizer
+
+    return WordNetLemmatizer()
+
+
+word2vec = LazyResource("Word2Vec model", load_word2vec)
+phrase_model = LazyResource("Phraser", load_phrase_model)
+lemmatizer = LazyResource("WordNet lemmatizer", load_lemmatizer)
+
+
+def refresh_models():
+    """
+    Switches to the newest version published in the model directory, if it
+    is newer than the loaded models, which are then reloaded on next use.
+    Returns whether the version changed.
+    """
+    global loaded_version
+    store = get_model_store()
+    if store is None:
+        return False
+    version = store.current()
+    if version is None or version == loaded_version:
+        return False
+    loaded_version = version
+    word2vec.reset()
+    phrase_model.reset()
+    print(f"Switched to model version {version}")
+    return True
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+
+class ResponseCache:
+    '''
+    Content-addressed on-disk cache for Edamam responses and scraped recipe
+    pages. Entries live in `<directory>/<key[:2]>/<key>.json`, expire after
+    `ttl` seconds and the least recently read entries are evicted once the
+    cache grows past `max_bytes`. Failures, stored as None, expire after
+    `negative_ttl` seconds instead, so they are retried on a later run.
+
+    In offline mode nothing expires and misses are never fetched, so a
+    build replays exactly what earlier runs stored.
+    '''
+
+    def __init__(self, directory, ttl=7 * 24 * 3600,
+                 max_bytes=512 * 1024 * 1024, offline=False,
+                 negative_ttl=3600):
+        self.directory = directory
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self._occurrences = defaultdict(int)
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(size for _, size, _ in self._entries())
+
+    def _key(self, namespace, request):
+        payload = json.dumps([namespace, request], sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.json'):
+                    path = os.path.join(root, name)
+                    stat = os.stat(path)
+                    yield path, stat.st_size, stat.st_mtime
+
+    def _read(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'r') as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return False, None
+        ttl = self.negative_ttl if entry['value'] is None else self.ttl
+        if not self.offline and time.time() - entry['created'] > ttl:
+            return False, None
+        # Reads refresh the mtime, which orders eviction
+        os.utime(path)
+        return True, entry['value']
+
+    def _write(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so readers never see partial entries
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'w') as file:
+            json.dump({'created': time.time(), 'value': value}, file)
+        size = os.path.getsize(tmp)
+
+        with self._lock:
+            # Expired entries are overwritten in place
+            try:
+                self._size -= os.path.getsize(path)
+            except OSError:
+                pass
+            os.replace(tmp, path)
+            self._size += size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Drop the least recently read entries down to 90% of the budget
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        self._size = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if self._size <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._size -= size
+
+    def fetch(self, namespace, request, producer, default=None,
+              sequence=False, occurrence=None):
+        """
+        Returns the cached value for `request`, calling `producer` to fill
+        the cache on a miss. With `sequence`, repeated identical requests
+        are stored as separate entries, so replaying a run sees the same
+        series of responses, e.g. for random searches. The entry is picked
+        by `occurrence` when given, otherwise by counting calls in this
+        process.
+        """
+        if sequence and occurrence is not None:
+            request = [request, occurrence]
+        elif sequence:
+            counter = (namespace, json.dumps(request, sort_keys=True))
+            with self._lock:
+                occurrence = self._occurrences[counter]
+                self._occurrences[counter] += 1
+            request = [request, occurrence]
+
+        key = self._key(namespace, request)
+        found, value = self._read(key)
+        if found:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        if self.offline:
+            return default
+        value = producer()
+        self._write(key, value)
+        return value
@@ -0,0 +1,106 @@
+import hashlib
+
+from py2neo.errors import ClientError
+
+from bulk_writer import chunks
+
+# (name, label, property) of the uniqueness constraints. Each one is backed
+# by an index, so lookups on these properties are no longer label scans.
+CONSTRAINTS = [
+    ('ingredient_key', 'Ingredient', 'key'),
+    ('ingredient_uid', 'Ingredient', 'uid'),
+    ('recipe_uid', 'Recipe', 'uid'),
+    ('recipe_name', 'Recipe', 'name'),
+    ('recipe_url', 'Recipe', 'url'),
+    ('user_api_key', 'User', 'api_key'),
+    ('graph_meta_name', 'GraphMeta', 'name'),
+]
+
+
+def uid(kind, key):
+    """
+    Stable external id of a node, derived from its natural key so that it
+    survives rebuilds, unlike Neo4j's internal ids.
+    """
+    return hashlib.sha1(f"{kind}:{key}".encode('utf-8')).hexdigest()[:16]
+
+
+def ingredient_properties(key):
+    return {'key': key, 'uid': uid('ingredient', key)}
+
+
+def recipe_properties(url):
+    return {'uid': uid('recipe', url)}
+
+
+# Raised for a constraint that already exists under another name, which
+# guarantees the same uniqueness
+EXISTING_CONSTRAINT = {
+    'EquivalentSchemaRuleAlreadyExists',
+    'ConstraintAlreadyExists',
+}
+
+
+def create_constraints(graph):
+    """
+    Creates the uniqueness constraints. Any failure other than an existing
+    equivalent constraint is raised, since writes merge on these properties
+    and rely on them being unique.
+    """
+    for name, label, property in CONSTRAINTS:
+        query = f"""
+        CREATE CONSTRAINT {name} IF NOT EXISTS
+        FOR (n:{label}) REQUIRE n.{property} IS UNIQUE
+        """
+        try:
+            graph.run(query)
+        except ClientError as e:
+            if e.title not in EXISTING_CONSTRAINT:
+                raise
+            print(f"Constraint {name} already exists: {e}")
+
+
+def check_unique(graph, label, property, examples=5):
+    """
+    Raises a RuntimeError naming some of the `property` values shared by
+    several `label` nodes, if there are any.
+    """
+    query = f"""
+    MATCH (n:{label}) WHERE n.{property} IS NOT NULL
+    WITH n.{property} AS value, count(n) AS nodes WHERE nodes > 1
+    RETURN value, nodes AS duplicates ORDER BY duplicates DESC
+    """
+    duplicates = graph.run(query).data()
+    if duplicates:
+        shown = ', '.join(
+            f"{record['value']!r} ({record['duplicates']} nodes)"
+            for record in duplicates[:examples])
+        raise RuntimeError(
+            f"{len(duplicates)} {label}.{property} values are shared by "
+            f"several nodes, e.g. {shown}. Merge the duplicate nodes before "
+            f"building, so the uniqueness constraint can be created")
+
+
+def backfill(graph, label, missing, compute, batch_size=500):
+    """
+    Sets the properties returned by `compute(properties)` on every `label`
+    node where the `missing` property is null. Returns the number of nodes
+    updated. Raises a RuntimeError if nodes end up sharing a `missing`
+    value, e.g. legacy ingredients whose names normalize to the same key.
+    """
+    query = f"""
+    MATCH (n:{label}) WHERE n.{missing} IS NULL
+    RETURN ID(n) AS id, properties(n) AS props
+    """
+    rows = [{'id': record['id'], 'props': compute(record['props'])}
+            for record in graph.run(query).data()]
+
+    update = """
+    UNWIND $rows AS row
+    MATCH (n) WHERE ID(n) = row.id
+    SET n += row.props
+    """
+    for chunk in chunks(rows, batch_size):
+        graph.run(update, rows=chunk)
+    check_unique(graph, label, missing)
+    return len(rows)
@@ -1,22 +1,21 @@
-from gensim.models import Word2Vec
-import spacy
-from nltk.stem import WordNetLemmatizer
-from gensim.models.phrases import Phrases, Phraser
+import os
+import sys
 
-nlp = spacy.load("en_core_web_sm", exclude=["textcat"])
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import resources  # noqa: E402
+from ingredient_normalizer import IngredientNormalizer  # noqa: E402
 
-# Load the trained Word2Vec model
-model = Word2Vec.load("phrases_ingredient_word2vec.model")
-phrase_model = Phraser.load("phrase_model.txt")
+# Same memoized pipeline as the graph builder
+normalizer = IngredientNormalizer()
 
 
 def get_similarity_score(word1, word2):
     # Tokenize the input words and generate phrases
-    tokens_word1 = word1.split()
-    tokens_word2 = word2.split()
+    tokens_word1 = normalizer.tokens(word1)
+    tokens_word2 = normalizer.tokens(word2)
 
-    tokens_word1 = phrase_model[tokens_word1]
-    tokens_word2 = phrase_model[tokens_word2]
+    # The trained model is loaded on first use
+    model = resources.word2vec.get()
 
     similarity_scores = []
 
@@ -37,66 +36,61 @@ def get_similarity_score(word1, word2):
 
 
 def preprocess_ingredient(ingredient):
-    # Normalize case
-    ingredient = ingredient.lower()
+    # Lowercase and lemmatize to reduce words to their base form
+    return normalizer.normalize(ingredient)
 
-    # Lemmatize to reduce words to their base form
-    lemmatizer = WordNetLemmatizer()
-    lemmatized = [lemmatizer.lemmatize(token)
-                  for token in ingredient.split(' ')]
-    return ' '.join(lemmatized)
 
+if __name__ == "__main__":
+    # Main test
+    # Example of word similarity evaluation
+    word_pairs = [
+        ("salt", "sea salt"),
+        ("light soy sauce", "fish sauce"),
+        ("light soy sauce", "soy sauce"),
+        ("chicken breast", "chicken thigh"),
+        ("reduced-sodium soy sauce", "soy sauce"),
+        ("low-sodium soy sauce", "soy sauce"),
+        # ("tomato", "tomato sauce"),
+        # ("tomato", "tomato paste"),
+        # ("tomato", "tomato ketchup"),
+        # ("tomato", "tomato juice"),
+        # ("tomato", "tomato puree"),
+        # ("diced tomatoes", "tomato soup"),
+        # ("tomato sauce ", "tomato paste"),
+        # ("dried oregano", "fresh oregano"),
+        # ("chicken broth", "chicken stock"),
+        # ("ground beef", "ground turkey"),
+        # ("whole milk", "skim milk"),
+        # ("olive oil", "vegetable oil"),
+        # ("white sugar", "brown sugar"),
+        # ("all-purpose flour", "whole wheat flour"),
+        # ("parmesan cheese", "pecorino romano cheese"),
+        # ("white rice", "brown rice"),
+        # ("lemon juice", "lime juice"),
+        # ("honey", "maple syrup"),
+        # ("cilantro", "parsley"),
+        # ("red onion", "yellow onion"),
+        # ("bell pepper", "jalapeno pepper"),
+        # ("dark chocolate", "milk chocolate"),
+        # ("basil leaves", "mint leaves"),
+        # ("ground cinnamon", "ground nutmeg"),
+        # ("ground black pepper", "white pepper"),
+        # ("balsamic vinegar", "red wine vinegar"),
+        # ("chicken sausage", "pork sausage"),
+        # ("baby spinach", "arugula"),
+        # ("cottage cheese", "ricotta cheese")
+    ]
 
-# Main test
-# Example of word similarity evaluation
-word_pairs = [
-    ("salt", "sea salt"),
-    ("light soy sauce", "fish sauce"),
-    ("light soy sauce", "soy sauce"),
-    ("chicken breast", "chicken thigh"),
-    ("reduced-sodium soy sauce", "soy sauce"),
-    ("low-sodium soy sauce", "soy sauce"),
-    # ("tomato", "tomato sauce"),
-    # ("tomato", "tomato paste"),
-    # ("tomato", "tomato ketchup"),
-    # ("tomato", "tomato juice"),
-    # ("tomato", "tomato puree"),
-    # ("diced tomatoes", "tomato soup"),
-    # ("tomato sauce ", "tomato paste"),
-    # ("dried oregano", "fresh oregano"),
-    # ("chicken broth", "chicken stock"),
-    # ("ground beef", "ground turkey"),
-    # ("whole milk", "skim milk"),
-    # ("olive oil", "vegetable oil"),
-    # ("white sugar", "brown sugar"),
-    # ("all-purpose flour", "whole wheat flour"),
-    # ("parmesan cheese", "pecorino romano cheese"),
-    # ("white rice", "brown rice"),
-    # ("lemon juice", "lime juice"),
-    # ("honey", "maple syrup"),
-    # ("cilantro", "parsley"),
-    # ("red onion", "yellow onion"),
-    # ("bell pepper", "jalapeno pepper"),
-    # ("dark chocolate", "milk chocolate"),
-    # ("basil leaves", "mint leaves"),
-    # ("ground cinnamon", "ground nutmeg"),
-    # ("ground black pepper", "white pepper"),
-    # ("balsamic vinegar", "red wine vinegar"),
-    # ("chicken sausage", "pork sausage"),
-    # ("baby spinach", "arugula"),
-    # ("cottage cheese", "ricotta cheese")
-]
+    averages = []
 
-averages = []
+    for word1, word2 in word_pairs:
+        word1 = preprocess_ingredient(word1)
+        word2 = preprocess_ingredient(word2)
+        similarity = get_similarity_score(word1, word2)
+        averages.append((word1, word2, similarity))
 
-for word1, word2 in word_pairs:
-    word1 = preprocess_ingredient(word1)
-    word2 = preprocess_ingredient(word2)
-    similarity = get_similarity_score(word1, word2)
-    averages.append((word1, word2, similarity))
-
-# Print the similarity scores
-averages.sort(key=lambda x: x[2], reverse=True)
-for word1, word2, similarity in averages:
-    print(
-        f"Similarity score between '{word1}' and '{word2}': {similarity}")
+    # Print the similarity scores
+    averages.sort(key=lambda x: x[2], reverse=True)
+    for word1, word2, similarity in averages:
+        print(
+            f"Similarity score between '{word1}' and '{word2}': {similarity}")
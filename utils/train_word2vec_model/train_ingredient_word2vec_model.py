@@ -1,126 +1,201 @@
+import argparse
 import json
-import pickle
+import os
+import sys
+import tempfile
+import time
+from itertools import chain
+
 from gensim.models import Word2Vec
 from gensim.models.phrases import Phrases, Phraser, ENGLISH_CONNECTOR_WORDS
-import time
-import os
-from nltk import WordNetLemmatizer
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from model_store import (PHRASES_FILE, WORD2VEC_FILE,  # noqa: E402
+                         IngestLog, ModelStore, tokenize)
 print("Done importing necessary libraries")
 
-############### Generating Dataset for Word2Vec Training ###############
+FDC_PATH = 'train_data/FoodData_Central_sr_legacy_food_json_2021-10-28.json'
+USDA_PATH = 'train_data/usda_food_items.txt'
+RECIPES_PATH = 'train_data/recipes.json'
+CORPUS_PATH = 'tokenized_phrases.txt'
 
+############### Generating Dataset for Word2Vec Training ###############
 
-def generate_training_data():
-    start = time.time()
 
-    # Read the JSON file
-    file_path = 'train_data/FoodData_Central_sr_legacy_food_json_2021-10-28.json'
-    with open(file_path, 'r') as file:
+def json_items(file_path, prefix):
+    """
+    Yields the items of the array at `prefix` of a JSON file. They are
+    parsed one at a time with ijson when it is installed, otherwise the
+    file is loaded whole, one source at a time.
+    """
+    with open(file_path, 'rb') as file:
+        if ijson is not None:
+            yield from ijson.items(file, f'{prefix}.item' if prefix else 'item')
+            return
         data = json.load(file)
+    yield from (data[prefix] if prefix else data)
 
-    # Access the "FoundationFoods" key in the JSON data
-    foundation_foods = data["SRLegacyFoods"]
 
-    # Extract the ingredient names
-    tokenized_ingredients_from_FDC = [
-        food["description"].lower().replace(',', '').split()
-        for food in foundation_foods]
+def fdc_sentences(file_path=FDC_PATH):
+    for food in json_items(file_path, 'SRLegacyFoods'):
+        yield tokenize(food["description"])
 
-    print(
-        f"Extracted dataset of length: {len(tokenized_ingredients_from_FDC)}")
-
-    # Read the text file
-    file_path = 'train_data/usda_food_items.txt'
 
-    # Read the content of the file
+def usda_sentences(file_path=USDA_PATH):
     with open(file_path, 'r') as file:
-        lines = file.readlines()
+        for line in file:
+            yield tokenize(line.strip().split('~^~')[2])
 
-    # Extract ingredient names from each line
-    tokenized_ingredients_from_usda = [
-        line.strip().split('~^~')[2].lower().replace(',', '').split()
-        for line in lines]
 
-    print(
-        f"Extracted dataset of length: {len(tokenized_ingredients_from_usda)}")
+def recipe_sentences(file_path=RECIPES_PATH):
+    # One sentence per recipe: its steps followed by its ingredients
+    for recipe in json_items(file_path, None):
+        yield [token
+               for text in chain(recipe["steps"], recipe["ingredients"])
+               for token in tokenize(text)]
 
-    # Read the json file
-    file_path = 'train_data/recipes.json'
 
-    with open(file_path, 'r') as file:
-        data = json.load(file)
+class Corpus:
+    '''
+    Restartable stream of the tokenized sentences of every source, so
+    Phrases can scan it without the whole dataset in memory.
+    '''
 
-    # Extract the steps and ingredients from the JSON data
-    all_steps = [recipe["steps"] for recipe in data]
-    all_ingredients = [recipe["ingredients"] for recipe in data]
-    tokenized_ingredients_from_kaggle = []
-
-    for recipe_steps, recipe_ingredients in zip(
-            all_steps, all_ingredients):
-        tokenized_steps = [step.lower().replace(',', '').split()
-                           for step in recipe_steps]
-        tokenized_steps = [item
-                           for sublist in tokenized_steps for item in
-                           sublist]
-        tokenized_ingredients = [
-            ingredient.lower().replace(',', '').split()
-            for ingredient in recipe_ingredients]
-        tokenized_ingredients = [item
-                                 for sublist in tokenized_ingredients
-                                 for item in sublist]
-
-        tokenized_ingredients_from_kaggle.append(
-            tokenized_steps + tokenized_ingredients)
-
-    # Combine the two lists of tokenized ingredients
-    print(
-        f"Extracted dataset of length: {len(tokenized_ingredients_from_kaggle)}")
+    def __init__(self, *sources):
+        self.sources = sources
 
-    # Combine the lists of tokenized ingredients
-    tokens = tokenized_ingredients_from_FDC + \
-        tokenized_ingredients_from_usda + tokenized_ingredients_from_kaggle
-    print(f"Generated net dataset of length: {len(tokens)}")
+    def __iter__(self):
+        for source in self.sources:
+            yield from source()
 
-    def build_phrases(sentences):
-        phrases = Phrases(sentences,
-                          min_count=1,
-                          threshold=2,
-                          progress_per=1000,
-                          connector_words=ENGLISH_CONNECTOR_WORDS
-                          )
-        return Phraser(phrases)
 
-    # Apply the phrases to the data
-    phrase_model = build_phrases(tokens)
+def build_phrases(sentences):
+    return Phrases(sentences,
+                   min_count=1,
+                   threshold=2,
+                   progress_per=1000,
+                   connector_words=ENGLISH_CONNECTOR_WORDS
+                   )
 
-    phrase_model.save("phrase_model.txt")
 
-    # Apply the phrases to your tokens
-    tokenized_phrases = phrase_model[tokens]
-
-    with open('tokenized_phrases.pkl', 'wb') as f:
-        pickle.dump(tokenized_phrases, f)
+def generate_training_data(corpus_path=CORPUS_PATH):
+    """
+    Learns the phrase model over the sources, then streams them through it
+    into a LineSentence corpus file: one sentence per line, space separated
+    tokens.
+    """
+    start = time.time()
+    corpus = Corpus(fdc_sentences, usda_sentences, recipe_sentences)
 
+    phrases = build_phrases(corpus)
+    # The unfrozen statistics are what incremental updates extend
+    phrases.save(PHRASES_FILE)
+    phrase_model = Phraser(phrases)
+    phrase_model.save("phrase_model.txt")
+    print("Done building phrases in ", time.time() - start, "seconds")
+
+    # Write to a temporary file first so an interrupted run is not reused
+    sentences = 0
+    fd, tmp = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(corpus_path)))
+    with os.fdopen(fd, 'w', encoding='utf-8') as file:
+        for sentence in corpus:
+            phrased = phrase_model[sentence]
+            if phrased:
+                file.write(' '.join(phrased) + '\n')
+                sentences += 1
+    os.replace(tmp, corpus_path)
+
+    print(f"Generated net dataset of length: {sentences}")
     print("Done generating training dataset in ",
           time.time() - start, "seconds")
 
 
+def update_models(store, ingest_log):
+    """
+    Continues training the current version in `store` on the sentences
+    logged since it was published: new phrases and words are added to the
+    vocabulary and only the new sentences are trained on. Publishes the
+    result as a new version, or returns None if nothing was logged.
+    """
+    start = time.time()
+    version = store.current()
+    if version is None:
+        raise RuntimeError(f"No model version published in {store.directory}")
+    offset = store.manifest(version).get('log_offset', 0)
+    sentences, end = ingest_log.read(offset)
+    if not sentences:
+        print(f"No new sentences since version {version}")
+        return None
+
+    phrases = Phrases.load(store.path(version, PHRASES_FILE))
+    phrases.add_vocab(sentences)
+    phrase_model = Phraser(phrases)
+    phrased = [phrase_model[sentence] for sentence in sentences]
+
+    # Not memory mapped, since training writes to the vectors
+    model = Word2Vec.load(store.path(version, WORD2VEC_FILE))
+    known = len(model.wv)
+    model.build_vocab(phrased, update=True)
+    model.train(phrased, total_examples=len(phrased), epochs=model.epochs)
+    print(
+        f"Trained on {len(sentences)} new sentences, "
+        f"{len(model.wv) - known} new words, in {time.time() - start} seconds")
+
+    return store.publish(
+        model, phrase_model, phrases, log_offset=end,
+        sentences=len(sentences), incremental=True)
+
+
 if __name__ == "__main__":
-    if "tokenized_phrases.pkl" not in os.listdir():
+    parser = argparse.ArgumentParser(
+        description="Trains the ingredient Word2Vec and phrase models")
+    parser.add_argument(
+        '--model-dir',
+        help="publish the models as a new version in this ModelStore")
+    parser.add_argument(
+        '--update', action='store_true',
+        help="continue training the current version on the ingest log")
+    parser.add_argument(
+        '--ingest-log', default=os.getenv("GRAPH_BUILDER_INGEST_LOG"),
+        help="sentences logged by graph_builder.py")
+    args = parser.parse_args()
+
+    if args.update:
+        if not args.model_dir or not args.ingest_log:
+            parser.error("--update needs --model-dir and --ingest-log")
+        version = update_models(
+            ModelStore(args.model_dir), IngestLog(args.ingest_log))
+        if version is not None:
+            print(f"Published model version {version}")
+        sys.exit()
+
+    if not os.path.exists(CORPUS_PATH):
         generate_training_data()
-     # Load the tokenized phrases
-    with open('tokenized_phrases.pkl', 'rb') as f:
-        tokenized_phrases = pickle.load(f)
 
     #################### Training the Word2Vec Model #######################
 
     # Time training
     start = time.time()
 
-    model = Word2Vec(sentences=tokenized_phrases, vector_size=200,
-                     window=10, min_count=1, workers=4)
+    # corpus_file mode reads the file in one chunk per worker, so training
+    # scales with the cores instead of a single producer thread
+    model = Word2Vec(corpus_file=CORPUS_PATH, vector_size=200,
+                     window=10, min_count=1, workers=os.cpu_count() or 4)
     print("Done training the Word2Vec model in ",
           time.time() - start, "seconds")
 
     # Save the trained model
     model.save("phrases_ingredient_word2vec.model")
+
+    if args.model_dir:
+        # Everything logged so far is left for the next update
+        version = ModelStore(args.model_dir).publish(
+            model, Phraser.load("phrase_model.txt"),
+            Phrases.load(PHRASES_FILE), log_offset=0, incremental=False)
+        print(f"Published model version {version}")